@@ -0,0 +1,116 @@
+"""HTTP helpers shared by the teacher and student clients.
+
+Both clients talk to the server through one pooled requests session, revalidate
+cached GETs by ETag, group dashboard loads into /batch round trips and read
+Server-Sent Events streams. Ship this file next to teacher.py and student.py.
+"""
+import json
+
+import requests
+
+try:
+    import brotli  # Lets requests decode brotli responses
+except ImportError:
+    brotli = None
+
+# One pooled session for every server call; advertises brotli only when it can be decoded
+http = requests.Session()
+http.headers['Accept-Encoding'] = 'br, gzip' if brotli else 'gzip'
+
+
+def cache_key(path, params=None):
+    return path, tuple(sorted((params or {}).items()))
+
+
+class ApiClient:
+    """Base for TeacherAuth and StudentAuth: ETag-cached GETs and /batch calls.
+
+    Subclasses set server_url and may override auth_headers() and timeout.
+    """
+
+    timeout = None
+
+    def __init__(self, server_url):
+        self.server_url = server_url
+        self.http_cache = {}  # (path, params) -> (etag, body text) for revalidated GETs
+
+    def auth_headers(self):
+        return {}
+
+    def cached_get(self, path, params=None):
+        """GET revalidated by ETag; returns (status_code, json), serving the cached body on a 304"""
+        key = cache_key(path, params)
+        headers = self.auth_headers()
+        if key in self.http_cache:
+            headers['If-None-Match'] = self.http_cache[key][0]
+
+        response = http.get(f"{self.server_url}{path}", params=params, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            # Parse the cached text again so callers never share (and mutate) one copy
+            return 200, json.loads(self.http_cache[key][1])
+
+        if response.status_code == 200 and response.headers.get('ETag'):
+            self.http_cache[key] = (response.headers['ETag'], response.text)
+        return response.status_code, response.json()
+
+    def batch(self, calls):
+        """Run several (method, path, params) calls in one /batch round trip.
+
+        Auth headers are sent once for the whole batch. Returns a list of
+        (status_code, json) in the same order; cached GETs are revalidated like cached_get.
+        """
+        sub_requests = []
+        keys = []
+        for method, path, params in calls:
+            key = cache_key(path, params)
+            sub = {'method': method, 'path': path, 'params': params or {}}
+            if method == 'GET' and key in self.http_cache:
+                sub['headers'] = {'If-None-Match': self.http_cache[key][0]}
+            sub_requests.append(sub)
+            keys.append(key)
+
+        response = http.post(
+            f"{self.server_url}/batch",
+            json={'requests': sub_requests},
+            headers=self.auth_headers(),
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+
+        results = []
+        for (method, _, _), key, sub in zip(calls, keys, response.json()['responses']):
+            if sub['status'] == 304:
+                results.append((200, json.loads(self.http_cache[key][1])))
+                continue
+            if method == 'GET' and sub['status'] == 200 and sub.get('etag'):
+                self.http_cache[key] = (f'"{sub["etag"]}"', json.dumps(sub['body']))
+            results.append((sub['status'], sub['body']))
+        return results
+
+
+def read_events(response):
+    """Parse a text/event-stream response into (event, data, id) tuples.
+
+    Comment-only messages (the server's keep-alives) come out as ('heartbeat', None, None).
+    """
+    event, data, event_id, comment = 'message', [], None, False
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            if line.startswith(':'):
+                comment = True
+            else:
+                field, _, value = line.partition(':')
+                value = value[1:] if value.startswith(' ') else value
+                if field == 'event':
+                    event = value
+                elif field == 'data':
+                    data.append(value)
+                elif field == 'id':
+                    event_id = value
+            continue
+
+        if data:
+            yield event, json.loads('\n'.join(data)), event_id
+        elif comment:
+            yield 'heartbeat', None, None
+        event, data, event_id, comment = 'message', [], None, False
@@ -0,0 +1,368 @@
+"""ASGI entry point serving the hot student endpoints asynchronously.
+
+/student/ping, /student/checkin and /student/get_status are called by every
+logged-in student and each does a couple of short queries. Here they run on the
+event loop against an asyncpg pool, so thousands of concurrent students cost
+coroutines rather than WSGI threads and pooled psycopg2 connections. The same goes
+for /student/stream, which stays open for a student's whole session: served here
+it is a coroutine waiting on a queue instead of a pinned WSGI thread, so it needs
+no STUDENT_STREAM_LIMIT. The queries are the shared *_SQL constants from server.py
+with their placeholders renumbered, and responses, status codes and side effects
+match the Flask handlers (tests/test_asgi_parity.py compares the two). Like the
+Flask routes, these refuse work with a 503 while the server drains and go through
+the same admission classes. Every other route is passed through to the Flask app.
+
+    uvicorn asgi_server:app --host 0.0.0.0 --port 5000
+
+or, pre-forked with the settings in gunicorn.conf.py (as render.yaml deploys it):
+
+    gunicorn -c gunicorn.conf.py -k uvicorn_worker.UvicornWorker asgi_server:app
+
+Flask routes run on a thread pool of GUNICORN_THREADS threads, the same budget
+server.py sizes admission and the teacher stream cap from.
+"""
+import asyncio
+import functools
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import server as sync_server
+from server import ADMISSION_CLASSES, app as flask_app, json_dumps, json_loads, server, sse_event
+
+ASYNC_DB_POOL_SIZE = int(os.getenv('ASYNC_DB_POOL_SIZE', 20))
+WSGI_THREADS = int(os.getenv('WSGI_THREADS', server.WORKER_THREADS))
+
+
+def numbered(query):
+    """Rewrite psycopg2 %s placeholders as asyncpg's $1, $2, ..."""
+    head, *rest = query.split('%s')
+    return head + ''.join(f'${i}{part}' for i, part in enumerate(rest, 1))
+
+
+STUDENT_STATUS_SQL = numbered(sync_server.STUDENT_STATUS_SQL)
+STATUS_CHANGED_SQL = numbered(sync_server.STATUS_CHANGED_SQL)
+START_TIMER_SQL = numbered(sync_server.START_TIMER_SQL)
+CLASSROOM_BSSID_SQL = numbered(sync_server.CLASSROOM_BSSID_SQL)
+STUDENT_DEVICE_SQL = numbered(sync_server.STUDENT_DEVICE_SQL)
+RECORD_CHECKIN_SQL = numbered(sync_server.RECORD_CHECKIN_SQL)
+STUDENT_CLASSROOM_SQL = numbered(sync_server.STUDENT_CLASSROOM_SQL)
+ACTIVE_SESSION_SQL = numbered(sync_server.ACTIVE_SESSION_SQL)
+CLASSROOM_VERSION_SQL = numbered(sync_server.CLASSROOM_VERSION_SQL)
+
+# AdmissionController waits on a threading.Condition, so a request that has to queue
+# waits here; acquire() sheds once a class queue is full, so this never backs up
+admission_waiters = ThreadPoolExecutor(
+    max_workers=max(cls['queue'] for cls in server.admission.classes.values()),
+    thread_name_prefix='admission'
+)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return json_dumps(content).encode()
+
+
+def error(message, status_code):
+    return FastJSONResponse({'error': message}, status_code)
+
+
+def unavailable(message, retry_after, **headers):
+    return FastJSONResponse({'error': message}, 503, headers={'Retry-After': str(retry_after), **headers})
+
+
+async def admit(admission_class):
+    if server.admission.try_acquire(admission_class):
+        return True
+
+    loop = asyncio.get_running_loop()
+    waiter = loop.run_in_executor(admission_waiters, server.admission.acquire, admission_class)
+    try:
+        return await asyncio.shield(waiter)
+    except asyncio.CancelledError:
+        # The client went away while queued; give back the slot if it still arrives
+        waiter.add_done_callback(
+            lambda f: f.cancelled() or not f.result() or server.admission.release(admission_class)
+        )
+        raise
+
+
+def handled(endpoint):
+    """Apply the Flask app's drain check, admission class and in-flight count to a route"""
+    admission_class = ADMISSION_CLASSES.get(endpoint)
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            if not server.accepting:
+                return unavailable('Server is shutting down, please retry', 5, Connection='close')
+            if admission_class and not await admit(admission_class):
+                return unavailable('Server is busy, please retry', server.admission.retry_after(admission_class))
+
+            with server.inflight_cond:
+                server.inflight += 1
+            try:
+                return await handler(request)
+            finally:
+                if admission_class:
+                    server.admission.release(admission_class)
+                with server.inflight_cond:
+                    server.inflight -= 1
+                    server.inflight_cond.notify_all()
+        return wrapper
+    return decorator
+
+
+class AsyncSubscription:
+    """StatusBroadcaster subscription that hands messages to the event loop.
+
+    put_nowait is called from the broadcaster's poll thread.
+    """
+
+    def __init__(self, loop, maxsize=100):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.maxsize = maxsize
+        self.dropped = False
+
+    def put_nowait(self, message):
+        if self.queue.qsize() >= self.maxsize:
+            raise queue.Full
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+async def read_json(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def authenticate(request, student_id, device_id):
+    """Async counterpart of server.authenticate_student; returns (claims, error_response).
+
+    A session token is verified in-process without touching the pool.
+    """
+    auth_header = request.headers.get('Authorization', '')
+    claims, failure = sync_server.student_token_check(auth_header, student_id, device_id)
+    if not (claims or failure):
+        row = await request.app.state.pool.fetchrow(STUDENT_DEVICE_SQL, student_id, student_id, device_id)
+        failure = sync_server.student_device_error(row)
+
+    if failure:
+        return None, error(*failure)
+    return claims, None
+
+
+async def classroom_bssid(conn, classroom):
+    mapping = await conn.fetchval(CLASSROOM_BSSID_SQL, classroom)
+    return json_loads(mapping).get(classroom) if mapping else None
+
+
+async def mark_status_changed(conn, student_ids):
+    await conn.execute(STATUS_CHANGED_SQL, student_ids, student_ids)
+
+
+async def start_timer(conn, student_id):
+    status = await conn.execute(
+        START_TIMER_SQL,
+        'running', datetime.now().timestamp(), server.TIMER_DURATION, server.TIMER_DURATION, student_id
+    )
+    if status == 'INSERT 0 0':
+        return False  # No such student
+
+    await mark_status_changed(conn, [student_id])
+    return True
+
+
+async def active_session(pool, classroom):
+    session = await pool.fetchrow(ACTIVE_SESSION_SQL, classroom)
+    return dict(session) if session else None
+
+
+async def student_status(pool, student_id):
+    row = await pool.fetchrow(STUDENT_STATUS_SQL, student_id)
+    if not row:
+        return None
+    return server.student_view(student_id, server._status_entry(row), row['authorized_bssid'])
+
+
+@handled('student_ping')
+async def ping(request):
+    data = await read_json(request) or {}
+    student_id = data.get('student_id')
+    device_id = data.get('device_id')
+
+    if not all([student_id, device_id]):
+        return error('Student ID and device ID are required', 400)
+
+    claims, failure = await authenticate(request, student_id, device_id)
+    if failure:
+        return failure
+
+    server.touch_device(student_id)
+
+    return FastJSONResponse({'message': 'Ping successful'})
+
+
+@handled('student_checkin')
+async def checkin(request):
+    data = await read_json(request) or {}
+    student_id = data.get('student_id')
+    bssid = data.get('bssid')
+    device_id = data.get('device_id')
+
+    if not all([student_id, device_id]):
+        return error('Student ID and device ID are required', 400)
+
+    claims, failure = await authenticate(request, student_id, device_id)
+    if failure:
+        return failure
+
+    server.touch_device(student_id)
+
+    async with request.app.state.pool.acquire() as conn:
+        await conn.execute(RECORD_CHECKIN_SQL, student_id, datetime.now().isoformat(), bssid, device_id)
+
+        if claims:
+            classroom = claims['cls']
+        else:
+            classroom = await conn.fetchval(STUDENT_CLASSROOM_SQL, student_id)
+
+        authorized_bssid = await classroom_bssid(conn, classroom)
+
+        if bssid and bssid == authorized_bssid:
+            await start_timer(conn, student_id)
+        else:
+            await mark_status_changed(conn, [student_id])
+
+    return FastJSONResponse(sync_server.checkin_result(bssid, authorized_bssid))
+
+
+@handled('student_get_status')
+async def get_status(request):
+    student_id = request.query_params.get('student_id')
+    device_id = request.query_params.get('device_id')
+
+    if not all([student_id, device_id]):
+        return error('Student ID and device ID are required', 400)
+
+    claims, failure = await authenticate(request, student_id, device_id)
+    if failure:
+        return failure
+
+    server.touch_device(student_id)
+
+    status = await student_status(request.app.state.pool, student_id)
+    if not status:
+        return error('Student not found', 404)
+    return FastJSONResponse(status)
+
+
+@handled('student_stream')
+async def stream(request):
+    """Async counterpart of server.student_stream"""
+    student_id = request.query_params.get('student_id')
+    device_id = request.query_params.get('device_id')
+
+    if not all([student_id, device_id]):
+        return error('Student ID and device ID are required', 400)
+
+    claims, failure = await authenticate(request, student_id, device_id)
+    if failure:
+        return failure
+    if not claims:
+        # Revocation must be able to end the stream, so it needs a session token
+        return error('Session token required', 401)
+
+    token = request.headers['Authorization'][len('Bearer '):]
+    classroom = claims['cls']
+    pool = request.app.state.pool
+    subscription = AsyncSubscription(asyncio.get_running_loop())
+    # The first subscriber of a classroom reads its baseline with psycopg2
+    await asyncio.to_thread(server.broadcaster.subscribe, classroom, subscription)
+
+    async def generate():
+        try:
+            server.touch_device(student_id)
+            version = await pool.fetchval(CLASSROOM_VERSION_SQL, classroom)
+            session = await active_session(pool, classroom)
+            yield 'retry: 3000\n\n'
+            yield sse_event('status', await student_status(pool, student_id), version)
+            yield sse_event('session', {'active': bool(session), 'session': session}, version)
+
+            next_beat = time.time() + server.STREAM_HEARTBEAT
+            while not subscription.dropped:
+                if time.time() >= next_beat:
+                    if not server.verify_token(token):
+                        yield sse_event('revoked', {'error': 'Session expired, please log in again'})
+                        break
+                    server.touch_device(student_id)
+                    yield ': heartbeat\n\n'
+                    next_beat = time.time() + server.STREAM_HEARTBEAT
+
+                try:
+                    message = await subscription.get(max(0.0, next_beat - time.time()))
+                except asyncio.TimeoutError:
+                    continue
+
+                if message is None:
+                    break
+
+                event, data, event_version = message
+                if event == 'status':
+                    # Classroom deltas only concern this student when they include them
+                    if event_version <= version or student_id not in data['students']:
+                        continue
+                    version = event_version
+                    data = server.student_view(student_id, data['students'][student_id], data['authorized_bssid'])
+                yield sse_event(event, data, event_version)
+        finally:
+            server.broadcaster.unsubscribe(classroom, subscription)
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Started already when the app is mounted in a process that runs it (as the tests
+    # do); under uvicorn, including gunicorn's uvicorn workers, the lifespan owns it
+    owns_server = not server.started
+    if owns_server:
+        server.start()
+    app.state.pool = await asyncpg.create_pool(server.db.db_url, min_size=1, max_size=ASYNC_DB_POOL_SIZE)
+    try:
+        yield
+    finally:
+        await app.state.pool.close()
+        if owns_server:
+            # Drains in-flight requests and flushes buffers; blocking, so off the loop
+            await asyncio.to_thread(server.shutdown)
+
+
+app = Starlette(
+    routes=[
+        Route('/student/ping', ping, methods=['POST']),
+        Route('/student/checkin', checkin, methods=['POST']),
+        Route('/student/get_status', get_status, methods=['GET']),
+        Route('/student/stream', stream, methods=['GET']),
+        Mount('/', app=WSGIMiddleware(flask_app, workers=WSGI_THREADS))
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,57 @@
+"""Measure bytes on the wire for the large JSON endpoints with and without compression.
+
+Fetches each endpoint once per Accept-Encoding from a running server and reports
+the body size as sent (before the client decodes it), so run it against a
+deployment with realistic data:
+
+    python benchmarks/compression_bench.py http://localhost:5000 --classroom A101 --student S001
+"""
+import argparse
+import time
+
+import requests
+
+ENCODINGS = ['identity', 'gzip', 'br']
+
+
+def endpoints(args):
+    yield 'get_students', '/teacher/get_students', {'fields': 'id,name,classroom,branch,semester,attendance', 'limit': 1000}
+    yield 'get_status', '/teacher/get_status', {'classroom': args.classroom}
+    yield 'get_sessions', '/teacher/get_sessions', {'limit': 1000}
+    if args.student and args.device:
+        yield 'get_attendance', '/student/get_attendance', {'student_id': args.student, 'device_id': args.device}
+
+
+def wire_size(url, params, encoding, headers):
+    started = time.perf_counter()
+    response = requests.get(url, params=params, headers=dict(headers, **{'Accept-Encoding': encoding}), stream=True)
+    body = response.raw.read(decode_content=False)
+    elapsed = (time.perf_counter() - started) * 1000
+    return response.status_code, response.headers.get('Content-Encoding', 'identity'), len(body), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('server_url')
+    parser.add_argument('--classroom', default='A101')
+    parser.add_argument('--student', help='student ID for get_attendance')
+    parser.add_argument('--device', help='device ID the student is logged in with')
+    parser.add_argument('--token', help='student session token for get_attendance')
+    args = parser.parse_args()
+
+    headers = {'Authorization': f'Bearer {args.token}'} if args.token else {}
+
+    print(f"{'endpoint':<16} | {'encoding':<8} | {'bytes':>10} | {'ratio':>6} | {'ms':>7}")
+    for name, path, params in endpoints(args):
+        baseline = None
+        for encoding in ENCODINGS:
+            status, used, size, elapsed = wire_size(args.server_url.rstrip('/') + path, params, encoding, headers)
+            if status != 200:
+                print(f"{name:<16} | {encoding:<8} | HTTP {status}")
+                break
+            baseline = baseline or size
+            print(f"{name:<16} | {used:<8} | {size:>10} | {size / baseline:>6.2f} | {elapsed:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark /teacher/get_status: legacy per-student queries vs the single-query snapshot.
+
+Seeds classrooms of 50, 300 and 1000 students (with check-ins and timers) into the
+database pointed to by DATABASE_URL, times both implementations and removes the
+seeded rows afterwards. Run it against a scratch database, never production:
+
+    DATABASE_URL=postgresql://localhost/attendance_bench python benchmarks/get_status_bench.py
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import server
+
+SIZES = [50, 300, 1000]
+ROUNDS = 20
+PREFIX = 'bench_'
+
+
+def legacy_status(classroom):
+    """The previous implementation: one roster query plus two queries per student"""
+    db = server.db
+    status = {
+        'authorized_bssid': db.fetch_one('SELECT authorized_bssid FROM server_settings')['authorized_bssid'],
+        'students': {}
+    }
+
+    for student in db.fetch_all('SELECT * FROM students WHERE classroom = %s', (classroom,)):
+        checkin = db.fetch_one(
+            'SELECT * FROM checkins WHERE student_id = %s ORDER BY timestamp DESC LIMIT 1',
+            (student['id'],)
+        )
+        timer = db.fetch_one('SELECT * FROM timers WHERE student_id = %s', (student['id'],))
+        status['students'][student['id']] = {
+            'name': student['name'],
+            'classroom': student['classroom'],
+            'branch': student['branch'],
+            'semester': student['semester'],
+            'connected': checkin is not None,
+            'authorized': checkin and checkin['bssid'] == status['authorized_bssid'],
+            'timestamp': checkin['timestamp'] if checkin else None,
+            'timer': {
+                'status': timer['status'] if timer else 'stop',
+                'remaining': timer['remaining'] if timer else 0,
+                'start_time': timer['start_time'] if timer else None
+            }
+        }
+
+    return status
+
+
+def seed(classroom, size):
+    now = datetime.now()
+    students = [(f'{PREFIX}{classroom}_{i}', 'x', f'Student {i}', classroom, 'CSE', 3, '{}') for i in range(size)]
+    server.db.execute_values(
+        'INSERT INTO students (id, password, name, classroom, branch, semester, attendance) VALUES %s',
+        students,
+        commit=True
+    )
+    # Two thirds checked in, half of those with a running timer
+    checkins = [(s[0], now.isoformat(), 'aa:bb:cc:dd:ee:ff', 'bench-device') for s in students[: size * 2 // 3]]
+    server.db.execute_values(
+        'INSERT INTO checkins (student_id, timestamp, bssid, device_id) VALUES %s',
+        checkins,
+        commit=True
+    )
+    timers = [(c[0], 'running', now.timestamp(), 1800, 1800) for c in checkins[::2]]
+    server.db.execute_values(
+        'INSERT INTO timers (student_id, status, start_time, duration, remaining) VALUES %s',
+        timers,
+        commit=True
+    )
+
+
+def cleanup():
+    pattern = PREFIX + '%'
+    for table in ('timers', 'checkins'):
+        server.db.execute(f'DELETE FROM {table} WHERE student_id LIKE %s', (pattern,), commit=True)
+    server.db.execute('DELETE FROM students WHERE id LIKE %s', (pattern,), commit=True)
+
+
+def timed(func, classroom):
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        result = func(classroom)
+    return (time.perf_counter() - started) / ROUNDS * 1000, result
+
+
+def main():
+    cleanup()
+    try:
+        print(f"{'students':>8} | {'legacy ms':>10} | {'snapshot ms':>11} | {'speedup':>7} | round trips")
+        for size in SIZES:
+            classroom = f'BENCH{size}'
+            seed(classroom, size)
+
+            legacy_ms, legacy = timed(legacy_status, classroom)
+            snapshot_ms, snapshot = timed(server.get_classroom_status, classroom)
+            assert legacy == {key: snapshot[key] for key in legacy}, "snapshot differs from the legacy payload"
+
+            print(f"{size:>8} | {legacy_ms:>10.1f} | {snapshot_ms:>11.1f} | {legacy_ms / snapshot_ms:>6.1f}x | {2 * size + 2} -> 1")
+    finally:
+        cleanup()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Microbenchmark JSON encoding of get_status and get_students payloads.
+
+Compares Flask's stdlib provider with the app's provider (orjson when installed)
+on synthetic payloads shaped like the real responses. Importing the app connects
+to DATABASE_URL, so point it at a scratch database:
+
+    DATABASE_URL=postgresql://localhost/attendance_bench python benchmarks/json_bench.py
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import app, orjson, server
+
+ROUNDS = 50
+STUDENTS = 1000
+HISTORY_DAYS = 120
+
+
+def status_payload():
+    now = datetime.now()
+    return {
+        'authorized_bssid': 'aa:bb:cc:dd:ee:ff',
+        'version': 12345,
+        'full': True,
+        'removed': [],
+        'students': {
+            f'S{i:04d}': {
+                'name': f'Student {i}',
+                'classroom': 'A101',
+                'branch': 'CSE',
+                'semester': 3,
+                'connected': i % 3 != 0,
+                'authorized': i % 3 == 1,
+                'timestamp': now.isoformat(),
+                'timer': {'status': 'running' if i % 2 else 'stop', 'remaining': 1234.5, 'start_time': now.timestamp()}
+            }
+            for i in range(STUDENTS)
+        }
+    }
+
+
+def students_payload():
+    start = datetime(2024, 1, 1)
+    attendance = {
+        (start + timedelta(days=d)).date().isoformat(): {
+            f'Maths_{d}': {
+                'status': 'present' if d % 4 else 'absent',
+                'subject': 'Maths',
+                'classroom': 'A101',
+                'start_time': '09:00:00',
+                'end_time': '10:00:00',
+                'branch': 'CSE',
+                'semester': 3
+            }
+        }
+        for d in range(HISTORY_DAYS)
+    }
+    return {
+        'students': [
+            {'id': f'S{i:04d}', 'name': f'Student {i}', 'classroom': 'A101', 'branch': 'CSE',
+             'semester': 3, 'attendance': attendance}
+            for i in range(STUDENTS)
+        ],
+        'next_cursor': None
+    }
+
+
+def timed(provider, payload):
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        body = provider.dumps(payload)
+    return (time.perf_counter() - started) / ROUNDS * 1000, len(body)
+
+
+def main():
+    stdlib = DefaultJSONProvider(app)
+    stdlib.sort_keys = False
+    try:
+        print(f"app provider uses {'orjson' if orjson else 'the stdlib (orjson not installed)'}")
+        print(f"{'payload':<14} | {'stdlib ms':>9} | {'app ms':>8} | {'speedup':>7} | bytes")
+        for name, payload in (('get_status', status_payload()), ('get_students', students_payload())):
+            stdlib_ms, size = timed(stdlib, payload)
+            app_ms, _ = timed(app.json, payload)
+            print(f"{name:<14} | {stdlib_ms:>9.2f} | {app_ms:>8.2f} | {stdlib_ms / app_ms:>6.1f}x | {size}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Closed-loop throughput test for comparing the development server with gunicorn.
+
+Runs `--clients` threads that each send requests back to back for `--duration`
+seconds, using a mix of the hot read endpoints, and reports requests/second and
+latency percentiles. To compare the two launch modes on the same hardware, run the
+same command against each server in turn while nothing else runs on the machine:
+
+    python server.py                                  # Werkzeug, single process
+    gunicorn -c gunicorn.conf.py server:app           # pre-forked gthread workers
+
+    python benchmarks/throughput_bench.py http://localhost:5000 --classroom A101 --clients 64
+
+Repeat each run a few times and record the median together with the CPU count,
+WEB_CONCURRENCY, GUNICORN_THREADS and DB_POOL_SIZE used.
+"""
+import argparse
+import statistics
+import threading
+import time
+
+import requests
+
+
+def request_mix(args):
+    return [
+        ('/teacher/get_status', {'classroom': args.classroom}),
+        ('/teacher/get_special_dates', None),
+        ('/teacher/get_active_sessions', {'teacher_id': args.teacher}),
+        ('/teacher/get_students', {'classroom': args.classroom, 'limit': 50})
+    ]
+
+
+def client(base_url, mix, deadline, latencies, errors):
+    session = requests.Session()
+    i = 0
+    while time.monotonic() < deadline:
+        path, params = mix[i % len(mix)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            response = session.get(base_url + path, params=params, timeout=30)
+            ok = response.status_code < 500
+        except requests.exceptions.RequestException:
+            ok = False
+        latencies.append(time.perf_counter() - started)
+        if not ok:
+            errors.append(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('server_url')
+    parser.add_argument('--classroom', default='A101')
+    parser.add_argument('--teacher', default='admin')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    args = parser.parse_args()
+
+    base_url = args.server_url.rstrip('/')
+    mix = request_mix(args)
+
+    # The warmup pass fills caches and pools; only the second pass is reported
+    for duration in (args.warmup, args.duration):
+        latencies, errors = [], []
+        deadline = time.monotonic() + duration
+        threads = [
+            threading.Thread(target=client, args=(base_url, mix, deadline, latencies, errors))
+            for _ in range(args.clients)
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+    if not latencies:
+        raise SystemExit("no requests completed")
+    latencies.sort()
+    ms = [latency * 1000 for latency in latencies]
+    print(f"clients:  {args.clients}")
+    print(f"requests: {len(ms)} in {elapsed:.1f}s ({len(ms) / elapsed:.0f} req/s), {len(errors)} errors")
+    print(f"latency:  p50 {statistics.median(ms):.1f} ms | "
+          f"p95 {ms[int(len(ms) * 0.95)]:.1f} ms | p99 {ms[int(len(ms) * 0.99)]:.1f} ms | max {ms[-1]:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
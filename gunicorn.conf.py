@@ -0,0 +1,68 @@
+"""Gunicorn settings for production.
+
+render.yaml serves the ASGI app, which streams to every student without pinning
+threads and passes all other routes to Flask:
+
+    gunicorn -c gunicorn.conf.py -k uvicorn_worker.UvicornWorker asgi_server:app
+
+The plain Flask app runs on the gthread workers configured below:
+
+    gunicorn -c gunicorn.conf.py server:app
+
+The app is preloaded, so schema setup, seeding and restart reconciliation run once
+in the master. The master then closes its connection pool, and each forked worker
+opens its own pool and starts its hash workers and background jobs (in the ASGI
+app's lifespan under the uvicorn worker). Maintenance jobs run only in the worker
+elected leader (see LeaderElector in server.py).
+
+Each worker opens up to DB_POOL_SIZE connections, so keep
+workers * DB_POOL_SIZE below the database's connection limit. Every open
+/teacher/status/stream or /student/stream holds one thread for as long as it is open;
+they are capped at TEACHER_STREAM_LIMIT and STUDENT_STREAM_LIMIT per worker, and
+clients beyond that poll. The ASGI app serves student streams as coroutines with no cap.
+Requests waiting for admission also hold a thread, so server.py sizes the admission
+limits and queues from GUNICORN_THREADS (less the stream caps). If you override
+ADMISSION_* settings, keep active plus queued requests within that budget or the
+overflow waits in gunicorn for a free thread instead of getting a quick 503.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Pre-forked workers, each with a thread pool for I/O-bound handlers and streams
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', 2 * (os.cpu_count() or 1) + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+# Every worker forks its own password hash processes; share the cores out between them
+os.environ.setdefault('PASSWORD_HASH_WORKERS', str(max(1, (os.cpu_count() or 1) // workers)))
+preload_app = True
+
+# Recycle workers now and then so slow leaks cannot accumulate; jitter avoids restarting all at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+# Idle keep-alive connections must outlive the load balancer's, or it races us closing them
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 75))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+# Leave room for AttendanceServer.shutdown to drain requests and flush buffers (whole seconds)
+graceful_timeout = int(float(os.getenv('SHUTDOWN_TIMEOUT', 25))) + 5
+
+accesslog = '-'
+
+def when_ready(arbiter):
+    # Connections opened during preload must not be shared by the forked workers
+    from server import server
+    server.db.close()
+
+
+def post_worker_init(worker):
+    # uvicorn ends its worker by re-raising the stop signal, so worker_exit never runs
+    # there; the ASGI app's lifespan starts and shuts down the server instead
+    if not worker.cfg.worker_class_str.startswith('uvicorn'):
+        from server import server
+        server.start()
+
+
+def worker_exit(arbiter, worker):
+    from server import server
+    server.shutdown()
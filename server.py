@@ -1,10 +1,14 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from flask_compress import Compress
 from datetime import datetime, timedelta
 import threading
+import queue
 import time
 import random
 from werkzeug.security import generate_password_hash, check_password_hash
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 import uuid
 import logging
 from logging.handlers import RotatingFileHandler
@@ -12,13 +16,71 @@ import os
 import signal
 import atexit
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
+import psycopg2.pool
+from werkzeug.serving import make_server
 import json
+import secrets
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from contextlib import contextmanager
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_dumps(obj):
+    """Serialize to a str, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj)
+
+def json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# jsonb columns decode through the same fast path
+psycopg2.extras.register_default_jsonb(loads=json_loads, globally=True)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, falling back to the stdlib encoder"""
+    sort_keys = False
+    
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        # Datetimes go through Flask's default() so both encoders format them alike
+        return orjson.dumps(
+            obj,
+            default=self.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        ).decode()
+    
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
+# Negotiated brotli/gzip for JSON bodies above the size threshold; event streams are left alone
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_ALGORITHM_STREAMING'] = ['br', 'deflate']
+app.config['COMPRESS_STREAMS'] = True
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_BR_LEVEL'] = int(os.getenv('COMPRESS_BR_LEVEL', 4))
+app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', 6))
+Compress(app)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('AttendanceServer')
@@ -28,13 +90,35 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 class DatabaseManager:
+    # Advisory lock held while the schema is created or migrated
+    SCHEMA_LOCK_KEY = int(os.getenv('SCHEMA_LOCK_KEY', 72650000))
+    
     def __init__(self, db_url=None):
         self.db_url = db_url or os.getenv('DATABASE_URL')
+        self.pool_size = int(os.getenv('DB_POOL_SIZE', 10))
+        self.connect()
+        # The pool raises instead of blocking when exhausted, so gate checkouts
+        self.pool_slots = threading.BoundedSemaphore(self.pool_size)
+        self.local = threading.local()
         self._init_db()
+    
+    def connect(self):
+        """Open a fresh connection pool; a forked worker calls this after its parent closed the pool"""
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            1, self.pool_size, self.db_url, cursor_factory=psycopg2.extras.RealDictCursor
+        )
 
     def _init_db(self):
         with self._get_connection() as conn:
             cursor = conn.cursor()
+            # Instances starting together take turns; the lock is released at commit
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', (self.SCHEMA_LOCK_KEY,))
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    name TEXT PRIMARY KEY,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            ''')
             # Teachers table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS teachers (
@@ -48,6 +132,13 @@ class DatabaseManager:
                     semesters TEXT
                 )
             ''')
+            # Unique teacher emails, unless existing rows already clash
+            cursor.execute('SELECT email FROM teachers GROUP BY email HAVING COUNT(*) > 1 LIMIT 1')
+            duplicate = cursor.fetchone()
+            if duplicate:
+                logger.warning(f"Teacher email {duplicate['email']} is used more than once; not enforcing unique emails")
+            else:
+                cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS teachers_email_key ON teachers (email)')
             # Students table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS students (
@@ -75,6 +166,28 @@ class DatabaseManager:
                     FOREIGN KEY (teacher_id) REFERENCES teachers (id)
                 )
             ''')
+            # Newest-first session listings per teacher and per classroom
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS sessions_teacher_start_idx
+                ON sessions (teacher_id, start_time DESC, id DESC)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS sessions_classroom_start_idx
+                ON sessions (classroom, start_time DESC, id DESC)
+            ''')
+            # At most one open session per classroom; close older duplicates left by earlier races first
+            cursor.execute('''
+                UPDATE sessions s SET end_time = to_char(localtimestamp, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+                WHERE s.end_time IS NULL AND EXISTS (
+                    SELECT 1 FROM sessions o
+                    WHERE o.classroom = s.classroom AND o.end_time IS NULL
+                      AND (o.start_time, o.id) > (s.start_time, s.id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS sessions_one_open_per_classroom
+                ON sessions (classroom) WHERE end_time IS NULL
+            ''')
             # Checkins table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS checkins (
@@ -123,14 +236,38 @@ class DatabaseManager:
                     PRIMARY KEY (branch, semester)
                 )
             ''')
-            # Special dates table
+            # Special dates: one row per date and kind ('holiday' or 'special_schedule')
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS special_dates (
-                    id SERIAL PRIMARY KEY,
-                    holidays TEXT NOT NULL,
-                    special_schedules TEXT NOT NULL
+                CREATE TABLE IF NOT EXISTS calendar_dates (
+                    date TEXT NOT NULL,
+                    kind TEXT NOT NULL CHECK (kind IN ('holiday', 'special_schedule')),
+                    description TEXT NOT NULL,
+                    PRIMARY KEY (date, kind)
                 )
             ''')
+            # Copy the newest full snapshot out of the old append-only special_dates table,
+            # once. The old table stays while instances running the previous release may
+            # still read it; drop it in a later release.
+            cursor.execute(
+                "SELECT to_regclass('special_dates') IS NOT NULL AS legacy, "
+                "       EXISTS (SELECT 1 FROM schema_migrations WHERE name = 'calendar_dates') AS migrated"
+            )
+            legacy_table = cursor.fetchone()
+            if legacy_table['legacy'] and not legacy_table['migrated']:
+                cursor.execute('SELECT holidays, special_schedules FROM special_dates ORDER BY id DESC LIMIT 1')
+                legacy = cursor.fetchone()
+                if legacy:
+                    entries = [(h['date'], 'holiday', h.get('description', '')) for h in json_loads(legacy['holidays'])]
+                    entries += [(d['date'], 'special_schedule', d.get('description', ''))
+                                for d in json_loads(legacy['special_schedules'])]
+                    if entries:
+                        psycopg2.extras.execute_values(
+                            cursor,
+                            'INSERT INTO calendar_dates (date, kind, description) VALUES %s '
+                            'ON CONFLICT (date, kind) DO NOTHING',
+                            entries
+                        )
+                cursor.execute("INSERT INTO schema_migrations (name) VALUES ('calendar_dates')")
             # Server settings table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS server_settings (
@@ -140,6 +277,58 @@ class DatabaseManager:
                     timer_duration INTEGER NOT NULL
                 )
             ''')
+            # Revoked session tokens (tokens issued before revoked_at are rejected)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS token_revocations (
+                    student_id TEXT PRIMARY KEY,
+                    revoked_at DOUBLE PRECISION NOT NULL
+                )
+            ''')
+            # Present/total attendance per student and subject ('*' is the overall count)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS attendance_counters (
+                    student_id TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    present INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (student_id, subject)
+                )
+            ''')
+            # Bumped on every attendance write; the student get_attendance ETag
+            cursor.execute('''
+                ALTER TABLE students ADD COLUMN IF NOT EXISTS attendance_version BIGINT NOT NULL DEFAULT 0
+            ''')
+            # Per-classroom status change versions for delta sync
+            cursor.execute('''
+                ALTER TABLE students ADD COLUMN IF NOT EXISTS status_version BIGINT NOT NULL DEFAULT 0
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS students_classroom_status_version_idx
+                ON students (classroom, status_version)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS students_classroom_id_idx
+                ON students (classroom, id)
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS classroom_versions (
+                    classroom TEXT PRIMARY KEY,
+                    version BIGINT NOT NULL,
+                    pruned_through BIGINT NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS status_removals (
+                    classroom TEXT NOT NULL,
+                    student_id TEXT NOT NULL,
+                    version BIGINT NOT NULL,
+                    removed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS status_removals_classroom_version_idx
+                ON status_removals (classroom, version)
+            ''')
             cursor.execute('SELECT 1 FROM server_settings LIMIT 1')
             if not cursor.fetchone():
                 cursor.execute('INSERT INTO server_settings (authorized_bssid, checkin_interval, timer_duration) VALUES (%s, %s, %s)', (None, 60, 1800))
@@ -147,11 +336,60 @@ class DatabaseManager:
 
     @contextmanager
     def _get_connection(self):
-        conn = psycopg2.connect(self.db_url, cursor_factory=psycopg2.extras.RealDictCursor)
-        try:
-            yield conn
-        finally:
-            conn.close()
+        pinned = getattr(self.local, 'conn', None)
+        if pinned is not None:
+            # Inside pinned(): reuse this thread's connection
+            self.local.depth += 1
+            try:
+                yield pinned
+            finally:
+                self.local.depth -= 1
+                if self.local.depth == 0 and not pinned.closed:
+                    try:
+                        pinned.rollback()
+                    except psycopg2.Error:
+                        pass
+            return
+        
+        with self.pool_slots:
+            conn = self.pool.getconn()
+            try:
+                yield conn
+            finally:
+                # Drop anything left uncommitted before the connection is reused
+                if not conn.closed:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        pass
+                self.pool.putconn(conn, close=bool(conn.closed))
+    
+    @contextmanager
+    def pinned(self):
+        """Serve every query on this thread from one pooled connection until exit"""
+        if getattr(self.local, 'conn', None) is not None:
+            yield
+            return
+        
+        with self._get_connection() as conn:
+            self.local.conn = conn
+            self.local.depth = 0
+            try:
+                yield
+            finally:
+                self.local.conn = None
+    
+    @contextmanager
+    def transaction(self):
+        """Yield a cursor whose statements commit together, or roll back on error"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            yield cursor
+            conn.commit()
+    
+    def close(self):
+        """Close every pooled connection"""
+        self.pool.closeall()
 
     def execute(self, query, params=(), commit=False):
         with self._get_connection() as conn:
@@ -173,24 +411,749 @@ class DatabaseManager:
             cursor.execute(query, params)
             return cursor.fetchall()
 
+    def execute_values(self, query, argslist, commit=False, page_size=1000):
+        """Run a multi-row statement; the query must contain a single VALUES %s placeholder"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            psycopg2.extras.execute_values(cursor, query, argslist, page_size=page_size)
+            if commit:
+                conn.commit()
+            return cursor
+
+class BackgroundScheduler:
+    """Runs registered periodic jobs from a single scheduler thread.
+    
+    Each run executes on its own worker thread so a slow job never delays the
+    others; a job that is still running when it comes due again is skipped.
+    Failures are logged and counted instead of killing the job.
+    """
+    
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.workers = set()
+    
+    def register(self, name, func, interval, jitter=0.1):
+        """Run func every `interval` seconds, randomly spread by +/- jitter * interval"""
+        with self.lock:
+            self.jobs[name] = {
+                'func': func,
+                'interval': interval,
+                'jitter': jitter,
+                'next_run': time.monotonic() + random.uniform(0, jitter * interval),
+                'running': False,
+                'runs': 0,
+                'failures': 0,
+                'skipped': 0,
+                'last_duration': None,
+                'max_duration': None,
+                'last_success': None,
+                'last_error': None
+            }
+    
+    def unregister(self, name):
+        """Stop scheduling a job; a run already in progress finishes"""
+        with self.lock:
+            self.jobs.pop(name, None)
+    
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self.thread.start()
+    
+    def stop(self, timeout=10):
+        """Stop scheduling new runs and wait up to `timeout` seconds for running jobs"""
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        if self.thread:
+            self.thread.join(timeout)
+        for worker in list(self.workers):
+            worker.join(max(0, deadline - time.monotonic()))
+    
+    def _run(self):
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            with self.lock:
+                for name, job in self.jobs.items():
+                    if job['next_run'] > now:
+                        continue
+                    
+                    spread = random.uniform(-job['jitter'], job['jitter'])
+                    job['next_run'] = now + job['interval'] * (1 + spread)
+                    
+                    # Overlap protection: never run two instances of the same job
+                    if job['running']:
+                        job['skipped'] += 1
+                        continue
+                    
+                    job['running'] = True
+                    worker = threading.Thread(target=self._execute, args=(name, job), name=f'job-{name}', daemon=True)
+                    self.workers.add(worker)
+                    worker.start()
+                
+                next_run = min((job['next_run'] for job in self.jobs.values()), default=now + 1)
+            
+            self.stop_event.wait(min(max(next_run - now, 0.05), 1))
+    
+    def _execute(self, name, job):
+        started = time.monotonic()
+        try:
+            job['func']()
+        except Exception as e:
+            job['failures'] += 1
+            job['last_error'] = f"{datetime.now().isoformat()}: {e}"
+            logger.exception(f"Background job {name} failed")
+        else:
+            job['last_success'] = datetime.now().isoformat()
+        finally:
+            duration = time.monotonic() - started
+            with self.lock:
+                job['runs'] += 1
+                job['last_duration'] = duration
+                job['max_duration'] = max(job['max_duration'] or 0, duration)
+                job['running'] = False
+                self.workers.discard(threading.current_thread())
+    
+    def snapshot(self):
+        """Per-job metrics for monitoring"""
+        with self.lock:
+            return {
+                name: {key: value for key, value in job.items() if key not in ('func', 'next_run')}
+                for name, job in self.jobs.items()
+            }
+
+class LeaderElector:
+    """Elects the one process, across all workers and hosts, that runs maintenance jobs.
+    
+    Leadership is a session-level Postgres advisory lock held on a dedicated
+    connection outside the pool, so it lasts exactly as long as that session.
+    tick() runs every few seconds: a follower tries to take the lock, the leader
+    renews its lease by checking that the session is still alive. When the leader
+    exits or crashes, Postgres releases the lock and a follower takes over on its
+    next tick. If the leader's host or network dies instead, the session is
+    dropped by the server's own TCP keepalives, which are set per session to
+    give up after about four lease timeouts. The leader's side gives up after
+    two (tcp_user_timeout), so a cut-off leader steps down before a follower can
+    be elected. A leader that cannot renew steps down immediately.
+    """
+    
+    def __init__(self, db_url, key, lease_timeout, on_elected, on_demoted):
+        self.db_url = db_url
+        self.key = key
+        self.lease_timeout = lease_timeout
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.lock = threading.Lock()
+        self.conn = None
+        self.is_leader = False
+        self.elected_at = None
+    
+    def _connect(self):
+        timeout = max(1, int(self.lease_timeout))
+        self.conn = psycopg2.connect(
+            self.db_url,
+            application_name='attendance-leader-election',
+            connect_timeout=timeout,
+            # Our side: notice a dead server and fail the renewal within two lease timeouts
+            keepalives=1,
+            keepalives_idle=timeout,
+            keepalives_interval=max(1, timeout // 3),
+            keepalives_count=3,
+            tcp_user_timeout=2 * timeout * 1000,
+            # Server side: drop this session (and the lock) once we stop answering, not hours later
+            options=(
+                f'-c statement_timeout={timeout * 1000} '
+                f'-c tcp_keepalives_idle={timeout} '
+                f'-c tcp_keepalives_interval={timeout} '
+                f'-c tcp_keepalives_count=3 '
+                f'-c tcp_user_timeout={4 * timeout * 1000}'
+            )
+        )
+        self.conn.autocommit = True
+    
+    def _disconnect(self):
+        if self.conn is not None and not self.conn.closed:
+            try:
+                self.conn.close()  # Ending the session releases the lock
+            except psycopg2.Error:
+                pass
+        self.conn = None
+    
+    def tick(self):
+        """Try to become leader, or renew the lease if already leader"""
+        with self.lock:
+            was_leader = self.is_leader
+            try:
+                if self.conn is None or self.conn.closed:
+                    self._connect()
+                cursor = self.conn.cursor()
+                if was_leader:
+                    # The lock is held for as long as this session lives
+                    cursor.execute('SELECT 1')
+                    self.is_leader = True
+                else:
+                    cursor.execute('SELECT pg_try_advisory_lock(%s)', (self.key,))
+                    self.is_leader = cursor.fetchone()[0]
+            except psycopg2.Error as e:
+                logger.warning(f"Leader election check failed: {e}")
+                self._disconnect()
+                self.is_leader = False
+            
+            if self.is_leader and not was_leader:
+                self.elected_at = datetime.now().isoformat()
+        
+        if self.is_leader and not was_leader:
+            logger.info(f"Process {os.getpid()} elected leader")
+            self.on_elected()
+        elif was_leader and not self.is_leader:
+            logger.warning(f"Process {os.getpid()} lost leadership")
+            self.on_demoted()
+    
+    def close(self):
+        """Give up leadership (if held) so a follower can take over without waiting"""
+        with self.lock:
+            self._disconnect()
+            self.is_leader = False
+    
+    def snapshot(self):
+        return {'pid': os.getpid(), 'is_leader': self.is_leader, 'elected_at': self.elected_at}
+
+class AdmissionController:
+    """Per-class concurrency limits with bounded waiting and load shedding.
+    
+    Every request class has a priority (0 is highest), a concurrency limit, a
+    wait queue length and a maximum wait. A request runs when its class has a free
+    slot, the process-wide total has room and no higher-priority request is
+    waiting for that room; a higher-priority class that is only at its own limit
+    does not hold the others back. The last `reserved` slots of the total are kept for priority 0, and
+    half of them for priority 1, so a burst of low-priority work cannot starve
+    teachers and heartbeats. A request that finds its queue full, or is still
+    waiting after max_wait seconds, is shed: acquire() returns False and the
+    caller answers 503 straight away instead of letting the backlog grow.
+    """
+    
+    def __init__(self, total, reserved, classes):
+        self.total = total
+        self.reserved = reserved
+        self.classes = classes
+        self.cond = threading.Condition()
+        self.total_active = 0
+        self.active = {name: 0 for name in classes}
+        self.waiting = {name: 0 for name in classes}
+        self.admitted = {name: 0 for name in classes}
+        self.shed = {name: 0 for name in classes}
+    
+    def _can_run(self, name):
+        cls = self.classes[name]
+        if self.active[name] >= cls['limit']:
+            return False
+        if self.total_active >= self.total - self.reserved * min(cls['priority'], 2) / 2:
+            return False
+        # Higher-priority waiters go first, unless all they wait for is a slot of their own class
+        return not any(
+            self.waiting[other] and self.active[other] < other_cls['limit']
+            for other, other_cls in self.classes.items()
+            if other_cls['priority'] < cls['priority']
+        )
+    
+    def acquire(self, name):
+        """Take a slot for a request of this class, waiting if allowed; False means shed it"""
+        cls = self.classes[name]
+        with self.cond:
+            if not self._can_run(name):
+                if self.waiting[name] >= cls['queue']:
+                    self.shed[name] += 1
+                    return False
+                
+                self.waiting[name] += 1
+                deadline = time.monotonic() + cls['max_wait']
+                try:
+                    while not self._can_run(name):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.shed[name] += 1
+                            return False
+                        self.cond.wait(remaining)
+                finally:
+                    self.waiting[name] -= 1
+                    # Lower-priority waiters may have been held back by this one
+                    self.cond.notify_all()
+            
+            self._admit(name)
+            return True
+    
+    def try_acquire(self, name):
+        """Take a slot only if one is free right now; False means the caller must wait or shed"""
+        with self.cond:
+            if not self._can_run(name):
+                return False
+            self._admit(name)
+            return True
+    
+    def _admit(self, name):
+        self.active[name] += 1
+        self.total_active += 1
+        self.admitted[name] += 1
+    
+    def release(self, name):
+        with self.cond:
+            self.active[name] -= 1
+            self.total_active -= 1
+            self.cond.notify_all()
+    
+    def retry_after(self, name):
+        """Seconds a shed client should wait, spread out so retries do not arrive together"""
+        base = self.classes[name]['retry_after']
+        return random.randint(base, 2 * base)
+    
+    def snapshot(self):
+        with self.cond:
+            return {
+                'total_active': self.total_active,
+                'classes': {
+                    name: {
+                        'active': self.active[name],
+                        'waiting': self.waiting[name],
+                        'admitted': self.admitted[name],
+                        'shed': self.shed[name],
+                        **cls
+                    }
+                    for name, cls in self.classes.items()
+                }
+            }
+
+class ReferenceCache:
+    """Parsed copies of rarely changing data (timetables, special dates).
+    
+    Entries expire after `ttl` seconds so an update made by another process is
+    picked up; local updates invalidate immediately. ETags are content hashes,
+    so every process hands out the same one for the same data.
+    """
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> (expires_at, value, etag)
+    
+    def get(self, key, loader):
+        """Return (value, etag), calling loader() on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1], entry[2]
+        
+        value = loader()
+        etag = hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:32]
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value, etag)
+        return value, etag
+    
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+class HasherBusy(Exception):
+    """Raised when the password hashing queue is full"""
+
+class PasswordHasher:
+    """Runs password hashing and verification in a bounded pool of worker processes.
+    
+    Hashes are deliberately slow, so they run off the request threads and never
+    under a lock. At most `workers + max_pending` calls are admitted at once; a
+    caller that cannot get a slot within `timeout` seconds gets HasherBusy.
+    Hashes made with a different method than `method` report needs_rehash().
+    If a worker process dies, the broken pool is replaced and the call retried once.
+    """
+    
+    def __init__(self, method, workers, max_pending, timeout):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(workers + max_pending)
+        # Stored hashes start with the fully expanded method, e.g. "scrypt:32768:8:1"
+        self.prefix = generate_password_hash('', method=method).split('$', 1)[0]
+        self.lock = threading.Lock()
+        self.pool = None
+    
+    def _new_pool(self):
+        if 'fork' in multiprocessing.get_all_start_methods():
+            pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'))
+        else:
+            # Spawned workers would re-import this module and build a second server;
+            # hashlib releases the GIL while hashing, so threads still run in parallel
+            pool = ThreadPoolExecutor(self.workers, thread_name_prefix='hasher')
+        pool.submit(int).result()  # Fork every worker now
+        return pool
+    
+    def start(self):
+        """Start the worker processes; call before opening connections or starting threads, since workers are forked"""
+        self.pool = self._new_pool()
+    
+    def _replace_pool(self, broken):
+        with self.lock:
+            if self.pool is broken:
+                logger.warning("A password hash worker died; starting a new pool")
+                self.pool = self._new_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+    
+    def _run(self, func, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise HasherBusy()
+        try:
+            pool = self.pool
+            try:
+                return pool.submit(func, *args).result()
+            except BrokenProcessPool:
+                self._replace_pool(pool)
+                return self.pool.submit(func, *args).result()
+        finally:
+            self.slots.release()
+    
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+    
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+    
+    def needs_rehash(self, pwhash):
+        return pwhash.split('$', 1)[0] != self.prefix
+    
+    def close(self):
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+class StatusBroadcaster:
+    """Fans classroom status changes out to Server-Sent Events subscribers.
+    
+    One poll per interval reads the versions of every watched classroom; when a
+    classroom advanced, its delta is built once and queued to all subscribers.
+    Event ids are classroom versions, so Last-Event-ID resumes exactly like
+    get_status?since=.
+    """
+    
+    def __init__(self, server):
+        self.server = server
+        self.lock = threading.Lock()
+        self.subscribers = {}  # classroom -> set of subscriber queues
+        self.state = {}  # classroom -> last broadcast (version, authorized_bssid, session id)
+    
+    def _current_state(self, classroom):
+        # Give the classroom a version row so classroom-wide bumps reach it
+        self.server.db.execute(
+            'INSERT INTO classroom_versions (classroom, version) VALUES (%s, 0) ON CONFLICT (classroom) DO NOTHING',
+            (classroom,),
+            commit=True
+        )
+        row = self.server.db.fetch_one(
+            'SELECT (SELECT version FROM classroom_versions WHERE classroom = %s) AS version, '
+            '       (SELECT authorized_bssid FROM server_settings LIMIT 1) AS authorized_bssid, '
+            '       (SELECT id FROM sessions WHERE classroom = %s AND end_time IS NULL LIMIT 1) AS session_id',
+            (classroom, classroom)
+        )
+        return row['version'] or 0, row['authorized_bssid'], row['session_id']
+    
+    def subscribe(self, classroom, subscription=None):
+        """Watch a classroom; pass a subscription with put_nowait/dropped to receive elsewhere"""
+        if subscription is None:
+            subscription = queue.Queue(maxsize=100)
+        subscription.dropped = False
+        
+        # Baseline first, so a subscriber's own catch-up always overlaps the broadcasts
+        state = None if classroom in self.state else self._current_state(classroom)
+        with self.lock:
+            self.subscribers.setdefault(classroom, set()).add(subscription)
+            if state and classroom not in self.state:
+                self.state[classroom] = state
+        return subscription
+    
+    def unsubscribe(self, classroom, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(classroom, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self.subscribers.pop(classroom, None)
+                self.state.pop(classroom, None)
+    
+    def _publish(self, classroom, event, data, version):
+        with self.lock:
+            subscribers = list(self.subscribers.get(classroom, ()))
+        
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait((event, data, version))
+            except queue.Full:
+                # Too slow to keep up: drop it; the client resumes from its last event id
+                subscription.dropped = True
+                self.unsubscribe(classroom, subscription)
+    
+    def poll(self):
+        """Background job to broadcast classrooms whose version advanced"""
+        with self.lock:
+            watched = dict(self.state)
+        
+        if not watched:
+            return
+        
+        rows = self.server.db.fetch_all(
+            'SELECT classroom, version FROM classroom_versions WHERE classroom = ANY(%s)',
+            (list(watched),)
+        )
+        
+        for row in rows:
+            classroom = row['classroom']
+            last_version, last_bssid, last_session = watched[classroom]
+            if row['version'] <= last_version:
+                continue
+            
+            status = self.server.get_classroom_status(classroom, last_version)
+            if status['authorized_bssid'] != last_bssid:
+                # Every student's authorization depends on it, so send everyone
+                status = self.server.get_classroom_status(classroom)
+            self._publish(classroom, 'status', status, status['version'])
+            
+            session = self.server.get_active_session(classroom)
+            session_id = session['id'] if session else None
+            if session_id != last_session:
+                self._publish(classroom, 'session', {'active': bool(session), 'session': session}, status['version'])
+            
+            with self.lock:
+                if classroom in self.state:
+                    self.state[classroom] = (status['version'], status['authorized_bssid'], session_id)
+    
+    def close(self):
+        """End every open stream"""
+        with self.lock:
+            subscriptions = [s for subscribers in self.subscribers.values() for s in subscribers]
+        
+        for subscription in subscriptions:
+            subscription.dropped = True
+            try:
+                subscription.put_nowait(None)
+            except queue.Full:
+                pass
+
+# Queries the ASGI app (asgi_server.py) runs too, renumbering the %s placeholders for
+# asyncpg; asyncpg cannot infer some parameter types, hence the explicit casts
+STUDENT_STATUS_SQL = (
+    'SELECT st.authorized_bssid, s.id, s.name, s.classroom, s.branch, s.semester, '
+    '       c.timestamp, c.bssid, c.student_id IS NOT NULL AS checked_in, '
+    '       t.status AS timer_status, t.remaining, t.start_time '
+    'FROM students s '
+    'LEFT JOIN (SELECT authorized_bssid FROM server_settings LIMIT 1) st ON TRUE '
+    'LEFT JOIN LATERAL ('
+    '    SELECT student_id, timestamp, bssid FROM checkins '
+    '    WHERE student_id = s.id ORDER BY timestamp DESC LIMIT 1'
+    ') c ON TRUE '
+    'LEFT JOIN timers t ON t.student_id = s.id '
+    'WHERE s.id = %s'
+)
+# Params: (student_ids, student_ids)
+STATUS_CHANGED_SQL = (
+    'WITH bumped AS ('
+    '    INSERT INTO classroom_versions (classroom, version) '
+    '    SELECT DISTINCT classroom, 1 FROM students WHERE id = ANY(%s::text[]) ORDER BY classroom '
+    '    ON CONFLICT (classroom) DO UPDATE SET version = classroom_versions.version + 1 '
+    '    RETURNING classroom, version'
+    ') '
+    'UPDATE students s SET status_version = b.version '
+    'FROM bumped b WHERE s.classroom = b.classroom AND s.id = ANY(%s::text[])'
+)
+# Params: (status, start_time, duration, remaining, student_id)
+START_TIMER_SQL = (
+    'INSERT INTO timers (student_id, status, start_time, duration, remaining) '
+    'SELECT id, %s::text, %s::double precision, %s::integer, %s::integer FROM students WHERE id = %s '
+    'ON CONFLICT (student_id) DO UPDATE SET status = EXCLUDED.status, start_time = EXCLUDED.start_time, '
+    'duration = EXCLUDED.duration, remaining = EXCLUDED.remaining'
+)
+CLASSROOM_BSSID_SQL = 'SELECT bssid_mapping FROM teachers WHERE classrooms::jsonb ? %s LIMIT 1'
+# Params: (student_id, student_id, device_id)
+STUDENT_DEVICE_SQL = (
+    'SELECT EXISTS (SELECT 1 FROM students WHERE id = %s) AS student, '
+    '       EXISTS (SELECT 1 FROM active_devices WHERE student_id = %s AND device_id = %s) AS device'
+)
+# Params: (student_id, timestamp, bssid, device_id)
+RECORD_CHECKIN_SQL = (
+    'INSERT INTO checkins (student_id, timestamp, bssid, device_id) VALUES (%s, %s, %s, %s) '
+    'ON CONFLICT (student_id, device_id) DO UPDATE SET timestamp = EXCLUDED.timestamp, bssid = EXCLUDED.bssid'
+)
+STUDENT_CLASSROOM_SQL = 'SELECT classroom FROM students WHERE id = %s'
+ACTIVE_SESSION_SQL = 'SELECT * FROM sessions WHERE classroom = %s AND end_time IS NULL'
+CLASSROOM_VERSION_SQL = 'SELECT COALESCE(MAX(version), 0) AS version FROM classroom_versions WHERE classroom = %s'
+
+def student_token_check(auth_header, student_id, device_id):
+    """Session-token half of student authentication, shared with the ASGI app.
+    
+    Returns (claims, None), (None, (message, status)) for a bad token, or
+    (None, None) when there is no token and the device must be checked in the database.
+    """
+    if not auth_header.startswith('Bearer '):
+        return None, None
+    claims = server.verify_token(auth_header[len('Bearer '):])
+    if not claims:
+        return None, ('Session expired, please log in again', 401)
+    if claims['sid'] != student_id or claims['did'] != device_id:
+        return None, ('Unauthorized device', 403)
+    return claims, None
+
+def student_device_error(row):
+    """(message, status) for a failed STUDENT_DEVICE_SQL check, else None"""
+    if not row['student']:
+        return 'Student not found', 404
+    if not row['device']:
+        return 'Unauthorized device', 403
+    return None
+
+def checkin_result(bssid, authorized_bssid):
+    return {
+        'message': 'Check-in successful',
+        'status': 'present' if bssid and bssid == authorized_bssid else 'absent',
+        'authorized_bssid': authorized_bssid
+    }
+
 class AttendanceServer:
     def __init__(self):
         self.db = DatabaseManager()
-        self.lock = threading.Lock()
         self.running = True
+        self.scheduler = BackgroundScheduler()
+        self.broadcaster = StatusBroadcaster(self)
+        
+        # Shutdown coordination: requests are refused once accepting is False
+        self.accepting = True
+        self.inflight = 0
+        self.inflight_cond = threading.Condition()
+        self.shutdown_lock = threading.Lock()
+        self.is_shut_down = False
+        self.started = False
         
         # Load server settings
         settings = self.db.fetch_one('SELECT * FROM server_settings')
         self.CHECKIN_INTERVAL = settings['checkin_interval']
         self.TIMER_DURATION = settings['timer_duration']
         self.SERVER_PORT = int(os.getenv('PORT', 5000))
+        self.ACTIVITY_FLUSH_INTERVAL = int(os.getenv('ACTIVITY_FLUSH_INTERVAL', 5))
+        self.TIMER_UPDATE_INTERVAL = float(os.getenv('TIMER_UPDATE_INTERVAL', 1))
+        self.CHECKIN_CLEANUP_INTERVAL = int(os.getenv('CHECKIN_CLEANUP_INTERVAL', 60))
+        self.DEVICE_CLEANUP_INTERVAL = int(os.getenv('DEVICE_CLEANUP_INTERVAL', 60))
+        self.JOB_JITTER = float(os.getenv('JOB_JITTER', 0.1))
+        self.SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 25))
+        self.SESSION_MAX_HOURS = float(os.getenv('SESSION_MAX_HOURS', 4))
+        self.STREAM_POLL_INTERVAL = float(os.getenv('STREAM_POLL_INTERVAL', 1))
+        self.STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', 15))
+        # Every /student/stream pins a WSGI thread while open; past this many per process,
+        # students are told to poll instead (the ASGI app serves streams without threads)
+        self.STUDENT_STREAM_LIMIT = int(os.getenv('STUDENT_STREAM_LIMIT', 4))
+        self.student_streams = threading.BoundedSemaphore(self.STUDENT_STREAM_LIMIT)
+        # The same for each open teacher dashboard; past the cap the dashboard polls
+        self.TEACHER_STREAM_LIMIT = int(os.getenv('TEACHER_STREAM_LIMIT', 4))
+        self.teacher_streams = threading.BoundedSemaphore(self.TEACHER_STREAM_LIMIT)
+        self.STUDENTS_PAGE_SIZE = int(os.getenv('STUDENTS_PAGE_SIZE', 200))
+        self.SESSIONS_PAGE_SIZE = int(os.getenv('SESSIONS_PAGE_SIZE', 100))
+        self.BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', 20))
+        self.REFERENCE_CACHE_TTL = float(os.getenv('REFERENCE_CACHE_TTL', 30))
+        self.LEADER_CHECK_INTERVAL = float(os.getenv('LEADER_CHECK_INTERVAL', 5))
+        self.REVOCATION_REFRESH_INTERVAL = float(os.getenv('REVOCATION_REFRESH_INTERVAL', 2))
+        
+        # Concurrency per request class (see ADMISSION_CLASSES for the routes in each).
+        # Admitted and queued requests each hold a WSGI thread, as do open streams, so the
+        # defaults split what the streams leave of a worker's GUNICORN_THREADS: half runs,
+        # half queues. Queues then fill and shed with a 503 before gunicorn itself has to
+        # park connections behind busy threads.
+        self.WORKER_THREADS = int(os.getenv('GUNICORN_THREADS', 32))
+        admission_threads = max(2, self.WORKER_THREADS - self.STUDENT_STREAM_LIMIT - self.TEACHER_STREAM_LIMIT)
+        max_active = int(os.getenv('ADMISSION_MAX_ACTIVE', admission_threads // 2))
+        queue_threads = max(0, admission_threads - max_active)
+        
+        def admission_class(name, priority, limit, queue_share, max_wait, retry_after):
+            return {
+                'priority': priority,
+                'limit': int(os.getenv(f'ADMISSION_{name.upper()}_LIMIT', limit)),
+                'queue': int(os.getenv(f'ADMISSION_{name.upper()}_QUEUE', int(queue_threads * queue_share))),
+                'max_wait': max_wait,
+                'retry_after': retry_after
+            }
+        self.admission = AdmissionController(
+            max_active,
+            int(os.getenv('ADMISSION_RESERVED', max_active // 3)),
+            {
+                'teacher': admission_class('teacher', 0, 8, 0.2, 5, 2),
+                'heartbeat': admission_class('heartbeat', 0, 8, 0.4, 2, 5),
+                'login': admission_class('login', 1, 4, 0.15, 5, 3),
+                'default': admission_class('default', 1, 6, 0.15, 3, 3),
+                'analytics': admission_class('analytics', 2, 2, 0.1, 1, 10)
+            }
+        )
+        queued = sum(cls['queue'] for cls in self.admission.classes.values())
+        if self.admission.total + queued > admission_threads:
+            logger.warning(
+                f"Admission allows {self.admission.total} active and {queued} queued requests but only "
+                f"{admission_threads} of {self.WORKER_THREADS} threads are left after streams; "
+                "excess requests will wait for a thread instead of being shed"
+            )
+        self.reference_cache = ReferenceCache(self.REFERENCE_CACHE_TTL)
+        self.elector = LeaderElector(
+            self.db.db_url,
+            int(os.getenv('LEADER_LOCK_KEY', 72650001)),
+            self.LEADER_CHECK_INTERVAL,
+            self.register_maintenance_jobs,
+            self.unregister_maintenance_jobs
+        )
+        
+        self.TOKEN_MAX_AGE = int(os.getenv('TOKEN_MAX_AGE', 12 * 3600))
+        
+        # Password hashing cost, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000";
+        # existing hashes are upgraded on the next successful login. Every server process
+        # forks its own hash workers (gunicorn.conf.py sets the count per worker).
+        self.hasher = PasswordHasher(
+            os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1'),
+            int(os.getenv('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2))),
+            int(os.getenv('PASSWORD_HASH_QUEUE', 32)),
+            float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+        )
+        
+        # Signed student session tokens
+        secret = os.getenv('SESSION_SECRET')
+        if not secret:
+            logger.warning("SESSION_SECRET is not set; session tokens will not survive a restart")
+            secret = secrets.token_hex(32)
+        self.token_serializer = URLSafeTimedSerializer(secret, salt='student-session')
+        self.token_revocations = {}
+        self.refresh_token_revocations()
+        
+        # Buffered last_activity touches (student_id -> ISO timestamp), written in batches
+        self.pending_activity = {}
+        self.activity_lock = threading.Lock()
         
         # Initialize with admin if not exists
         if not self.db.fetch_one('SELECT 1 FROM teachers WHERE id = %s', ('admin',)):
             self._create_admin_account()
         
-        # Start background threads
+        # Counters start out empty when the table is first created
+        if not self.db.fetch_one('SELECT 1 FROM attendance_counters LIMIT 1'):
+            self.rebuild_attendance_counters()
+        
+        # Repair whatever expired while the server was down
+        self.last_reconciliation = None
+        try:
+            self.last_reconciliation = self.reconcile_after_restart()
+        except Exception:
+            logger.exception("Startup reconciliation failed")
+    
+    def start(self):
+        """Per-process startup: connection pool, hash workers and background jobs.
+        
+        __init__ only does the one-time work (schema, seed data, reconciliation), so a
+        pre-forking server can run it once in the parent, close the pool and call this
+        in every worker.
+        """
+        # Fork the hash workers before any connection is open, so they inherit no pooled sockets
+        if not self.db.pool.closed:
+            self.db.close()
+        self.hasher.start()
+        self.db.connect()
         self.start_background_threads()
+        self.started = True
     
     def _create_admin_account(self):
         self.db.execute(
@@ -198,13 +1161,13 @@ class AttendanceServer:
             'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
             (
                 'admin',
-                generate_password_hash('admin'),
+                generate_password_hash('admin', self.hasher.method),
                 'admin@school.com',
                 'Admin',
-                json.dumps(["A101", "A102", "B201", "B202"]),
-                json.dumps({"A101": "00:11:22:33:44:55", "A102": "AA:BB:CC:DD:EE:FF"}),
-                json.dumps(["CSE", "ECE", "EEE", "ME", "CE"]),
-                json.dumps(list(range(1, 9)))
+                json_dumps(["A101", "A102", "B201", "B202"]),
+                json_dumps({"A101": "00:11:22:33:44:55", "A102": "AA:BB:CC:DD:EE:FF"}),
+                json_dumps(["CSE", "ECE", "EEE", "ME", "CE"]),
+                json_dumps(list(range(1, 9)))
             ),
             commit=True
         )
@@ -216,12 +1179,12 @@ class AttendanceServer:
                 'VALUES (%s, %s, %s, %s, %s, %s, %s)',
                 (
                     's001',
-                    generate_password_hash('student123'),
+                    generate_password_hash('student123', self.hasher.method),
                     'John Doe',
                     'A101',
                     'CSE',
                     3,
-                    json.dumps({})
+                    json_dumps({})
                 ),
                 commit=True
             )
@@ -230,12 +1193,12 @@ class AttendanceServer:
                 'VALUES (%s, %s, %s, %s, %s, %s, %s)',
                 (
                     's002',
-                    generate_password_hash('student123'),
+                    generate_password_hash('student123', self.hasher.method),
                     'Jane Smith',
                     'A101',
                     'CSE',
                     3,
-                    json.dumps({})
+                    json_dumps({})
                 ),
                 commit=True
             )
@@ -246,7 +1209,7 @@ class AttendanceServer:
                 (
                     'CSE',
                     3,
-                    json.dumps([
+                    json_dumps([
                         ["Monday", "09:00", "10:00", "Mathematics", "A101"],
                         ["Monday", "10:00", "11:00", "Physics", "A101"]
                     ])
@@ -255,163 +1218,934 @@ class AttendanceServer:
             )
     
     def start_background_threads(self):
-        """Start all background maintenance threads"""
-        timer_thread = threading.Thread(target=self.update_timers, daemon=True)
-        timer_thread.start()
-        
-        cleanup_thread = threading.Thread(target=self.cleanup_checkins, daemon=True)
-        cleanup_thread.start()
-        
-        device_cleanup_thread = threading.Thread(target=self.cleanup_active_devices, daemon=True)
-        device_cleanup_thread.start()
+        """Register the jobs and start the scheduler.
+        
+        Activity flushing, status broadcasting and revocation refreshes work on this
+        process's buffers, subscribers and caches, so every process runs them. The maintenance jobs act on shared
+        rows and only run in the process the LeaderElector picks.
+        """
+        self.scheduler.register('flush_activity', self.flush_activity, self.ACTIVITY_FLUSH_INTERVAL, self.JOB_JITTER)
+        self.scheduler.register('broadcast_status', self.broadcaster.poll, self.STREAM_POLL_INTERVAL, self.JOB_JITTER)
+        self.scheduler.register(
+            'refresh_token_revocations', self.refresh_token_revocations, self.REVOCATION_REFRESH_INTERVAL, self.JOB_JITTER
+        )
+        self.scheduler.register('leader_election', self.elector.tick, self.LEADER_CHECK_INTERVAL, self.JOB_JITTER)
+        self.elector.tick()  # Take over at once if no one else leads
+        self.scheduler.start()
+    
+    # Jobs that act on shared rows; exactly one process (the leader) runs them
+    MAINTENANCE_JOBS = ('update_timers', 'cleanup_checkins', 'cleanup_active_devices', 'prune_status_removals')
+    
+    def register_maintenance_jobs(self):
+        self.scheduler.register('update_timers', self.update_timers, self.TIMER_UPDATE_INTERVAL, self.JOB_JITTER)
+        self.scheduler.register('cleanup_checkins', self.cleanup_checkins, self.CHECKIN_CLEANUP_INTERVAL, self.JOB_JITTER)
+        self.scheduler.register('cleanup_active_devices', self.cleanup_active_devices, self.DEVICE_CLEANUP_INTERVAL, self.JOB_JITTER)
+        self.scheduler.register('prune_status_removals', self.prune_status_removals, 3600, self.JOB_JITTER)
+    
+    def unregister_maintenance_jobs(self):
+        for name in self.MAINTENANCE_JOBS:
+            self.scheduler.unregister(name)
+    
+    def shutdown(self):
+        """Stop taking requests, drain in-flight ones, flush buffered state and close the pool"""
+        with self.shutdown_lock:
+            if self.is_shut_down:
+                return
+            self.is_shut_down = True
+        
+        logger.info("Server shutting down...")
+        deadline = time.monotonic() + self.SHUTDOWN_TIMEOUT
+        self.accepting = False
+        self.running = False
+        self.broadcaster.close()
+        
+        if not self.started:
+            # Nothing was served or buffered in this process (e.g. a pre-fork parent)
+            if not self.db.pool.closed:
+                self.db.close()
+            logger.info("Shutdown complete")
+            return
+        
+        with self.inflight_cond:
+            while self.inflight and time.monotonic() < deadline:
+                self.inflight_cond.wait(deadline - time.monotonic())
+            if self.inflight:
+                logger.warning(f"Shutdown deadline reached with {self.inflight} requests in flight")
+        
+        self.scheduler.stop(max(0, deadline - time.monotonic()))
+        self.hasher.close()
+        
+        # Final passes: persist buffered heartbeats and, in the leader only (while it
+        # still holds the lock), finalize/refresh timers
+        steps = [self.flush_activity]
+        if self.elector.is_leader:
+            steps.append(self.update_timers)
+        for step in steps:
+            try:
+                step()
+            except Exception:
+                logger.exception(f"Shutdown step {step.__name__} failed")
+        
+        self.elector.close()
+        self.db.close()
+        logger.info("Shutdown complete")
+    
+    def rehash_password(self, table, user_id, pwhash, password):
+        """After a successful login, re-store a hash made with outdated parameters"""
+        if not self.hasher.needs_rehash(pwhash):
+            return
+        try:
+            self.db.execute(
+                f'UPDATE {table} SET password = %s WHERE id = %s AND password = %s',
+                (self.hasher.hash(password), user_id, pwhash),
+                commit=True
+            )
+        except (HasherBusy, psycopg2.Error):
+            logger.warning(f"Could not upgrade password hash for {user_id}; will retry at next login")
     
-    def update_timers(self):
-        """Background thread to update all student timers"""
-        while self.running:
-            current_time = datetime.now().timestamp()
-            
-            with self.lock:
-                timers = self.db.fetch_all('SELECT * FROM timers WHERE status = %s', ('running',))
-                for timer in timers:
-                    elapsed = current_time - timer['start_time']
-                    remaining = max(0, timer['duration'] - elapsed)
-                    
-                    if remaining <= 0:
-                        self.db.execute(
-                            'UPDATE timers SET status = %s, remaining = %s WHERE student_id = %s',
-                            ('completed', 0, timer['student_id']),
-                            commit=True
-                        )
-                        self.record_attendance(timer['student_id'])
-                    else:
-                        self.db.execute(
-                            'UPDATE timers SET remaining = %s WHERE student_id = %s',
-                            (remaining, timer['student_id']),
-                            commit=True
-                        )
-            
-            time.sleep(1)
+    def touch_device(self, student_id):
+        """Buffer a last_activity update for the student's active device"""
+        with self.activity_lock:
+            self.pending_activity[student_id] = datetime.now().isoformat()
     
-    def record_attendance(self, student_id):
-        """Record attendance for completed timer"""
-        with self.lock:
-            student = self.db.fetch_one('SELECT * FROM students WHERE id = %s', (student_id,))
-            if not student:
-                return
-            
-            timer = self.db.fetch_one('SELECT * FROM timers WHERE student_id = %s', (student_id,))
-            if not timer or timer['status'] != 'completed':
-                return
-            
-            # Check authorization
-            checkin = self.db.fetch_one(
-                'SELECT * FROM checkins WHERE student_id = %s ORDER BY timestamp DESC LIMIT 1',
-                (student_id,)
+    def flush_activity(self):
+        """Write all buffered last_activity touches in a single batched UPDATE"""
+        with self.activity_lock:
+            pending, self.pending_activity = self.pending_activity, {}
+        
+        if not pending:
+            return 0
+        
+        try:
+            # Never move last_activity backwards (e.g. past a fresh login)
+            self.db.execute_values(
+                'UPDATE active_devices AS a SET last_activity = v.last_activity '
+                'FROM (VALUES %s) AS v (student_id, last_activity) '
+                'WHERE a.student_id = v.student_id AND a.last_activity < v.last_activity',
+                list(pending.items()),
+                commit=True
             )
-            
-            authorized_bssid = self.db.fetch_one('SELECT authorized_bssid FROM server_settings')['authorized_bssid']
-            is_authorized = checkin and checkin['bssid'] == authorized_bssid
-            
-            date_str = datetime.fromtimestamp(timer['start_time']).date().isoformat()
-            session_key = f"timer_{int(timer['start_time'])}"
-            
-            attendance = json.loads(student['attendance']) if student['attendance'] else {}
-            if date_str not in attendance:
-                attendance[date_str] = {}
-            
-            attendance[date_str][session_key] = {
-                'status': 'present' if is_authorized else 'absent',
-                'subject': 'Timer Session',
-                'classroom': student['classroom'],
-                'start_time': datetime.fromtimestamp(timer['start_time']).isoformat(),
-                'end_time': datetime.fromtimestamp(timer['start_time'] + self.TIMER_DURATION).isoformat(),
-                'branch': student['branch'],
-                'semester': student['semester']
+        except Exception:
+            # Keep the touches for the next flush; newer ones win
+            with self.activity_lock:
+                for student_id, timestamp in pending.items():
+                    self.pending_activity.setdefault(student_id, timestamp)
+            raise
+        
+        return len(pending)
+    
+    def issue_token(self, student_id, device_id, classroom, issued_at=None):
+        """Issue a signed session token binding a student to a device and classroom"""
+        return self.token_serializer.dumps({
+            'sid': student_id,
+            'did': device_id,
+            'cls': classroom,
+            'iat': issued_at or time.time()
+        })
+    
+    def verify_token(self, token):
+        """Return the claims of a valid, unrevoked session token, else None"""
+        try:
+            claims = self.token_serializer.loads(token, max_age=self.TOKEN_MAX_AGE)
+        except BadSignature:
+            return None
+        
+        if claims.get('iat', 0) < self.token_revocations.get(claims.get('sid'), 0):
+            return None
+        return claims
+    
+    def refresh_token_revocations(self):
+        """Pick up revocations written by other processes since the newest one we know.
+        
+        The window reaches a minute further back, so a revocation committed late or
+        stamped by a host with a slightly slower clock is not missed.
+        """
+        newest = max(self.token_revocations.values(), default=0)
+        rows = self.db.fetch_all(
+            'SELECT student_id, revoked_at FROM token_revocations WHERE revoked_at >= %s',
+            (newest - 60,)
+        )
+        for row in rows:
+            if row['revoked_at'] > self.token_revocations.get(row['student_id'], 0):
+                self.token_revocations[row['student_id']] = row['revoked_at']
+    
+    def revoke_tokens(self, student_ids, revoked_at=None):
+        """Revoke every session token issued to these students before revoked_at"""
+        student_ids = list(student_ids)
+        if not student_ids:
+            return
+        
+        revoked_at = revoked_at or time.time()
+        # Never move a revocation back: a later login may already have revoked up to a newer time
+        self.db.execute_values(
+            'INSERT INTO token_revocations (student_id, revoked_at) VALUES %s '
+            'ON CONFLICT (student_id) DO UPDATE '
+            'SET revoked_at = GREATEST(token_revocations.revoked_at, EXCLUDED.revoked_at)',
+            [(student_id, revoked_at) for student_id in student_ids],
+            commit=True
+        )
+        for student_id in student_ids:
+            if revoked_at > self.token_revocations.get(student_id, 0):
+                self.token_revocations[student_id] = revoked_at
+    
+    def get_classroom_status(self, classroom=None, since=None):
+        """Teacher dashboard snapshot for one classroom (or every student) in a single query.
+        
+        With a classroom and `since`, only students whose status changed after that
+        version are returned, plus the ids removed from the classroom since then.
+        """
+        versions = self.db.fetch_one(
+            'SELECT COALESCE(MAX(version), 0) AS version, COALESCE(MAX(pruned_through), 0) AS pruned_through '
+            'FROM classroom_versions WHERE (%s IS NULL OR classroom = %s)',
+            (classroom, classroom)
+        )
+        
+        # Versions are per classroom, and removals older than the prune horizon are gone
+        if classroom is None or since is None or since < versions['pruned_through']:
+            since = None
+        
+        rows = self.db.fetch_all(
+            'SELECT st.authorized_bssid, s.id, s.name, s.classroom, s.branch, s.semester, '
+            '       c.timestamp, c.bssid, c.student_id IS NOT NULL AS checked_in, '
+            '       t.status AS timer_status, t.remaining, t.start_time '
+            'FROM (SELECT authorized_bssid FROM server_settings LIMIT 1) st '
+            'LEFT JOIN students s ON (%s IS NULL OR s.classroom = %s) AND s.status_version > %s '
+            'LEFT JOIN LATERAL ('
+            '    SELECT student_id, timestamp, bssid FROM checkins '
+            '    WHERE student_id = s.id ORDER BY timestamp DESC LIMIT 1'
+            ') c ON TRUE '
+            'LEFT JOIN timers t ON t.student_id = s.id '
+            'ORDER BY s.id',
+            (classroom, classroom, -1 if since is None else since)
+        )
+        
+        status = {
+            'authorized_bssid': rows[0]['authorized_bssid'] if rows else None,
+            'students': {},
+            'version': versions['version'],
+            'full': since is None,
+            'removed': []
+        }
+        
+        for row in rows:
+            if row['id'] is not None:
+                status['students'][row['id']] = self._status_entry(row)
+        
+        if since is not None:
+            removed = self.db.fetch_all(
+                'SELECT DISTINCT student_id FROM status_removals WHERE classroom = %s AND version > %s',
+                (classroom, since)
+            )
+            status['removed'] = [row['student_id'] for row in removed if row['student_id'] not in status['students']]
+        
+        return status
+    
+    @staticmethod
+    def _status_entry(row):
+        return {
+            'name': row['name'],
+            'classroom': row['classroom'],
+            'branch': row['branch'],
+            'semester': row['semester'],
+            'connected': row['checked_in'],
+            'authorized': row['bssid'] == row['authorized_bssid'] if row['checked_in'] else None,
+            'timestamp': row['timestamp'],
+            'timer': {
+                'status': row['timer_status'] or 'stop',
+                'remaining': row['remaining'] if row['timer_status'] else 0,
+                'start_time': row['start_time']
             }
-            
+        }
+    
+    @staticmethod
+    def student_view(student_id, entry, authorized_bssid):
+        """Shape a classroom status entry the way /student/get_status returns it"""
+        return {
+            'student_id': student_id,
+            'name': entry['name'],
+            'classroom': entry['classroom'],
+            'connected': entry['connected'],
+            'authorized': entry['authorized'],
+            'expected_bssid': authorized_bssid,
+            'timestamp': entry['timestamp'],
+            'timer': entry['timer']
+        }
+    
+    def get_student_status(self, student_id):
+        """One student's status in a single query, or None if the student does not exist"""
+        row = self.db.fetch_one(STUDENT_STATUS_SQL, (student_id,))
+        if not row:
+            return None
+        return self.student_view(student_id, self._status_entry(row), row['authorized_bssid'])
+    
+    def mark_status_changed(self, student_ids):
+        """Bump the classroom version and stamp it on students whose dashboard status changed.
+        
+        Bumping the classroom_versions row locks it until commit, so versions of a
+        classroom become visible in order and a delta reader never skips one.
+        """
+        student_ids = list(set(student_ids))
+        if not student_ids:
+            return
+        
+        self.db.execute(STATUS_CHANGED_SQL, (student_ids, student_ids), commit=True)
+    
+    def mark_students_removed(self, removals):
+        """Record (student_id, classroom) pairs that left a classroom's dashboard"""
+        removals = list(removals)
+        if not removals:
+            return
+        
+        student_ids = [student_id for student_id, _ in removals]
+        classrooms = [classroom for _, classroom in removals]
+        self.db.execute(
+            'WITH removed AS ('
+            '    SELECT * FROM unnest(%s::text[], %s::text[]) AS r (student_id, classroom)'
+            '), bumped AS ('
+            '    INSERT INTO classroom_versions (classroom, version) '
+            '    SELECT DISTINCT classroom, 1 FROM removed ORDER BY classroom '
+            '    ON CONFLICT (classroom) DO UPDATE SET version = classroom_versions.version + 1 '
+            '    RETURNING classroom, version'
+            ') '
+            'INSERT INTO status_removals (classroom, student_id, version) '
+            'SELECT r.classroom, r.student_id, b.version FROM removed r JOIN bumped b USING (classroom)',
+            (student_ids, classrooms),
+            commit=True
+        )
+    
+    def mark_classroom_changed(self, classroom=None):
+        """Bump classroom versions for changes not tied to a student (sessions, authorized BSSID)"""
+        if classroom is None:
+            self.db.execute('UPDATE classroom_versions SET version = version + 1', commit=True)
+        else:
             self.db.execute(
-                'UPDATE students SET attendance = %s WHERE id = %s',
-                (json.dumps(attendance), student_id),
+                'INSERT INTO classroom_versions (classroom, version) VALUES (%s, 1) '
+                'ON CONFLICT (classroom) DO UPDATE SET version = classroom_versions.version + 1',
+                (classroom,),
                 commit=True
             )
     
-    def cleanup_checkins(self):
-        """Background thread to clean up old checkins"""
-        while self.running:
-            threshold = (datetime.now() - timedelta(minutes=10)).isoformat()
-            
-            with self.lock:
-                self.db.execute(
-                    'DELETE FROM checkins WHERE timestamp < %s',
-                    (threshold,),
-                    commit=True
-                )
-            
-            time.sleep(60)
+    def get_active_session(self, classroom):
+        session = self.db.fetch_one(ACTIVE_SESSION_SQL, (classroom,))
+        return dict(session) if session else None
     
-    def cleanup_active_devices(self):
-        """Background thread to clean up inactive devices"""
-        while self.running:
-            threshold = (datetime.now() - timedelta(minutes=5)).isoformat()
-            
-            with self.lock:
-                inactive_devices = self.db.fetch_all(
-                    'SELECT student_id FROM active_devices WHERE last_activity < %s',
-                    (threshold,)
-                )
-                
-                for device in inactive_devices:
-                    student_id = device['student_id']
-                    self.db.execute(
-                        'DELETE FROM active_devices WHERE student_id = %s',
-                        (student_id,),
-                        commit=True
-                    )
-                    self.db.execute(
-                        'DELETE FROM checkins WHERE student_id = %s',
-                        (student_id,),
-                        commit=True
-                    )
-                    self.db.execute(
-                        'DELETE FROM timers WHERE student_id = %s',
-                        (student_id,),
-                        commit=True
-                    )
-            
-            time.sleep(60)
+    def prune_status_removals(self):
+        """Background job to drop old removal markers; older deltas fall back to a full snapshot"""
+        self.db.execute(
+            'WITH pruned AS ('
+            "    DELETE FROM status_removals WHERE removed_at < now() - interval '1 day' "
+            '    RETURNING classroom, version'
+            ') '
+            'UPDATE classroom_versions cv SET pruned_through = GREATEST(cv.pruned_through, p.version) '
+            'FROM (SELECT classroom, MAX(version) AS version FROM pruned GROUP BY classroom) p '
+            'WHERE cv.classroom = p.classroom',
+            commit=True
+        )
     
-    def start_timer(self, student_id):
-        """Start timer for a student"""
-        with self.lock:
-            if not self.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
-                return False
-            
-            existing_timer = self.db.fetch_one('SELECT 1 FROM timers WHERE student_id = %s', (student_id,))
-            if existing_timer:
-                self.db.execute(
-                    'UPDATE timers SET status = %s, start_time = %s, duration = %s, remaining = %s WHERE student_id = %s',
-                    ('running', datetime.now().timestamp(), self.TIMER_DURATION, self.TIMER_DURATION, student_id),
-                    commit=True
-                )
-            else:
-                self.db.execute(
-                    'INSERT INTO timers (student_id, status, start_time, duration, remaining) VALUES (%s, %s, %s, %s, %s)',
-                    (student_id, 'running', datetime.now().timestamp(), self.TIMER_DURATION, self.TIMER_DURATION),
-                    commit=True
-                )
+    def get_classroom_bssid(self, classroom):
+        """Return the BSSID a teacher has mapped to this classroom, if any"""
+        teacher = self.db.fetch_one(CLASSROOM_BSSID_SQL, (classroom,))
+        
+        if not teacher:
+            return None
+        return json_loads(teacher['bssid_mapping']).get(classroom)
+    
+    def update_timers(self):
+        """Background job to count running timers down and complete the expired ones.
+        
+        Completion is conditional on the timer still running, so a timer stopped or
+        restarted concurrently is never recorded, and none is recorded twice.
+        """
+        now = datetime.now().timestamp()
+        
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                'UPDATE timers SET status = %s, remaining = 0 '
+                'WHERE status = %s AND start_time + duration <= %s '
+                'RETURNING student_id, start_time, duration',
+                ('completed', 'running', now)
+            )
+            completed = {timer['student_id']: timer for timer in cursor.fetchall()}
+            self.record_timer_attendance(cursor, completed)
             
-            return True
+            cursor.execute(
+                'UPDATE timers SET remaining = GREATEST(0, duration - (%s - start_time))::integer WHERE status = %s',
+                (now, 'running')
+            )
+        
+        # Only transitions count as changes; clients count running timers down themselves
+        self.mark_status_changed(completed)
+        return len(completed)
+    
+    def record_timer_attendance(self, cursor, timers):
+        """Record attendance for completed timers ({student_id: timer}) in the caller's transaction.
+        
+        The student's latest check-in decides present/absent. Returns the stored entries.
+        """
+        if not timers:
+            return []
+        
+        cursor.execute('SELECT authorized_bssid FROM server_settings LIMIT 1')
+        authorized_bssid = cursor.fetchone()['authorized_bssid']
+        
+        cursor.execute(
+            'SELECT s.id, s.classroom, s.branch, s.semester, c.bssid, c.student_id IS NOT NULL AS checked_in '
+            'FROM students s '
+            'LEFT JOIN LATERAL ('
+            '    SELECT student_id, bssid FROM checkins WHERE student_id = s.id ORDER BY timestamp DESC LIMIT 1'
+            ') c ON TRUE '
+            'WHERE s.id = ANY(%s)',
+            (list(timers),)
+        )
+        entries = [
+            self._timer_attendance(
+                student,
+                timers[student['id']],
+                student['checked_in'] and student['bssid'] == authorized_bssid
+            )
+            for student in cursor.fetchall()
+        ]
+        self.store_attendance(cursor, entries)
+        return entries
+    
+    def record_session_attendance(self, cursor, session):
+        """Record attendance for a just-closed session in the caller's transaction.
+        
+        Students who checked in during the session are recorded; the latest check-in
+        decides present/absent. Returns the stored entries.
+        """
+        cursor.execute('SELECT authorized_bssid FROM server_settings LIMIT 1')
+        authorized_bssid = cursor.fetchone()['authorized_bssid']
+        
+        cursor.execute(
+            'SELECT DISTINCT ON (c.student_id) c.student_id, c.bssid FROM checkins c '
+            'JOIN students s ON s.id = c.student_id '
+            'WHERE s.classroom = %s AND c.timestamp BETWEEN %s AND %s '
+            'ORDER BY c.student_id, c.timestamp DESC',
+            (session['classroom'], session['start_time'], session['end_time'])
+        )
+        
+        date_str = datetime.fromisoformat(session['start_time']).date().isoformat()
+        session_key = f"{session['subject']}_{session['id']}"
+        entries = [
+            (checkin['student_id'], date_str, session_key, {
+                'status': 'present' if checkin['bssid'] == authorized_bssid else 'absent',
+                'subject': session['subject'],
+                'classroom': session['classroom'],
+                'start_time': session['start_time'],
+                'end_time': session['end_time'],
+                'branch': session['branch'],
+                'semester': session['semester']
+            })
+            for checkin in cursor.fetchall()
+        ]
+        self.store_attendance(cursor, entries)
+        return entries
+    
+    def _timer_attendance(self, student, timer, is_authorized):
+        """Build the attendance entry for a completed timer, dated by when it ran"""
+        date_str = datetime.fromtimestamp(timer['start_time']).date().isoformat()
+        session_key = f"timer_{int(timer['start_time'])}"
+        
+        return student['id'], date_str, session_key, {
+            'status': 'present' if is_authorized else 'absent',
+            'subject': 'Timer Session',
+            'classroom': student['classroom'],
+            'start_time': datetime.fromtimestamp(timer['start_time']).isoformat(),
+            'end_time': datetime.fromtimestamp(timer['start_time'] + timer['duration']).isoformat(),
+            'branch': student['branch'],
+            'semester': student['semester']
+        }
+    
+    def store_attendance(self, cursor, entries):
+        """Merge (student_id, date, session_key, record) entries into the students' histories.
+        
+        Rows are locked, merged in Python and written back with one batched UPDATE.
+        """
+        by_student = {}
+        for student_id, date_str, session_key, record in entries:
+            by_student.setdefault(student_id, []).append((date_str, session_key, record))
+        
+        if not by_student:
+            return
+        
+        cursor.execute(
+            'SELECT id, attendance FROM students WHERE id = ANY(%s) FOR UPDATE',
+            (list(by_student),)
+        )
+        
+        updates = []
+        counters = {}
+        for student in cursor.fetchall():
+            attendance = json_loads(student['attendance']) if student['attendance'] else {}
+            for date_str, session_key, record in by_student[student['id']]:
+                sessions = attendance.setdefault(date_str, {})
+                # A re-recorded session replaces its old counts
+                if session_key in sessions:
+                    self._count_record(counters, student['id'], sessions[session_key], -1)
+                self._count_record(counters, student['id'], record, 1)
+                sessions[session_key] = record
+            updates.append((student['id'], json_dumps(attendance)))
+        
+        psycopg2.extras.execute_values(
+            cursor,
+            'UPDATE students AS s SET attendance = v.attendance, attendance_version = s.attendance_version + 1 '
+            'FROM (VALUES %s) AS v (id, attendance) WHERE s.id = v.id',
+            updates,
+            page_size=1000
+        )
+        
+        # Same transaction as the history, so the counters never drift from it
+        changes = [(student_id, subject, present, total)
+                   for (student_id, subject), (present, total) in counters.items() if present or total]
+        if changes:
+            psycopg2.extras.execute_values(
+                cursor,
+                'INSERT INTO attendance_counters (student_id, subject, present, total) VALUES %s '
+                'ON CONFLICT (student_id, subject) DO UPDATE SET '
+                'present = attendance_counters.present + EXCLUDED.present, '
+                'total = attendance_counters.total + EXCLUDED.total',
+                sorted(changes),
+                page_size=1000
+            )
+    
+    @staticmethod
+    def _count_record(counters, student_id, record, sign):
+        """Add (sign=1) or remove (sign=-1) one attendance record from per-subject and overall counts"""
+        present = sign if record.get('status') == 'present' else 0
+        for subject in ('*', record.get('subject') or 'N/A'):
+            counts = counters.setdefault((student_id, subject), [0, 0])
+            counts[0] += present
+            counts[1] += sign
+    
+    def rebuild_attendance_counters(self, student_ids=None, cursor=None):
+        """Recompute counters from the raw attendance histories (all students by default)"""
+        if cursor is None:
+            with self.db.transaction() as cursor:
+                return self.rebuild_attendance_counters(student_ids, cursor)
+        
+        if student_ids is None:
+            cursor.execute('SELECT id, attendance FROM students ORDER BY id FOR UPDATE')
+        else:
+            cursor.execute(
+                'SELECT id, attendance FROM students WHERE id = ANY(%s) ORDER BY id FOR UPDATE',
+                (list(student_ids),)
+            )
+        students = cursor.fetchall()
+        
+        counters = {}
+        for student in students:
+            attendance = json_loads(student['attendance']) if student['attendance'] else {}
+            for sessions in attendance.values():
+                for record in sessions.values():
+                    self._count_record(counters, student['id'], record, 1)
+        
+        if student_ids is None:
+            cursor.execute('DELETE FROM attendance_counters')
+        else:
+            cursor.execute('DELETE FROM attendance_counters WHERE student_id = ANY(%s)', (list(student_ids),))
+        
+        if counters:
+            psycopg2.extras.execute_values(
+                cursor,
+                'INSERT INTO attendance_counters (student_id, subject, present, total) VALUES %s',
+                [(student_id, subject, present, total) for (student_id, subject), (present, total) in counters.items()],
+                page_size=1000
+            )
+        
+        return len(students)
+    
+    def get_timetable(self, branch, semester):
+        """Parsed timetable for a branch and semester, with its ETag"""
+        def load():
+            row = self.db.fetch_one(
+                'SELECT timetable FROM timetables WHERE branch = %s AND semester = %s',
+                (branch, semester)
+            )
+            return json_loads(row['timetable']) if row else []
+        
+        return self.reference_cache.get(('timetable', branch, str(semester)), load)
+    
+    def get_special_dates(self):
+        """Current holidays and special schedules in date order, with their ETag"""
+        def load():
+            special_dates = {'holidays': [], 'special_schedules': []}
+            for row in self.db.fetch_all('SELECT date, kind, description FROM calendar_dates ORDER BY date, kind'):
+                key = 'holidays' if row['kind'] == 'holiday' else 'special_schedules'
+                special_dates[key].append({'date': row['date'], 'description': row['description']})
+            return special_dates
+        
+        return self.reference_cache.get(('special_dates',), load)
+    
+    def get_date_info(self, date_str):
+        """Holiday and special schedule entries for one date (a primary key lookup)"""
+        info = {'date': date_str, 'holiday': None, 'special_schedule': None}
+        for row in self.db.fetch_all(
+            'SELECT kind, description FROM calendar_dates WHERE date = %s',
+            (date_str,)
+        ):
+            info[row['kind']] = {'date': date_str, 'description': row['description']}
+        return info
+    
+    def get_attendance_page(self, student_id, date_from=None, date_to=None, page_token=None, limit=None):
+        """Attendance dates in [date_from, date_to] after page_token, limit dates at a time.
+        
+        Returns (attendance, next_page_token); the token is None on the last page.
+        """
+        rows = self.db.fetch_all(
+            'SELECT d.key AS date, d.value AS sessions '
+            "FROM students s, jsonb_each(COALESCE(NULLIF(s.attendance, ''), '{}')::jsonb) d "
+            'WHERE s.id = %s AND (%s IS NULL OR d.key >= %s) AND (%s IS NULL OR d.key <= %s) '
+            'AND (%s IS NULL OR d.key > %s) '
+            'ORDER BY d.key LIMIT %s',
+            (student_id, date_from, date_from, date_to, date_to, page_token, page_token,
+             limit + 1 if limit else None)
+        )
+        
+        next_page_token = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_page_token = rows[-1]['date']
+        
+        return {row['date']: row['sessions'] for row in rows}, next_page_token
+    
+    def get_attendance_summary(self, student_id, date_from=None, date_to=None):
+        """Present/total counts for one student, from the counters unless a date range is given"""
+        if not date_from and not date_to:
+            return self.get_attendance_counters(student_id=student_id).get(
+                student_id, {'present': 0, 'total': 0, 'percentage': 0, 'subjects': {}}
+            )
+        
+        rows = self.db.fetch_all(
+            "SELECT COALESCE(r.value->>'subject', 'N/A') AS subject, "
+            "       count(*) FILTER (WHERE r.value->>'status' = 'present') AS present, count(*) AS total "
+            "FROM students s, jsonb_each(COALESCE(NULLIF(s.attendance, ''), '{}')::jsonb) d, jsonb_each(d.value) r "
+            'WHERE s.id = %s AND (%s IS NULL OR d.key >= %s) AND (%s IS NULL OR d.key <= %s) '
+            'GROUP BY 1 ORDER BY 1',
+            (student_id, date_from, date_from, date_to, date_to)
+        )
+        
+        present = sum(row['present'] for row in rows)
+        total = sum(row['total'] for row in rows)
+        return {
+            'present': present,
+            'total': total,
+            'percentage': round(present / total * 100, 2) if total else 0,
+            'subjects': {row['subject']: {'present': row['present'], 'total': row['total']} for row in rows}
+        }
+    
+    def get_attendance_counters(self, student_id=None, classroom=None):
+        """Counters keyed by student: overall present/total/percentage plus per-subject counts"""
+        rows = self.db.fetch_all(
+            'SELECT c.student_id, c.subject, c.present, c.total FROM attendance_counters c '
+            'JOIN students s ON s.id = c.student_id '
+            'WHERE (%s IS NULL OR c.student_id = %s) AND (%s IS NULL OR s.classroom = %s) '
+            'ORDER BY c.student_id, c.subject',
+            (student_id, student_id, classroom, classroom)
+        )
+        
+        counters = {}
+        for row in rows:
+            student = counters.setdefault(row['student_id'], {'present': 0, 'total': 0, 'percentage': 0, 'subjects': {}})
+            if row['subject'] == '*':
+                student['present'] = row['present']
+                student['total'] = row['total']
+                student['percentage'] = round(row['present'] / row['total'] * 100, 2) if row['total'] else 0
+            else:
+                student['subjects'][row['subject']] = {'present': row['present'], 'total': row['total']}
+        
+        return counters
+    
+    def reconcile_after_restart(self):
+        """Repair timers and sessions left behind while the server was down.
+        
+        Timers whose deadline passed during downtime are completed and their
+        attendance recorded with the timer's own timestamps. Sessions open for
+        longer than SESSION_MAX_HOURS are closed at that limit and their attendance
+        recorded as if they had been ended there. Dashboards of the affected
+        classrooms are notified.
+        """
+        started = time.monotonic()
+        now = datetime.now()
+        
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                'UPDATE timers SET status = %s, remaining = 0 '
+                'WHERE status = %s AND start_time + duration <= %s '
+                'RETURNING student_id, start_time, duration',
+                ('completed', 'running', now.timestamp())
+            )
+            expired = {timer['student_id']: timer for timer in cursor.fetchall()}
+            entries = self.record_timer_attendance(cursor, expired)
+            
+            cutoff = (now - timedelta(hours=self.SESSION_MAX_HOURS)).isoformat()
+            cursor.execute(
+                'UPDATE sessions '
+                "SET end_time = to_char(start_time::timestamp + %s * interval '1 hour', %s) "
+                'WHERE end_time IS NULL AND start_time < %s '
+                'RETURNING *',
+                (self.SESSION_MAX_HOURS, 'YYYY-MM-DD"T"HH24:MI:SS.US', cutoff)
+            )
+            closed_sessions = cursor.fetchall()
+            for session in closed_sessions:
+                entries += self.record_session_attendance(cursor, session)
+        
+        self.mark_status_changed(expired)
+        for classroom in sorted({session['classroom'] for session in closed_sessions}):
+            self.mark_classroom_changed(classroom)
+        
+        report = {
+            'timers_finalized': len(expired),
+            'attendance_recorded': len(entries),
+            'present': sum(1 for entry in entries if entry[3]['status'] == 'present'),
+            'sessions_closed': len(closed_sessions),
+            'duration': round(time.monotonic() - started, 3),
+            'completed_at': datetime.now().isoformat()
+        }
+        logger.info(f"Startup reconciliation: {report}")
+        return report
+    
+    def cleanup_checkins(self):
+        """Background job to clean up old checkins"""
+        threshold = (datetime.now() - timedelta(minutes=10)).isoformat()
+        
+        with self.db.transaction() as cursor:
+            cursor.execute('DELETE FROM checkins WHERE timestamp < %s RETURNING student_id', (threshold,))
+            expired = [row['student_id'] for row in cursor.fetchall()]
+        
+        self.mark_status_changed(expired)
+    
+    def cleanup_active_devices(self):
+        """Background job to clean up inactive devices"""
+        # Flush buffered touches first so active devices are not expired early
+        self.flush_activity()
+        
+        threshold = (datetime.now() - timedelta(minutes=5)).isoformat()
+        # Taken before the delete: a student who logs in again once it commits gets a
+        # token issued after this and must not lose it to the revocation below
+        revoked_at = time.time()
+        
+        # The delete re-checks last_activity, so a device that was touched meanwhile stays
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                'DELETE FROM active_devices WHERE last_activity < %s RETURNING student_id',
+                (threshold,)
+            )
+            inactive = [row['student_id'] for row in cursor.fetchall()]
+            if inactive:
+                cursor.execute('DELETE FROM checkins WHERE student_id = ANY(%s)', (inactive,))
+                cursor.execute('DELETE FROM timers WHERE student_id = ANY(%s)', (inactive,))
+        
+        self.revoke_tokens(inactive, revoked_at)
+        self.mark_status_changed(inactive)
+    
+    def start_timer(self, student_id):
+        """Start (or restart) the student's single timer; False if the student does not exist"""
+        cursor = self.db.execute(
+            START_TIMER_SQL,
+            ('running', datetime.now().timestamp(), self.TIMER_DURATION, self.TIMER_DURATION, student_id),
+            commit=True
+        )
+        if cursor.rowcount == 0:
+            return False
+        
+        self.mark_status_changed([student_id])
+        return True
 
 # Initialize the server
 server = AttendanceServer()
 
 # Cleanup on exit
 def cleanup():
-    server.running = False
-    logger.info("Server shutting down...")
+    server.shutdown()
 
 atexit.register(cleanup)
-signal.signal(signal.SIGTERM, lambda signum, frame: cleanup())
+
+# Admission classes by endpoint; other teacher routes are 'teacher', everything else 'default'
+ADMISSION_CLASSES = {
+    'student_ping': 'heartbeat',
+    'student_checkin': 'heartbeat',
+    'student_get_status': 'heartbeat',
+    'student_start_timer': 'heartbeat',
+    'student_stop_timer': 'heartbeat',
+    'cleanup_dead_sessions': 'heartbeat',
+    'student_login': 'login',
+    'teacher_login': 'login',
+    'teacher_signup': 'login',
+    'register_student': 'login',
+    'change_teacher_password': 'login',
+    'student_get_attendance': 'analytics',
+    'get_sessions': 'analytics',
+    'get_attendance_counters': 'analytics'
+}
+# Streams hold their thread for as long as they are open, so they are not counted
+ADMISSION_EXEMPT = {'status_stream', 'student_stream', 'get_jobs'}
+
+def admission_class_for(endpoint, rule):
+    if endpoint is None or endpoint in ADMISSION_EXEMPT:
+        return None
+    if endpoint == 'batch':
+        return batch_admission_class()
+    if endpoint in ADMISSION_CLASSES:
+        return ADMISSION_CLASSES[endpoint]
+    return 'teacher' if rule.startswith('/teacher/') else 'default'
+
+def batch_admission_class():
+    """A batch is admitted once, as its lowest-priority sub-request, so batching never outranks a route"""
+    sub_requests = (request.get_json(silent=True) or {}).get('requests')
+    if not isinstance(sub_requests, list):
+        return 'default'  # batch() rejects it
+    
+    adapter = app.url_map.bind('')
+    classes = []
+    for sub in sub_requests[:server.BATCH_MAX_REQUESTS]:
+        if batch_request_error(sub):
+            continue  # batch() answers it with a 400
+        try:
+            rule, _ = adapter.match(sub.get('path', ''), sub.get('method', 'GET').upper(), return_rule=True)
+        except Exception:
+            continue  # batch() reports the 404/405
+        if rule.endpoint not in BATCH_EXCLUDED_ENDPOINTS:
+            classes.append(admission_class_for(rule.endpoint, rule.rule) or 'default')
+    
+    return max(classes, key=lambda name: server.admission.classes[name]['priority'], default='default')
+
+@app.before_request
+def track_request():
+    if g.get('in_batch'):
+        return  # Admitted and tracked as part of the enclosing /batch request
+    
+    if not server.accepting:
+        response = jsonify({'error': 'Server is shutting down, please retry'})
+        response.headers['Retry-After'] = '5'
+        response.headers['Connection'] = 'close'
+        return response, 503
+    
+    admission_class = admission_class_for(request.endpoint, request.url_rule.rule if request.url_rule else '')
+    if admission_class:
+        if not server.admission.acquire(admission_class):
+            response = jsonify({'error': 'Server is busy, please retry'})
+            response.headers['Retry-After'] = str(server.admission.retry_after(admission_class))
+            return response, 503
+        g.admission_class = admission_class
+    
+    with server.inflight_cond:
+        server.inflight += 1
+    g.tracked = True
+
+@app.teardown_request
+def untrack_request(exc):
+    if g.get('in_batch'):
+        return
+    
+    admission_class = g.pop('admission_class', None)
+    if admission_class:
+        server.admission.release(admission_class)
+    
+    if g.pop('tracked', False):
+        with server.inflight_cond:
+            server.inflight -= 1
+            server.inflight_cond.notify_all()
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(exc):
+    response = jsonify({'error': 'Server is busy, please retry'})
+    response.headers['Retry-After'] = '2'
+    return response, 503
+
+# Long-lived or recursive endpoints cannot run inside a batch
+BATCH_EXCLUDED_ENDPOINTS = {'batch', 'status_stream', 'student_stream'}
+
+def batch_request_error(sub):
+    """Why a batched sub-request is malformed, or None if it can be dispatched"""
+    if not isinstance(sub, dict):
+        return 'Each request must be an object'
+    if not isinstance(sub.get('path', ''), str) or not isinstance(sub.get('method', 'GET'), str):
+        return 'method and path must be strings'
+    for key in ('params', 'headers'):
+        if not isinstance(sub.get(key) or {}, dict):
+            return f'{key} must be an object'
+    return None
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """Run several sub-requests in one round trip.
+    
+    Body: {"requests": [{"method": "GET", "path": "/teacher/get_status", "params": {...},
+    "body": {...}, "headers": {"If-None-Match": ...}}, ...]}. Sub-requests run in order
+    on one pinned database connection and share this request's Authorization header,
+    so a session token is verified once. The batch is admitted as its lowest-priority
+    sub-request (see batch_admission_class). Returns {"responses": [{"status", "body",
+    "etag"}, ...]} in the same order; a malformed sub-request gets a 400 entry.
+    """
+    data = request.get_json(silent=True) or {}
+    sub_requests = data.get('requests')
+    
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return jsonify({'error': 'A list of requests is required'}), 400
+    if len(sub_requests) > server.BATCH_MAX_REQUESTS:
+        return jsonify({'error': f'At most {server.BATCH_MAX_REQUESTS} requests per batch'}), 400
+    
+    headers = {}
+    if request.headers.get('Authorization'):
+        headers['Authorization'] = request.headers['Authorization']
+    adapter = app.url_map.bind('')
+    
+    responses = []
+    g.in_batch = True
+    try:
+        with server.db.pinned():
+            for sub in sub_requests:
+                error = batch_request_error(sub)
+                if error:
+                    responses.append({'status': 400, 'body': {'error': error}, 'etag': None})
+                    continue
+                
+                method = sub.get('method', 'GET').upper()
+                path = sub.get('path', '')
+                
+                try:
+                    endpoint, _ = adapter.match(path, method)
+                except Exception:
+                    endpoint = None  # Dispatch reports the 404/405
+                if endpoint in BATCH_EXCLUDED_ENDPOINTS:
+                    responses.append({'status': 400, 'body': {'error': f'{path} cannot be batched'}, 'etag': None})
+                    continue
+                
+                sub_headers = dict(headers)
+                if (sub.get('headers') or {}).get('If-None-Match'):
+                    sub_headers['If-None-Match'] = sub['headers']['If-None-Match']
+                
+                try:
+                    with app.test_request_context(
+                        path,
+                        method=method,
+                        query_string=sub.get('params') or {},
+                        json=sub.get('body') if method != 'GET' else None,
+                        headers=sub_headers
+                    ):
+                        response = app.make_response(app.full_dispatch_request())
+                        responses.append({
+                            'status': response.status_code,
+                            'body': response.get_json(silent=True),
+                            'etag': response.get_etag()[0]
+                        })
+                except Exception:
+                    logger.exception(f"Batched request {method} {path} failed")
+                    responses.append({'status': 500, 'body': {'error': 'Internal server error'}, 'etag': None})
+    finally:
+        g.in_batch = False
+    
+    return jsonify({'responses': responses}), 200
+
+@app.route('/server/jobs', methods=['GET'])
+def get_jobs():
+    return jsonify({
+        'jobs': server.scheduler.snapshot(),
+        'leader': server.elector.snapshot(),
+        'admission': server.admission.snapshot(),
+        'reconciliation': server.last_reconciliation
+    }), 200
 
 # Teacher endpoints
 @app.route('/teacher/signup', methods=['POST'])
@@ -425,28 +2159,35 @@ def teacher_signup():
     if not all([teacher_id, password, email, name]):
         return jsonify({'error': 'All fields are required'}), 400
     
-    with server.lock:
-        if server.db.fetch_one('SELECT 1 FROM teachers WHERE id = %s', (teacher_id,)):
-            return jsonify({'error': 'Teacher ID already exists'}), 400
-        if server.db.fetch_one('SELECT 1 FROM teachers WHERE email = %s', (email,)):
-            return jsonify({'error': 'Email already registered'}), 400
-        server.db.execute(
+    if server.db.fetch_one('SELECT 1 FROM teachers WHERE email = %s', (email,)):
+        return jsonify({'error': 'Email already registered'}), 400
+    
+    password_hash = server.hasher.hash(password)
+    
+    # The primary key and the unique email index settle concurrent signups
+    try:
+        cursor = server.db.execute(
             'INSERT INTO teachers (id, password, email, name, classrooms, bssid_mapping, branches, semesters) '
-            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT (id) DO NOTHING',
             (
                 teacher_id,
-                generate_password_hash(password),
+                password_hash,
                 email,
                 name,
-                json.dumps([]),
-                json.dumps({}),
-                json.dumps(["CSE", "ECE", "EEE", "ME", "CE"]),
-                json.dumps(list(range(1, 9)))
+                json_dumps([]),
+                json_dumps({}),
+                json_dumps(["CSE", "ECE", "EEE", "ME", "CE"]),
+                json_dumps(list(range(1, 9)))
             ),
             commit=True
         )
-        
-        return jsonify({'message': 'Registration successful'}), 201
+    except psycopg2.errors.UniqueViolation:
+        return jsonify({'error': 'Email already registered'}), 400
+    
+    if cursor.rowcount == 0:
+        return jsonify({'error': 'Teacher ID already exists'}), 400
+    
+    return jsonify({'message': 'Registration successful'}), 201
 
 @app.route('/teacher/login', methods=['POST'])
 def teacher_login():
@@ -461,15 +2202,16 @@ def teacher_login():
     if not teacher:
         return jsonify({'error': 'Teacher not found'}), 404
     
-    if not check_password_hash(teacher['password'], password):
+    if not server.hasher.verify(teacher['password'], password):
         return jsonify({'error': 'Incorrect password'}), 401
+    server.rehash_password('teachers', teacher_id, teacher['password'], password)
     
     # Convert database row to dict and parse JSON fields
     teacher_dict = dict(teacher)
-    teacher_dict['classrooms'] = json.loads(teacher_dict['classrooms'])
-    teacher_dict['bssid_mapping'] = json.loads(teacher_dict['bssid_mapping'])
-    teacher_dict['branches'] = json.loads(teacher_dict['branches'])
-    teacher_dict['semesters'] = json.loads(teacher_dict['semesters'])
+    teacher_dict['classrooms'] = json_loads(teacher_dict['classrooms'])
+    teacher_dict['bssid_mapping'] = json_loads(teacher_dict['bssid_mapping'])
+    teacher_dict['branches'] = json_loads(teacher_dict['branches'])
+    teacher_dict['semesters'] = json_loads(teacher_dict['semesters'])
     
     return jsonify({
         'message': 'Login successful',
@@ -489,37 +2231,69 @@ def register_student():
     if not all([student_id, password, name, classroom, branch, semester]):
         return jsonify({'error': 'All fields are required'}), 400
     
-    with server.lock:
-        if server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
-            return jsonify({'error': 'Student ID already exists'}), 400
-        
-        server.db.execute(
-            'INSERT INTO students (id, password, name, classroom, branch, semester, attendance) '
-            'VALUES (%s, %s, %s, %s, %s, %s, %s)',
-            (
-                student_id,
-                generate_password_hash(password),
-                name,
-                classroom,
-                branch,
-                semester,
-                json.dumps({})
-            ),
-            commit=True
-        )
-        
-        return jsonify({'message': 'Student registered successfully'}), 201
+    password_hash = server.hasher.hash(password)
+    
+    cursor = server.db.execute(
+        'INSERT INTO students (id, password, name, classroom, branch, semester, attendance) '
+        'VALUES (%s, %s, %s, %s, %s, %s, %s) ON CONFLICT (id) DO NOTHING',
+        (
+            student_id,
+            password_hash,
+            name,
+            classroom,
+            branch,
+            semester,
+            json_dumps({})
+        ),
+        commit=True
+    )
+    if cursor.rowcount == 0:
+        return jsonify({'error': 'Student ID already exists'}), 400
+    
+    server.mark_status_changed([student_id])
+    
+    return jsonify({'message': 'Student registered successfully'}), 201
+
+# Columns get_students may return; password hashes are never exposed
+STUDENT_FIELDS = ('id', 'name', 'classroom', 'branch', 'semester', 'attendance')
+DEFAULT_STUDENT_FIELDS = ('id', 'name', 'classroom', 'branch', 'semester')
+MAX_STUDENTS_PAGE_SIZE = 1000
 
 @app.route('/teacher/get_students', methods=['GET'])
 def get_students():
+    """One page of students in id order.
+    
+    Pass the returned next_cursor as `cursor` for the following page (null on the
+    last one). `fields` is a comma-separated subset of STUDENT_FIELDS; attendance
+    is only included when asked for.
+    """
+    student_id = request.args.get('id')
     classroom = request.args.get('classroom')
     branch = request.args.get('branch')
     semester = request.args.get('semester')
-    
-    query = 'SELECT * FROM students'
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', server.STUDENTS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_STUDENTS_PAGE_SIZE))
+    
+    fields = request.args.get('fields')
+    fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else list(DEFAULT_STUDENT_FIELDS)
+    unknown = [f for f in fields if f not in STUDENT_FIELDS]
+    if unknown:
+        return jsonify({'error': f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(STUDENT_FIELDS)}"}), 400
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    
+    # Column names come from the allowlist above
+    query = f'SELECT {", ".join(fields)} FROM students'
     params = []
     conditions = []
     
+    if student_id:
+        conditions.append('id = %s')
+        params.append(student_id)
+    if cursor:
+        conditions.append('id > %s')
+        params.append(cursor)
     if classroom:
         conditions.append('classroom = %s')
         params.append(classroom)
@@ -533,17 +2307,25 @@ def get_students():
     if conditions:
         query += ' WHERE ' + ' AND '.join(conditions)
     
-    with server.lock:
-        students = server.db.fetch_all(query, params)
-        
-        # Convert to list of dicts and parse attendance
-        students_list = []
-        for student in students:
-            student_dict = dict(student)
-            student_dict['attendance'] = json.loads(student_dict['attendance']) if student_dict['attendance'] else {}
-            students_list.append(student_dict)
+    # One extra row tells whether another page follows
+    query += ' ORDER BY id LIMIT %s'
+    params.append(limit + 1)
+    
+    students = server.db.fetch_all(query, params)
+    has_more = len(students) > limit
+    students = students[:limit]
     
-    return jsonify({'students': students_list}), 200
+    students_list = []
+    for student in students:
+        student_dict = dict(student)
+        if 'attendance' in student_dict:
+            student_dict['attendance'] = json_loads(student_dict['attendance']) if student_dict['attendance'] else {}
+        students_list.append(student_dict)
+    
+    return jsonify({
+        'students': students_list,
+        'next_cursor': students_list[-1]['id'] if has_more else None
+    }), 200
 
 @app.route('/teacher/update_student', methods=['POST'])
 def update_student():
@@ -554,30 +2336,43 @@ def update_student():
     if not student_id or not new_data:
         return jsonify({'error': 'Student ID and new data are required'}), 400
     
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
+    # Build update query
+    set_clauses = []
+    params = []
+    
+    for key, value in new_data.items():
+        if key in ['name', 'classroom', 'branch', 'semester']:
+            set_clauses.append(f'{key} = %s')
+            params.append(value)
+        elif key == 'attendance':
+            set_clauses.append('attendance = %s, attendance_version = attendance_version + 1')
+            params.append(json_dumps(value))
+    
+    if not set_clauses:
+        return jsonify({'error': 'No valid fields to update'}), 400
+    
+    query = f'UPDATE students SET {", ".join(set_clauses)} WHERE id = %s'
+    params.append(student_id)
+    
+    with server.db.transaction() as cursor:
+        # Lock the row so the old classroom is still current when we write
+        cursor.execute('SELECT classroom FROM students WHERE id = %s FOR UPDATE', (student_id,))
+        student = cursor.fetchone()
+        if not student:
             return jsonify({'error': 'Student not found'}), 404
         
-        # Build update query
-        set_clauses = []
-        params = []
-        
-        for key, value in new_data.items():
-            if key in ['name', 'classroom', 'branch', 'semester']:
-                set_clauses.append(f'{key} = %s')
-                params.append(value)
-            elif key == 'attendance':
-                set_clauses.append('attendance = %s')
-                params.append(json.dumps(value))
-        
-        if not set_clauses:
-            return jsonify({'error': 'No valid fields to update'}), 400
-        
-        query = f'UPDATE students SET {", ".join(set_clauses)} WHERE id = %s'
-        params.append(student_id)
-        server.db.execute(query, params, commit=True)
-        
-        return jsonify({'message': 'Student updated successfully'}), 200
+        cursor.execute(query, params)
+        if 'attendance' in new_data:
+            server.rebuild_attendance_counters([student_id], cursor)
+    
+    # Session tokens carry the classroom, so moving a student requires a new login
+    if 'classroom' in new_data:
+        server.revoke_tokens([student_id])
+        if new_data['classroom'] != student['classroom']:
+            server.mark_students_removed([(student_id, student['classroom'])])
+    server.mark_status_changed([student_id])
+    
+    return jsonify({'message': 'Student updated successfully'}), 200
 
 @app.route('/teacher/delete_student', methods=['POST'])
 def delete_student():
@@ -587,19 +2382,21 @@ def delete_student():
     if not student_id:
         return jsonify({'error': 'Student ID is required'}), 400
     
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
+    # Delete all related data, then the student, in one transaction
+    with server.db.transaction() as cursor:
+        cursor.execute('SELECT classroom FROM students WHERE id = %s FOR UPDATE', (student_id,))
+        student = cursor.fetchone()
+        if not student:
             return jsonify({'error': 'Student not found'}), 404
         
-        # Delete all related data
-        server.db.execute('DELETE FROM students WHERE id = %s', (student_id,))
-        server.db.execute('DELETE FROM checkins WHERE student_id = %s', (student_id,))
-        server.db.execute('DELETE FROM timers WHERE student_id = %s', (student_id,))
-        server.db.execute('DELETE FROM active_devices WHERE student_id = %s', (student_id,))
-        server.db.execute('DELETE FROM manual_overrides WHERE student_id = %s', (student_id,))
-        server.db.commit()
-        
-        return jsonify({'message': 'Student deleted successfully'}), 200
+        for table in ('checkins', 'timers', 'active_devices', 'manual_overrides', 'attendance_counters'):
+            cursor.execute(f'DELETE FROM {table} WHERE student_id = %s', (student_id,))
+        cursor.execute('DELETE FROM students WHERE id = %s', (student_id,))
+    
+    server.revoke_tokens([student_id])
+    server.mark_students_removed([(student_id, student['classroom'])])
+    
+    return jsonify({'message': 'Student deleted successfully'}), 200
 
 @app.route('/teacher/update_profile', methods=['POST'])
 def update_teacher_profile():
@@ -610,30 +2407,32 @@ def update_teacher_profile():
     if not teacher_id or not new_data:
         return jsonify({'error': 'Teacher ID and new data are required'}), 400
     
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM teachers WHERE id = %s', (teacher_id,)):
-            return jsonify({'error': 'Teacher not found'}), 404
-        
-        # Build update query
-        set_clauses = []
-        params = []
-        
-        for key, value in new_data.items():
-            if key in ['email', 'name']:
-                set_clauses.append(f'{key} = %s')
-                params.append(value)
-            elif key in ['classrooms', 'bssid_mapping', 'branches', 'semesters']:
-                set_clauses.append(f'{key} = %s')
-                params.append(json.dumps(value))
-        
-        if not set_clauses:
-            return jsonify({'error': 'No valid fields to update'}), 400
-        
-        query = f'UPDATE teachers SET {", ".join(set_clauses)} WHERE id = %s'
-        params.append(teacher_id)
-        server.db.execute(query, params, commit=True)
-        
-        return jsonify({'message': 'Profile updated successfully'}), 200
+    # Build update query
+    set_clauses = []
+    params = []
+    
+    for key, value in new_data.items():
+        if key in ['email', 'name']:
+            set_clauses.append(f'{key} = %s')
+            params.append(value)
+        elif key in ['classrooms', 'bssid_mapping', 'branches', 'semesters']:
+            set_clauses.append(f'{key} = %s')
+            params.append(json_dumps(value))
+    
+    if not set_clauses:
+        return jsonify({'error': 'No valid fields to update'}), 400
+    
+    query = f'UPDATE teachers SET {", ".join(set_clauses)} WHERE id = %s'
+    params.append(teacher_id)
+    try:
+        cursor = server.db.execute(query, params, commit=True)
+    except psycopg2.errors.UniqueViolation:
+        return jsonify({'error': 'Email already registered'}), 400
+    
+    if cursor.rowcount == 0:
+        return jsonify({'error': 'Teacher not found'}), 404
+    
+    return jsonify({'message': 'Profile updated successfully'}), 200
 
 @app.route('/teacher/change_password', methods=['POST'])
 def change_teacher_password():
@@ -645,20 +2444,23 @@ def change_teacher_password():
     if not all([teacher_id, old_password, new_password]):
         return jsonify({'error': 'All fields are required'}), 400
     
-    with server.lock:
-        teacher = server.db.fetch_one('SELECT * FROM teachers WHERE id = %s', (teacher_id,))
-        if not teacher:
-            return jsonify({'error': 'Teacher not found'}), 404
-        
-        if not check_password_hash(teacher['password'], old_password):
-            return jsonify({'error': 'Incorrect current password'}), 401
-        server.db.execute(
-            'UPDATE teachers SET password = %s WHERE id = %s',
-            (generate_password_hash(new_password), teacher_id),
-            commit=True
-        )
-        
-        return jsonify({'message': 'Password changed successfully'}), 200
+    teacher = server.db.fetch_one('SELECT password FROM teachers WHERE id = %s', (teacher_id,))
+    if not teacher:
+        return jsonify({'error': 'Teacher not found'}), 404
+    
+    if not server.hasher.verify(teacher['password'], old_password):
+        return jsonify({'error': 'Incorrect current password'}), 401
+    
+    # Only replace the hash that was verified, so a concurrent change is not overwritten
+    cursor = server.db.execute(
+        'UPDATE teachers SET password = %s WHERE id = %s AND password = %s',
+        (server.hasher.hash(new_password), teacher_id, teacher['password']),
+        commit=True
+    )
+    if cursor.rowcount == 0:
+        return jsonify({'error': 'Password was changed concurrently, please retry'}), 409
+    
+    return jsonify({'message': 'Password changed successfully'}), 200
 
 @app.route('/teacher/update_bssid', methods=['POST'])
 def update_bssid_mapping():
@@ -670,46 +2472,41 @@ def update_bssid_mapping():
     if not all([teacher_id, classroom]):
         return jsonify({'error': 'Teacher ID and classroom are required'}), 400
     
-    with server.lock:
-        teacher = server.db.fetch_one('SELECT * FROM teachers WHERE id = %s', (teacher_id,))
+    with server.db.transaction() as cursor:
+        # The mapping is read, modified and written back, so hold the row meanwhile
+        cursor.execute('SELECT bssid_mapping, classrooms FROM teachers WHERE id = %s FOR UPDATE', (teacher_id,))
+        teacher = cursor.fetchone()
         if not teacher:
-            return jsonify({'error': 'Teacher not found'}), 404        
-        # Get current bssid_mapping
-        bssid_mapping = json.loads(teacher['bssid_mapping'])
+            return jsonify({'error': 'Teacher not found'}), 404
         
-        # Update the mapping
+        bssid_mapping = json_loads(teacher['bssid_mapping'])
+        previous_bssid = bssid_mapping.get(classroom)
         bssid_mapping[classroom] = bssid
         
-        # Update teacher record
-        server.db.execute(
-            'UPDATE teachers SET bssid_mapping = %s WHERE id = %s',
-            (json.dumps(bssid_mapping), teacher_id),
-            commit=True
-        )
-        
         # Add classroom to teacher's classrooms if not present
-        classrooms = json.loads(teacher['classrooms'])
+        classrooms = json_loads(teacher['classrooms'])
         if classroom not in classrooms:
             classrooms.append(classroom)
-            server.db.execute(
-                'UPDATE teachers SET classrooms = %s WHERE id = %s',
-                (json.dumps(classrooms), teacher_id),
-                commit=True
-            )
         
-        # Update authorized BSSID if it matches this classroom's previous BSSID
-        settings = server.db.fetch_one('SELECT authorized_bssid FROM server_settings')
-        if settings['authorized_bssid'] == bssid_mapping.get(classroom):
-            server.db.execute(
-                'UPDATE server_settings SET authorized_bssid = %s',
-                (bssid,),
-                commit=True
-            )
+        cursor.execute(
+            'UPDATE teachers SET bssid_mapping = %s, classrooms = %s WHERE id = %s',
+            (json_dumps(bssid_mapping), json_dumps(classrooms), teacher_id)
+        )
         
-        return jsonify({
-            'message': 'BSSID mapping updated successfully',
-            'bssid_mapping': bssid_mapping
-        }), 200
+        # Update authorized BSSID only if it is still this classroom's previous BSSID
+        cursor.execute(
+            'UPDATE server_settings SET authorized_bssid = %s WHERE authorized_bssid = %s',
+            (bssid, previous_bssid)
+        )
+        authorized_changed = cursor.rowcount > 0
+    
+    if authorized_changed:
+        server.mark_classroom_changed()
+    
+    return jsonify({
+        'message': 'BSSID mapping updated successfully',
+        'bssid_mapping': bssid_mapping
+    }), 200
 
 @app.route('/teacher/start_session', methods=['POST'])
 def start_session():
@@ -723,54 +2520,48 @@ def start_session():
     if not all([teacher_id, classroom, subject]):
         return jsonify({'error': 'Teacher ID, classroom and subject are required'}), 400
     
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM teachers WHERE id = %s', (teacher_id,)):
-            return jsonify({'error': 'Teacher not found'}), 404
-        
-        # Check for existing active session in this classroom
-        active_session = server.db.fetch_one(
-            'SELECT 1 FROM sessions WHERE classroom = %s AND end_time IS NULL',
-            (classroom,)
-        )
-        if active_session:
-            return jsonify({'error': 'There is already an active session for this classroom'}), 400
-        
-        session_id = str(uuid.uuid4())
-        start_time = datetime.now().isoformat()
-        
-        server.db.execute(
-            'INSERT INTO sessions (id, teacher_id, classroom, subject, branch, semester, start_time, ad_hoc) '
-            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
-            (
-                session_id,
-                teacher_id,
-                classroom,
-                subject,
-                branch,
-                semester,
-                start_time,
-                int(data.get('ad_hoc', False))
-            ),
-            commit=True
-        )
-        
-        # Set authorized BSSID from teacher's mapping
-        teacher = server.db.fetch_one('SELECT bssid_mapping FROM teachers WHERE id = %s', (teacher_id,))
-        bssid_mapping = json.loads(teacher['bssid_mapping'])
-        authorized_bssid = bssid_mapping.get(classroom)
-        
-        if authorized_bssid:
-            server.db.execute(
-                'UPDATE server_settings SET authorized_bssid = %s',
-                (authorized_bssid,),
-                commit=True
+    teacher = server.db.fetch_one('SELECT bssid_mapping FROM teachers WHERE id = %s', (teacher_id,))
+    if not teacher:
+        return jsonify({'error': 'Teacher not found'}), 404
+    
+    session_id = str(uuid.uuid4())
+    start_time = datetime.now().isoformat()
+    
+    # Set authorized BSSID from teacher's mapping
+    authorized_bssid = json_loads(teacher['bssid_mapping']).get(classroom)
+    
+    try:
+        with server.db.transaction() as cursor:
+            # sessions_one_open_per_classroom rejects a second open session for the classroom
+            cursor.execute(
+                'INSERT INTO sessions (id, teacher_id, classroom, subject, branch, semester, start_time, ad_hoc) '
+                'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
+                (
+                    session_id,
+                    teacher_id,
+                    classroom,
+                    subject,
+                    branch,
+                    semester,
+                    start_time,
+                    int(data.get('ad_hoc', False))
+                )
             )
-        
-        return jsonify({
-            'message': 'Session started successfully',
-            'session_id': session_id,
-            'authorized_bssid': authorized_bssid
-        }), 201
+            if authorized_bssid:
+                cursor.execute('UPDATE server_settings SET authorized_bssid = %s', (authorized_bssid,))
+    except psycopg2.errors.UniqueViolation:
+        return jsonify({'error': 'There is already an active session for this classroom'}), 400
+    
+    if authorized_bssid:
+        server.mark_classroom_changed()
+    else:
+        server.mark_classroom_changed(classroom)
+    
+    return jsonify({
+        'message': 'Session started successfully',
+        'session_id': session_id,
+        'authorized_bssid': authorized_bssid
+    }), 201
 
 @app.route('/teacher/end_session', methods=['POST'])
 def end_session():
@@ -780,78 +2571,48 @@ def end_session():
     if not session_id:
         return jsonify({'error': 'Session ID is required'}), 400
     
-    with server.lock:
-        session = server.db.fetch_one('SELECT * FROM sessions WHERE id = %s', (session_id,))
-        if not session or session['end_time']:
-            return jsonify({'error': 'Session not found or already ended'}), 404
-        
-        end_time = datetime.now().isoformat()
-        
-        # Update session
-        server.db.execute(
-            'UPDATE sessions SET end_time = %s WHERE id = %s',
-            (end_time, session_id),
-            commit=True
-        )
-        
-        # Record attendance for checked-in students
-        classroom = session['classroom']
-        session_start = datetime.fromisoformat(session['start_time'])
-        session_end = datetime.now()
-        
-        checkins = server.db.fetch_all(
-            'SELECT * FROM checkins WHERE student_id IN '
-            '(SELECT id FROM students WHERE classroom = %s) '
-            'AND timestamp BETWEEN %s AND %s',
-            (classroom, session['start_time'], end_time)
+    end_time = datetime.now().isoformat()
+    
+    with server.db.transaction() as cursor:
+        # Closing is conditional on the session still being open, so only one caller ends it
+        cursor.execute(
+            'UPDATE sessions SET end_time = %s WHERE id = %s AND end_time IS NULL RETURNING *',
+            (end_time, session_id)
         )
+        session = cursor.fetchone()
+        if not session:
+            return jsonify({'error': 'Session not found or already ended'}), 404
         
-        for checkin in checkins:
-            student_id = checkin['student_id']
-            student = server.db.fetch_one('SELECT * FROM students WHERE id = %s', (student_id,))
-            if not student:
-                continue
-            
-            authorized_bssid = server.db.fetch_one('SELECT authorized_bssid FROM server_settings')['authorized_bssid']
-            is_authorized = checkin['bssid'] == authorized_bssid
-            
-            date_str = session_start.date().isoformat()
-            session_key = f"{session['subject']}_{session_id}"
-            
-            attendance = json.loads(student['attendance']) if student['attendance'] else {}
-            if date_str not in attendance:
-                attendance[date_str] = {}
-            
-            attendance[date_str][session_key] = {
-                'status': 'present' if is_authorized else 'absent',
-                'subject': session['subject'],
-                'classroom': classroom,
-                'start_time': session['start_time'],
-                'end_time': end_time,
-                'branch': session['branch'],
-                'semester': session['semester']
-            }
-            
-            server.db.execute(
-                'UPDATE students SET attendance = %s WHERE id = %s',
-                (json.dumps(attendance), student_id),
-                commit=True
-            )
+        server.record_session_attendance(cursor, session)
         
         # Clear authorized BSSID
-        server.db.execute(
-            'UPDATE server_settings SET authorized_bssid = NULL',
-            commit=True
-        )
-        
-        return jsonify({'message': 'Session ended successfully'}), 200
+        cursor.execute('UPDATE server_settings SET authorized_bssid = NULL')
+    
+    server.mark_classroom_changed()
+    
+    return jsonify({'message': 'Session ended successfully'}), 200
+
+MAX_SESSIONS_PAGE_SIZE = 1000
 
 @app.route('/teacher/get_sessions', methods=['GET'])
 def get_sessions():
+    """One page of sessions, newest first.
+    
+    `from`/`to` (YYYY-MM-DD, inclusive) filter on the start date. Pass next_cursor
+    back as `cursor` for the following page. The first page also carries counts
+    over the whole filtered range.
+    """
     teacher_id = request.args.get('teacher_id')
     classroom = request.args.get('classroom')
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', server.SESSIONS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_SESSIONS_PAGE_SIZE))
+    
+    if not all(valid_date(value) for value in (date_from, date_to) if value):
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
     
-    query = 'SELECT * FROM sessions'
     params = []
     conditions = []
     
@@ -861,15 +2622,50 @@ def get_sessions():
     if classroom:
         conditions.append('classroom = %s')
         params.append(classroom)
+    # start_time is ISO text, so date bounds compare as strings
+    if date_from:
+        conditions.append('start_time >= %s')
+        params.append(date_from)
+    if date_to:
+        conditions.append('start_time < %s')
+        params.append((datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d'))
+    
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    
+    counts = None
+    if not cursor:
+        counts = server.db.fetch_one(
+            'SELECT COUNT(*) AS total, '
+            '       COUNT(*) FILTER (WHERE end_time IS NULL) AS active, '
+            '       COUNT(*) FILTER (WHERE ad_hoc = 1) AS ad_hoc '
+            f'FROM sessions{where}',
+            params
+        )
     
-    if conditions:
-        query += ' WHERE ' + ' AND '.join(conditions)
+    page_conditions = list(conditions)
+    page_params = list(params)
+    if cursor:
+        start_time, _, session_id = cursor.partition('|')
+        page_conditions.append('(start_time, id) < (%s, %s)')
+        page_params.extend([start_time, session_id])
     
-    with server.lock:
-        sessions = server.db.fetch_all(query, params)
-        sessions_list = [dict(session) for session in sessions]
+    # One extra row tells whether another page follows
+    query = 'SELECT * FROM sessions'
+    if page_conditions:
+        query += ' WHERE ' + ' AND '.join(page_conditions)
+    query += ' ORDER BY start_time DESC, id DESC LIMIT %s'
+    page_params.append(limit + 1)
     
-    return jsonify({'sessions': sessions_list}), 200
+    sessions = server.db.fetch_all(query, page_params)
+    has_more = len(sessions) > limit
+    sessions_list = [dict(session) for session in sessions[:limit]]
+    
+    last = sessions_list[-1] if sessions_list else None
+    return jsonify({
+        'sessions': sessions_list,
+        'next_cursor': f"{last['start_time']}|{last['id']}" if has_more else None,
+        'counts': dict(counts) if counts else None
+    }), 200
 
 @app.route('/teacher/get_active_sessions', methods=['GET'])
 def get_active_sessions():
@@ -882,9 +2678,8 @@ def get_active_sessions():
         query += ' AND teacher_id = %s'
         params.append(teacher_id)
     
-    with server.lock:
-        sessions = server.db.fetch_all(query, params)
-        sessions_list = [dict(session) for session in sessions]
+    sessions = server.db.fetch_all(query, params)
+    sessions_list = [dict(session) for session in sessions]
     
     return jsonify({'sessions': sessions_list}), 200
 
@@ -896,64 +2691,85 @@ def set_bssid():
     if not bssid:
         return jsonify({'error': 'BSSID is required'}), 400
     
-    with server.lock:
-        server.db.execute(
-            'UPDATE server_settings SET authorized_bssid = %s',
-            (bssid,),
-            commit=True
-        )
+    server.db.execute(
+        'UPDATE server_settings SET authorized_bssid = %s',
+        (bssid,),
+        commit=True
+    )
+    server.mark_classroom_changed()
     
     return jsonify({'message': 'Authorized BSSID set successfully'}), 200
 
 @app.route('/teacher/get_status', methods=['GET'])
 def get_status():
     classroom = request.args.get('classroom')
+    since = request.args.get('since', type=int)
     
-    status = {
-        'authorized_bssid': server.db.fetch_one('SELECT authorized_bssid FROM server_settings')['authorized_bssid'],
-        'students': {}
-    }
+    # One consistent query
+    return jsonify(server.get_classroom_status(classroom or None, since)), 200
+
+def sse_event(event, data, event_id=None):
+    """Format one Server-Sent Events message"""
+    message = f'id: {event_id}\n' if event_id is not None else ''
+    return message + f'event: {event}\ndata: {json_dumps(data)}\n\n'
+
+@app.route('/teacher/status/stream', methods=['GET'])
+def status_stream():
+    classroom = request.args.get('classroom')
+    if not classroom:
+        return jsonify({'error': 'Classroom is required'}), 400
     
-    query = 'SELECT * FROM students'
-    params = []
-    if classroom:
-        query += ' WHERE classroom = %s'
-        params.append(classroom)
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    if last_event_id is None:
+        last_event_id = request.args.get('last_event_id', type=int)
     
-    with server.lock:
-        students = server.db.fetch_all(query, params)
-        
-        for student in students:
-            student_id = student['id']
-            
-            # Get checkin
-            checkin = server.db.fetch_one(
-                'SELECT * FROM checkins WHERE student_id = %s ORDER BY timestamp DESC LIMIT 1',
-                (student_id,)
-            )
-            
-            # Get timer
-            timer = server.db.fetch_one('SELECT * FROM timers WHERE student_id = %s', (student_id,))
-            
-            authorized_bssid = status['authorized_bssid']
-            is_authorized = checkin and checkin['bssid'] == authorized_bssid
-            
-            status['students'][student_id] = {
-                'name': student['name'],
-                'classroom': student['classroom'],
-                'branch': student['branch'],
-                'semester': student['semester'],
-                'connected': checkin is not None,
-                'authorized': is_authorized,
-                'timestamp': checkin['timestamp'] if checkin else None,
-                'timer': {
-                    'status': timer['status'] if timer else 'stop',
-                    'remaining': timer['remaining'] if timer else 0,
-                    'start_time': timer['start_time'] if timer else None
-                }
-            }
+    if not server.teacher_streams.acquire(blocking=False):
+        # The dashboard falls back to polling until it is asked to retry
+        response = jsonify({'error': 'Too many open streams, please poll'})
+        response.headers['Retry-After'] = str(random.randint(30, 60))
+        return response, 503
     
-    return jsonify(status), 200
+    try:
+        subscription = server.broadcaster.subscribe(classroom)
+    except Exception:
+        server.teacher_streams.release()
+        raise
+    
+    def generate():
+        try:
+            # Catch up from Last-Event-ID (or send a full snapshot), then follow live changes
+            status = server.get_classroom_status(classroom, last_event_id)
+            version = status['version']
+            session = server.get_active_session(classroom)
+            yield f'retry: 3000\n\n'
+            yield sse_event('status', status, version)
+            yield sse_event('session', {'active': bool(session), 'session': session}, version)
+            
+            while not subscription.dropped:
+                try:
+                    message = subscription.get(timeout=server.STREAM_HEARTBEAT)
+                except queue.Empty:
+                    yield ': heartbeat\n\n'
+                    continue
+                
+                if message is None:
+                    break
+                
+                event, data, event_version = message
+                if event == 'status' and event_version <= version:
+                    continue
+                version = max(version, event_version)
+                yield sse_event(event, data, event_version)
+        finally:
+            server.broadcaster.unsubscribe(classroom, subscription)
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs when the server closes the response, even if the generator never started
+    response.call_on_close(server.teacher_streams.release)
+    return response
 
 @app.route('/teacher/manual_override', methods=['POST'])
 def manual_override():
@@ -967,30 +2783,21 @@ def manual_override():
     if status not in ['present', 'absent']:
         return jsonify({'error': 'Status must be "present" or "absent"'}), 400
     
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
-            return jsonify({'error': 'Student not found'}), 404
-        
-        # Check if override exists
-        existing = server.db.fetch_one('SELECT 1 FROM manual_overrides WHERE student_id = %s', (student_id,))
-        
-        if existing:
-            server.db.execute(
-                'UPDATE manual_overrides SET status = %s WHERE student_id = %s',
-                (status, student_id),
-                commit=True
-            )
-        else:
-            server.db.execute(
-                'INSERT INTO manual_overrides (student_id, status) VALUES (%s, %s)',
-                (student_id, status),
-                commit=True
-            )
-        
-        if status == 'present':
-            server.start_timer(student_id)
-        
-        return jsonify({'message': f'Student {student_id} marked as {status}'}), 200
+    cursor = server.db.execute(
+        'INSERT INTO manual_overrides (student_id, status) SELECT id, %s FROM students WHERE id = %s '
+        'ON CONFLICT (student_id) DO UPDATE SET status = EXCLUDED.status',
+        (status, student_id),
+        commit=True
+    )
+    if cursor.rowcount == 0:
+        return jsonify({'error': 'Student not found'}), 404
+    
+    if status == 'present':
+        server.start_timer(student_id)
+    else:
+        server.mark_status_changed([student_id])
+    
+    return jsonify({'message': f'Student {student_id} marked as {status}'}), 200
 
 @app.route('/teacher/random_ring', methods=['POST'])
 def random_ring():
@@ -999,79 +2806,172 @@ def random_ring():
     if not classroom:
         return jsonify({'error': 'Classroom is required'}), 400
     
-    with server.lock:
-        # Get all students in classroom with attendance data
-        students = server.db.fetch_all(
-            'SELECT id, name, attendance FROM students WHERE classroom = %s',
-            (classroom,)
-        )
-        
-        if len(students) < 2:
-            return jsonify({'error': 'Need at least 2 students for random ring'}), 400
-        
-        # Calculate attendance percentages
-        student_stats = []
-        for student in students:
-            attendance = json.loads(student['attendance']) if student['attendance'] else {}
-            total_sessions = sum(len(sessions) for sessions in attendance.values())
-            present_sessions = sum(1 for sessions in attendance.values() 
-                                 for session in sessions.values() if session.get('status') == 'present')
-            percentage = round((present_sessions / total_sessions) * 100) if total_sessions > 0 else 0
-            
-            student_stats.append({
-                'id': student['id'],
-                'name': student['name'],
-                'attendance_percentage': percentage
-            })
-        
-        # Sort by attendance percentage
-        student_stats.sort(key=lambda x: x['attendance_percentage'])
-        
-        # Select one from bottom 30% and one from top 30%
-        split_point = max(1, len(student_stats) // 3)
-        low_attendance = student_stats[:split_point]
-        high_attendance = student_stats[-split_point:]
-        
-        selected_low = random.choice(low_attendance)
-        selected_high = random.choice(high_attendance)
-        
-        return jsonify({
-            'message': 'Random ring selection complete',
-            'low_attendance_student': selected_low,
-            'high_attendance_student': selected_high
-        }), 200
+    # Rank the classroom on the precomputed counters and sample one student from the
+    # bottom third and one from the top third, all in the database
+    rows = server.db.fetch_all(
+        'WITH ranked AS ('
+        '    SELECT s.id, s.name, '
+        '           COALESCE(ROUND(c.present * 100.0 / NULLIF(c.total, 0)), 0)::int AS attendance_percentage, '
+        '           count(*) OVER () AS students '
+        '    FROM students s '
+        "    LEFT JOIN attendance_counters c ON c.student_id = s.id AND c.subject = '*' "
+        '    WHERE s.classroom = %s'
+        '), numbered AS ('
+        '    SELECT *, row_number() OVER (ORDER BY attendance_percentage, random()) AS position, '
+        '           GREATEST(1, students / 3) AS split_point '
+        '    FROM ranked'
+        ') '
+        "(SELECT 'low' AS band, id, name, attendance_percentage, students FROM numbered "
+        ' WHERE position <= split_point ORDER BY random() LIMIT 1) '
+        'UNION ALL '
+        "(SELECT 'high' AS band, id, name, attendance_percentage, students FROM numbered "
+        ' WHERE position > students - split_point ORDER BY random() LIMIT 1)',
+        (classroom,)
+    )
+    
+    if not rows or rows[0]['students'] < 2:
+        return jsonify({'error': 'Need at least 2 students for random ring'}), 400
+    
+    selected = {
+        row['band']: {'id': row['id'], 'name': row['name'], 'attendance_percentage': row['attendance_percentage']}
+        for row in rows
+    }
+    
+    return jsonify({
+        'message': 'Random ring selection complete',
+        'low_attendance_student': selected['low'],
+        'high_attendance_student': selected['high']
+    }), 200
+
+@app.route('/teacher/get_attendance_counters', methods=['GET'])
+def get_attendance_counters():
+    student_id = request.args.get('student_id')
+    classroom = request.args.get('classroom')
+    
+    if not student_id and not classroom:
+        return jsonify({'error': 'Student ID or classroom is required'}), 400
+    
+    return jsonify({'counters': server.get_attendance_counters(student_id, classroom)}), 200
+
+def etag_matches(etag):
+    """If-None-Match check that also accepts the ':<encoding>' suffix compression adds to ETags"""
+    return request.if_none_match.star_tag or any(tag.split(':')[0] == etag for tag in request.if_none_match)
+
+def flag_arg(name):
+    """Boolean query parameter: 1/true/yes/on enable it, anything else (or absent) does not"""
+    return request.args.get(name, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+def conditional_response(data, etag):
+    """JSON response clients must revalidate; a matching If-None-Match gets a 304"""
+    if etag_matches(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(data)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/teacher/get_special_dates', methods=['GET'])
 def get_special_dates():
-    with server.lock:
-        special_dates = server.db.fetch_one('SELECT * FROM special_dates ORDER BY id DESC LIMIT 1')
-        
-        if special_dates:
-            return jsonify({
-                'holidays': json.loads(special_dates['holidays']),
-                'special_schedules': json.loads(special_dates['special_schedules'])
-            }), 200
-        else:
-            return jsonify({
-                'holidays': [],
-                'special_schedules': []
-            }), 200
+    special_dates, etag = server.get_special_dates()
+    return conditional_response(special_dates, etag)
+
+CALENDAR_KINDS = ('holiday', 'special_schedule')
+
+def valid_date(value):
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+        return True
+    except (TypeError, ValueError):
+        return False
 
 @app.route('/teacher/update_special_dates', methods=['POST'])
 def update_special_dates():
+    """Replace the whole calendar; only rows that actually changed are written"""
     data = request.json
     holidays = data.get('holidays', [])
     special_dates = data.get('special_dates', [])
     
-    with server.lock:
-        server.db.execute(
-            'INSERT INTO special_dates (holidays, special_schedules) VALUES (%s, %s)',
-            (json.dumps(holidays), json.dumps(special_dates)),
-            commit=True
+    for listed in (holidays, special_dates):
+        if not isinstance(listed, list) or not all(
+            isinstance(entry, dict) and isinstance(entry.get('description', ''), str) for entry in listed
+        ):
+            return jsonify({'error': 'holidays and special_dates must be lists of {date, description} objects'}), 400
+    
+    entries = {(h.get('date'), 'holiday'): h.get('description', '') for h in holidays}
+    entries.update({(d.get('date'), 'special_schedule'): d.get('description', '') for d in special_dates})
+    if not all(valid_date(date_str) for date_str, kind in entries):
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    
+    with server.db.transaction() as cursor:
+        dates = [date_str for date_str, kind in entries]
+        kinds = [kind for date_str, kind in entries]
+        cursor.execute(
+            'DELETE FROM calendar_dates c WHERE NOT EXISTS ('
+            '    SELECT 1 FROM unnest(%s::text[], %s::text[]) AS k (date, kind) '
+            '    WHERE k.date = c.date AND k.kind = c.kind'
+            ')',
+            (dates, kinds)
         )
+        if entries:
+            psycopg2.extras.execute_values(
+                cursor,
+                'INSERT INTO calendar_dates (date, kind, description) VALUES %s '
+                'ON CONFLICT (date, kind) DO UPDATE SET description = EXCLUDED.description '
+                'WHERE calendar_dates.description IS DISTINCT FROM EXCLUDED.description',
+                [(date_str, kind, description) for (date_str, kind), description in entries.items()]
+            )
+    server.reference_cache.invalidate(('special_dates',))
     
     return jsonify({'message': 'Special dates updated successfully'}), 200
 
+@app.route('/teacher/set_special_date', methods=['POST'])
+def set_special_date():
+    data = request.json
+    date_str = data.get('date')
+    kind = data.get('kind')
+    description = data.get('description', '')
+    
+    if not valid_date(date_str) or kind not in CALENDAR_KINDS:
+        return jsonify({'error': f"A YYYY-MM-DD date and a kind ({', '.join(CALENDAR_KINDS)}) are required"}), 400
+    
+    server.db.execute(
+        'INSERT INTO calendar_dates (date, kind, description) VALUES (%s, %s, %s) '
+        'ON CONFLICT (date, kind) DO UPDATE SET description = EXCLUDED.description',
+        (date_str, kind, description),
+        commit=True
+    )
+    server.reference_cache.invalidate(('special_dates',))
+    
+    return jsonify({'message': 'Special date saved successfully'}), 200
+
+@app.route('/teacher/delete_special_date', methods=['POST'])
+def delete_special_date():
+    data = request.json
+    date_str = data.get('date')
+    kind = data.get('kind')
+    
+    if not date_str or kind not in CALENDAR_KINDS:
+        return jsonify({'error': f"Date and kind ({', '.join(CALENDAR_KINDS)}) are required"}), 400
+    
+    server.db.execute(
+        'DELETE FROM calendar_dates WHERE date = %s AND kind = %s',
+        (date_str, kind),
+        commit=True
+    )
+    server.reference_cache.invalidate(('special_dates',))
+    
+    return jsonify({'message': 'Special date removed successfully'}), 200
+
+@app.route('/teacher/get_date_info', methods=['GET'])
+def get_date_info():
+    date_str = request.args.get('date') or datetime.now().strftime('%Y-%m-%d')
+    
+    if not valid_date(date_str):
+        return jsonify({'error': 'Date must be YYYY-MM-DD'}), 400
+    
+    return jsonify(server.get_date_info(date_str)), 200
+
 @app.route('/teacher/get_timetable', methods=['GET'])
 def get_timetable():
     branch = request.args.get('branch')
@@ -1080,16 +2980,8 @@ def get_timetable():
     if not branch or not semester:
         return jsonify({'error': 'Branch and semester are required'}), 400
     
-    with server.lock:
-        timetable = server.db.fetch_one(
-            'SELECT timetable FROM timetables WHERE branch = %s AND semester = %s',
-            (branch, semester)
-        )
-        
-        if timetable:
-            return jsonify({'timetable': json.loads(timetable['timetable'])}), 200
-        else:
-            return jsonify({'timetable': []}), 200
+    timetable, etag = server.get_timetable(branch, semester)
+    return conditional_response({'timetable': timetable}, etag)
 
 @app.route('/teacher/update_timetable', methods=['POST'])
 def update_timetable():
@@ -1101,28 +2993,47 @@ def update_timetable():
     if not branch or not semester:
         return jsonify({'error': 'Branch and semester are required'}), 400
     
-    with server.lock:
-        existing = server.db.fetch_one(
-            'SELECT 1 FROM timetables WHERE branch = %s AND semester = %s',
-            (branch, semester)
-        )
-        
-        if existing:
-            server.db.execute(
-                'UPDATE timetables SET timetable = %s WHERE branch = %s AND semester = %s',
-                (json.dumps(timetable), branch, semester),
-                commit=True
-            )
-        else:
-            server.db.execute(
-                'INSERT INTO timetables (branch, semester, timetable) VALUES (%s, %s, %s)',
-                (branch, semester, json.dumps(timetable)),
-                commit=True
-            )
+    server.db.execute(
+        'INSERT INTO timetables (branch, semester, timetable) VALUES (%s, %s, %s) '
+        'ON CONFLICT (branch, semester) DO UPDATE SET timetable = EXCLUDED.timetable',
+        (branch, semester, json_dumps(timetable)),
+        commit=True
+    )
+    server.reference_cache.invalidate(('timetable', branch, str(semester)))
     
     return jsonify({'message': 'Timetable updated successfully'}), 200
 
 # Student endpoints
+def authenticate_student(student_id, device_id):
+    """Check that a request comes from the student's active device.
+    
+    Requests carrying a session token (Authorization: Bearer ...) are verified
+    in-process; clients without one fall back to the database lookups.
+    Returns (claims, error_response); claims is None on the fallback path.
+    """
+    auth_header = request.headers.get('Authorization', '')
+    
+    # Sub-requests of one /batch share `g`, so each identity is checked once
+    checked = g.setdefault('authenticated', {})
+    key = (auth_header, student_id, device_id)
+    if key in checked:
+        return checked[key], None
+    
+    claims, error = _authenticate_student(auth_header, student_id, device_id)
+    if not error:
+        checked[key] = claims
+    return claims, error
+
+def _authenticate_student(auth_header, student_id, device_id):
+    claims, failure = student_token_check(auth_header, student_id, device_id)
+    if not (claims or failure):
+        failure = student_device_error(server.db.fetch_one(STUDENT_DEVICE_SQL, (student_id, student_id, device_id)))
+    
+    if failure:
+        message, status = failure
+        return None, (jsonify({'error': message}), status)
+    return claims, None
+
 @app.route('/student/login', methods=['POST'])
 def student_login():
     data = request.json
@@ -1133,63 +3044,46 @@ def student_login():
     if not all([student_id, password, device_id]):
         return jsonify({'error': 'ID, password and device ID are required'}), 400
     
-    with server.lock:
-        student = server.db.fetch_one('SELECT * FROM students WHERE id = %s', (student_id,))
-        if not student:
-            return jsonify({'error': 'Student not found'}), 404
-        
-        if not check_password_hash(student['password'], password):
-            return jsonify({'error': 'Incorrect password'}), 401
-        
-        # Check if already logged in on another device
-        active_device = server.db.fetch_one(
-            'SELECT * FROM active_devices WHERE student_id = %s AND device_id != %s',
-            (student_id, device_id)
-        )
-        if active_device:
-            return jsonify({'error': 'This account is already logged in on another device'}), 403
-        
-        # Update or insert active device
-        existing = server.db.fetch_one(
-            'SELECT 1 FROM active_devices WHERE student_id = %s',
-            (student_id,)
-        )
-        
-        if existing:
-            server.db.execute(
-                'UPDATE active_devices SET device_id = %s, last_activity = %s WHERE student_id = %s',
-                (device_id, datetime.now().isoformat(), student_id),
-                commit=True
-            )
-        else:
-            server.db.execute(
-                'INSERT INTO active_devices (student_id, device_id, last_activity) VALUES (%s, %s, %s)',
-                (student_id, device_id, datetime.now().isoformat()),
-                commit=True
-            )
-        
-        # Get classroom BSSID from any teacher
-        teacher = server.db.fetch_one(
-            'SELECT bssid_mapping FROM teachers WHERE json_extract(classrooms, ?) IS NOT NULL',
-            (f'$."{student["classroom"]}"',)
-        )
-        
-        classroom_bssid = None
-        if teacher:
-            bssid_mapping = json.loads(teacher['bssid_mapping'])
-            classroom_bssid = bssid_mapping.get(student['classroom'])
-        
-        return jsonify({
-            'message': 'Login successful',
-            'student': {
-                'id': student['id'],
-                'name': student['name'],
-                'classroom': student['classroom'],
-                'branch': student['branch'],
-                'semester': student['semester']
-            },
-            'classroom_bssid': classroom_bssid
-        }), 200
+    student = server.db.fetch_one('SELECT * FROM students WHERE id = %s', (student_id,))
+    if not student:
+        return jsonify({'error': 'Student not found'}), 404
+    
+    if not server.hasher.verify(student['password'], password):
+        return jsonify({'error': 'Incorrect password'}), 401
+    server.rehash_password('students', student_id, student['password'], password)
+    
+    # One active device per student: claim the row only if it is free or already this device's
+    cursor = server.db.execute(
+        'INSERT INTO active_devices (student_id, device_id, last_activity) VALUES (%s, %s, %s) '
+        'ON CONFLICT (student_id) DO UPDATE SET last_activity = EXCLUDED.last_activity '
+        'WHERE active_devices.device_id = EXCLUDED.device_id',
+        (student_id, device_id, datetime.now().isoformat()),
+        commit=True
+    )
+    if cursor.rowcount == 0:
+        return jsonify({'error': 'This account is already logged in on another device'}), 403
+    
+    # Get classroom BSSID from any teacher
+    classroom_bssid = server.get_classroom_bssid(student['classroom'])
+    
+    # Tokens from any earlier login (e.g. a device that was taken over) stop working
+    issued_at = time.time()
+    server.revoke_tokens([student_id], issued_at)
+    session_token = server.issue_token(student_id, device_id, student['classroom'], issued_at)
+    
+    return jsonify({
+        'message': 'Login successful',
+        'session_token': session_token,
+        'token_expires_in': server.TOKEN_MAX_AGE,
+        'student': {
+            'id': student['id'],
+            'name': student['name'],
+            'classroom': student['classroom'],
+            'branch': student['branch'],
+            'semester': student['semester']
+        },
+        'classroom_bssid': classroom_bssid
+    }), 200
 
 @app.route('/student/checkin', methods=['POST'])
 def student_checkin():
@@ -1201,65 +3095,30 @@ def student_checkin():
     if not all([student_id, device_id]):
         return jsonify({'error': 'Student ID and device ID are required'}), 400
 
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
-            return jsonify({'error': 'Student not found'}), 404
-
-        active_device = server.db.fetch_one(
-            'SELECT 1 FROM active_devices WHERE student_id = %s AND device_id = %s',
-            (student_id, device_id)
-        )
-        if not active_device:
-            return jsonify({'error': 'Unauthorized device'}), 403
+    claims, error = authenticate_student(student_id, device_id)
+    if error:
+        return error
 
-        # Update last activity
-        server.db.execute(
-            'UPDATE active_devices SET last_activity = %s WHERE student_id = %s',
-            (datetime.now().isoformat(), student_id),
-            commit=True
-        )
+    # Update last activity
+    server.touch_device(student_id)
 
-        # Record checkin
-        existing_checkin = server.db.fetch_one(
-            'SELECT 1 FROM checkins WHERE student_id = %s AND device_id = %s',
-            (student_id, device_id)
-        )
-        
-        if existing_checkin:
-            server.db.execute(
-                'UPDATE checkins SET timestamp = %s, bssid = %s WHERE student_id = %s AND device_id = %s',
-                (datetime.now().isoformat(), bssid, student_id, device_id),
-                commit=True
-            )
-        else:
-            server.db.execute(
-                'INSERT INTO checkins (student_id, timestamp, bssid, device_id) VALUES (%s, %s, %s, %s)',
-                (student_id, datetime.now().isoformat(), bssid, device_id),
-                commit=True
-            )
+    # Record checkin
+    server.db.execute(RECORD_CHECKIN_SQL, (student_id, datetime.now().isoformat(), bssid, device_id), commit=True)
 
-        # Get authorized BSSID for student's classroom
-        student = server.db.fetch_one('SELECT classroom FROM students WHERE id = %s', (student_id,))
-        classroom = student['classroom']
-        
-        teacher = server.db.fetch_one(
-            'SELECT bssid_mapping FROM teachers WHERE json_extract(classrooms, ?) IS NOT NULL',
-            (f'$."{classroom}"',)
-        )
-        
-        authorized_bssid = None
-        if teacher:
-            bssid_mapping = json.loads(teacher['bssid_mapping'])
-            authorized_bssid = bssid_mapping.get(classroom)
+    # Get authorized BSSID for student's classroom
+    if claims:
+        classroom = claims['cls']
+    else:
+        classroom = server.db.fetch_one(STUDENT_CLASSROOM_SQL, (student_id,))['classroom']
+    
+    authorized_bssid = server.get_classroom_bssid(classroom)
 
-        if bssid and bssid == authorized_bssid:
-            server.start_timer(student_id)
+    if bssid and bssid == authorized_bssid:
+        server.start_timer(student_id)
+    else:
+        server.mark_status_changed([student_id])
 
-        return jsonify({
-            'message': 'Check-in successful',
-            'status': 'present' if bssid and bssid == authorized_bssid else 'absent',
-            'authorized_bssid': authorized_bssid
-        }), 200
+    return jsonify(checkin_result(bssid, authorized_bssid)), 200
 
 @app.route('/student/timer/start', methods=['POST'])
 def student_start_timer():
@@ -1270,52 +3129,36 @@ def student_start_timer():
     if not all([student_id, device_id]):
         return jsonify({'error': 'Student ID and device ID are required'}), 400
 
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
-            return jsonify({'error': 'Student not found'}), 404
-
-        if not server.db.fetch_one(
-            'SELECT 1 FROM active_devices WHERE student_id = %s AND device_id = %s',
-            (student_id, device_id)
-        ):
-            return jsonify({'error': 'Unauthorized device'}), 403
+    claims, error = authenticate_student(student_id, device_id)
+    if error:
+        return error
 
-        # Check authorization via latest checkin
-        checkin = server.db.fetch_one(
-            'SELECT * FROM checkins WHERE student_id = %s ORDER BY timestamp DESC LIMIT 1',
-            (student_id,)
-        )
+    # Check authorization via latest checkin
+    checkin = server.db.fetch_one(
+        'SELECT * FROM checkins WHERE student_id = %s ORDER BY timestamp DESC LIMIT 1',
+        (student_id,)
+    )
 
-        # Get authorized BSSID for student's classroom
-        student = server.db.fetch_one('SELECT classroom FROM students WHERE id = %s', (student_id,))
-        classroom = student['classroom']
-        
-        teacher = server.db.fetch_one(
-            'SELECT bssid_mapping FROM teachers WHERE json_extract(classrooms, ?) IS NOT NULL',
-            (f'$."{classroom}"',)
-        )
-        
-        authorized_bssid = None
-        if teacher:
-            bssid_mapping = json.loads(teacher['bssid_mapping'])
-            authorized_bssid = bssid_mapping.get(classroom)
+    # Get authorized BSSID for student's classroom
+    if claims:
+        classroom = claims['cls']
+    else:
+        classroom = server.db.fetch_one('SELECT classroom FROM students WHERE id = %s', (student_id,))['classroom']
+    
+    authorized_bssid = server.get_classroom_bssid(classroom)
 
-        if not checkin or checkin['bssid'] != authorized_bssid:
-            return jsonify({'error': 'Not authorized to start timer - BSSID mismatch'}), 403
+    if not checkin or checkin['bssid'] != authorized_bssid:
+        return jsonify({'error': 'Not authorized to start timer - BSSID mismatch'}), 403
 
-        # Update last activity
-        server.db.execute(
-            'UPDATE active_devices SET last_activity = %s WHERE student_id = %s',
-            (datetime.now().isoformat(), student_id),
-            commit=True
-        )
+    # Update last activity
+    server.touch_device(student_id)
 
-        server.start_timer(student_id)
+    server.start_timer(student_id)
 
-        return jsonify({
-            'message': 'Timer started successfully',
-            'status': 'running'
-        }), 200
+    return jsonify({
+        'message': 'Timer started successfully',
+        'status': 'running'
+    }), 200
 
 @app.route('/student/timer/stop', methods=['POST'])
 def student_stop_timer():
@@ -1326,40 +3169,28 @@ def student_stop_timer():
     if not all([student_id, device_id]):
         return jsonify({'error': 'Student ID and device ID are required'}), 400
     
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
-            return jsonify({'error': 'Student not found'}), 404
-        
-        if not server.db.fetch_one(
-            'SELECT 1 FROM active_devices WHERE student_id = %s AND device_id = %s',
-            (student_id, device_id)
-        ):
-            return jsonify({'error': 'Unauthorized device'}), 403
-        
-        timer = server.db.fetch_one('SELECT * FROM timers WHERE student_id = %s', (student_id,))
-        if not timer or timer['status'] == 'stop':
-            return jsonify({'error': 'No active timer to stop'}), 400
-        
-        # Update last activity
-        server.db.execute(
-            'UPDATE active_devices SET last_activity = %s WHERE student_id = %s',
-            (datetime.now().isoformat(), student_id),
-            commit=True
-        )
-        
-        if timer['status'] == 'running':
-            server.record_attendance(student_id)
-        
-        server.db.execute(
-            'UPDATE timers SET status = %s, remaining = 0 WHERE student_id = %s',
-            ('stop', student_id),
-            commit=True
-        )
-        
-        return jsonify({
-            'message': 'Timer stopped successfully',
-            'status': 'stop'
-        }), 200
+    claims, error = authenticate_student(student_id, device_id)
+    if error:
+        return error
+    
+    # Conditional on the timer not being stopped already, so concurrent stops report once;
+    # a completed timer was already recorded by update_timers
+    cursor = server.db.execute(
+        'UPDATE timers SET status = %s, remaining = 0 WHERE student_id = %s AND status != %s',
+        ('stop', student_id, 'stop'),
+        commit=True
+    )
+    if cursor.rowcount == 0:
+        return jsonify({'error': 'No active timer to stop'}), 400
+    
+    # Update last activity
+    server.touch_device(student_id)
+    server.mark_status_changed([student_id])
+    
+    return jsonify({
+        'message': 'Timer stopped successfully',
+        'status': 'stop'
+    }), 200
 
 @app.route('/student/get_status', methods=['GET'])
 def student_get_status():
@@ -1369,81 +3200,145 @@ def student_get_status():
     if not all([student_id, device_id]):
         return jsonify({'error': 'Student ID and device ID are required'}), 400
     
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
-            return jsonify({'error': 'Student not found'}), 404
-        
-        if not server.db.fetch_one(
-            'SELECT 1 FROM active_devices WHERE student_id = %s AND device_id = %s',
-            (student_id, device_id)
-        ):
-            return jsonify({'error': 'Unauthorized device'}), 403
-        
-        # Update last activity
-        server.db.execute(
-            'UPDATE active_devices SET last_activity = %s WHERE student_id = %s',
-            (datetime.now().isoformat(), student_id),
-            commit=True
-        )
-        
-        # Get checkin
-        checkin = server.db.fetch_one(
-            'SELECT * FROM checkins WHERE student_id = %s ORDER BY timestamp DESC LIMIT 1',
-            (student_id,)
-        )
-        
-        # Get timer
-        timer = server.db.fetch_one('SELECT * FROM timers WHERE student_id = %s', (student_id,))
-        
-        authorized_bssid = server.db.fetch_one('SELECT authorized_bssid FROM server_settings')['authorized_bssid']
-        is_authorized = checkin and checkin['bssid'] == authorized_bssid
-        
-        status = {
-            'student_id': student_id,
-            'name': server.db.fetch_one('SELECT name FROM students WHERE id = %s', (student_id,))['name'],
-            'classroom': server.db.fetch_one('SELECT classroom FROM students WHERE id = %s', (student_id,))['classroom'],
-            'connected': checkin is not None,
-            'authorized': is_authorized,
-            'timestamp': checkin['timestamp'] if checkin else None,
-            'timer': {
-                'status': timer['status'] if timer else 'stop',
-                'remaining': timer['remaining'] if timer else 0,
-                'start_time': timer['start_time'] if timer else None
-            }
-        }
-        
-        return jsonify(status), 200
+    claims, error = authenticate_student(student_id, device_id)
+    if error:
+        return error
+    
+    # Update last activity
+    server.touch_device(student_id)
+    
+    status = server.get_student_status(student_id)
+    if not status:
+        return jsonify({'error': 'Student not found'}), 404
+    
+    return jsonify(status), 200
+
+@app.route('/student/stream', methods=['GET'])
+def student_stream():
+    """Live timer, session and authorization updates; the open connection is the liveness heartbeat"""
+    student_id = request.args.get('student_id')
+    device_id = request.args.get('device_id')
+    
+    if not all([student_id, device_id]):
+        return jsonify({'error': 'Student ID and device ID are required'}), 400
+    
+    claims, error = authenticate_student(student_id, device_id)
+    if error:
+        return error
+    if not claims:
+        # Revocation must be able to end the stream, so it needs a session token
+        return jsonify({'error': 'Session token required'}), 401
+    
+    if not server.student_streams.acquire(blocking=False):
+        # The client keeps pinging and polling until it is asked to retry
+        response = jsonify({'error': 'Too many open streams, please poll'})
+        response.headers['Retry-After'] = str(random.randint(30, 60))
+        return response, 503
+    
+    token = request.headers['Authorization'][len('Bearer '):]
+    classroom = claims['cls']
+    try:
+        subscription = server.broadcaster.subscribe(classroom)
+    except Exception:
+        server.student_streams.release()
+        raise
+    
+    def generate():
+        try:
+            server.touch_device(student_id)
+            version = server.db.fetch_one(CLASSROOM_VERSION_SQL, (classroom,))['version']
+            session = server.get_active_session(classroom)
+            yield f'retry: 3000\n\n'
+            yield sse_event('status', server.get_student_status(student_id), version)
+            yield sse_event('session', {'active': bool(session), 'session': session}, version)
+            
+            next_beat = time.time() + server.STREAM_HEARTBEAT
+            while not subscription.dropped:
+                if time.time() >= next_beat:
+                    if not server.verify_token(token):
+                        yield sse_event('revoked', {'error': 'Session expired, please log in again'})
+                        break
+                    server.touch_device(student_id)
+                    yield ': heartbeat\n\n'
+                    next_beat = time.time() + server.STREAM_HEARTBEAT
+                
+                try:
+                    message = subscription.get(timeout=max(0.0, next_beat - time.time()))
+                except queue.Empty:
+                    continue
+                
+                if message is None:
+                    break
+                
+                event, data, event_version = message
+                if event == 'status':
+                    # Classroom deltas only concern this student when they include them
+                    if event_version <= version or student_id not in data['students']:
+                        continue
+                    version = event_version
+                    data = server.student_view(student_id, data['students'][student_id], data['authorized_bssid'])
+                yield sse_event(event, data, event_version)
+        finally:
+            server.broadcaster.unsubscribe(classroom, subscription)
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs when the server closes the response, even if the generator never started
+    response.call_on_close(server.student_streams.release)
+    return response
 
 @app.route('/student/get_attendance', methods=['GET'])
 def student_get_attendance():
+    """The student's attendance history, newest last.
+    
+    Optional `from`/`to` (YYYY-MM-DD, inclusive) narrow it; `limit` pages it by date,
+    continued with `page_token`; `summary=1` returns present/total counts instead.
+    """
     student_id = request.args.get('student_id')
     device_id = request.args.get('device_id')
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    page_token = request.args.get('page_token')
+    limit = request.args.get('limit', type=int)
+    limit = max(1, limit) if limit else None
     
     if not all([student_id, device_id]):
         return jsonify({'error': 'Student ID and device ID are required'}), 400
     
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
-            return jsonify({'error': 'Student not found'}), 404
-        
-        if not server.db.fetch_one(
-            'SELECT 1 FROM active_devices WHERE student_id = %s AND device_id = %s',
-            (student_id, device_id)
-        ):
-            return jsonify({'error': 'Unauthorized device'}), 403
-        
-        # Update last activity
-        server.db.execute(
-            'UPDATE active_devices SET last_activity = %s WHERE student_id = %s',
-            (datetime.now().isoformat(), student_id),
-            commit=True
-        )
-        
-        student = server.db.fetch_one('SELECT attendance FROM students WHERE id = %s', (student_id,))
-        
-        return jsonify({
-            'attendance': json.loads(student['attendance']) if student['attendance'] else {}
-        }), 200
+    try:
+        for value in (date_from, date_to, page_token):
+            if value:
+                datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    
+    claims, error = authenticate_student(student_id, device_id)
+    if error:
+        return error
+    
+    # Update last activity
+    server.touch_device(student_id)
+    
+    student = server.db.fetch_one('SELECT attendance_version FROM students WHERE id = %s', (student_id,))
+    if not student:
+        return jsonify({'error': 'Student not found'}), 404
+    
+    # Each URL's result only changes when the history does
+    etag = f"a{student['attendance_version']}"
+    if etag_matches(etag):
+        response = Response(status=304)
+    elif flag_arg('summary'):
+        response = jsonify({'summary': server.get_attendance_summary(student_id, date_from, date_to)})
+    else:
+        attendance, next_page_token = server.get_attendance_page(student_id, date_from, date_to, page_token, limit)
+        response = jsonify({'attendance': attendance, 'next_page_token': next_page_token})
+    
+    # A 304 carries the same caching headers as the 200 it revalidates
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/student/get_active_session', methods=['GET'])
 def get_active_session():
@@ -1453,22 +3348,18 @@ def get_active_session():
     if not student_id or not classroom:
         return jsonify({'error': 'Student ID and classroom are required'}), 400
     
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
-            return jsonify({'error': 'Student not found'}), 404
-        
-        session = server.db.fetch_one(
-            'SELECT * FROM sessions WHERE classroom = %s AND end_time IS NULL',
-            (classroom,)
-        )
-        
-        if session:
-            return jsonify({
-                'active': True,
-                'session': dict(session)
-            }), 200
-        else:
-            return jsonify({'active': False}), 200
+    if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
+        return jsonify({'error': 'Student not found'}), 404
+    
+    session = server.get_active_session(classroom)
+    
+    if session:
+        return jsonify({
+            'active': True,
+            'session': session
+        }), 200
+    else:
+        return jsonify({'active': False}), 200
 
 @app.route('/student/get_timetable', methods=['GET'])
 def student_get_timetable():
@@ -1479,22 +3370,11 @@ def student_get_timetable():
     if not student_id or not branch or not semester:
         return jsonify({'error': 'Student ID, branch and semester are required'}), 400
     
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
-            return jsonify({'error': 'Student not found'}), 404        
-        timetable = server.db.fetch_one(
-            'SELECT timetable FROM timetables WHERE branch = %s AND semester = %s',
-            (branch, semester)
-        )
-        
-        if timetable:
-            return jsonify({
-                'timetable': json.loads(timetable['timetable'])
-            }), 200
-        else:
-            return jsonify({
-                'timetable': []
-            }), 200
+    if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
+        return jsonify({'error': 'Student not found'}), 404
+    
+    timetable, etag = server.get_timetable(branch, semester)
+    return conditional_response({'timetable': timetable}, etag)
 
 @app.route('/student/ping', methods=['POST'])
 def student_ping():
@@ -1505,23 +3385,13 @@ def student_ping():
     if not all([student_id, device_id]):
         return jsonify({'error': 'Student ID and device ID are required'}), 400
     
-    with server.lock:
-        if not server.db.fetch_one('SELECT 1 FROM students WHERE id = %s', (student_id,)):
-            return jsonify({'error': 'Student not found'}), 404
-        
-        if not server.db.fetch_one(
-            'SELECT 1 FROM active_devices WHERE student_id = %s AND device_id = %s',
-            (student_id, device_id)
-        ):
-            return jsonify({'error': 'Unauthorized device'}), 403
-        
-        server.db.execute(
-            'UPDATE active_devices SET last_activity = %s WHERE student_id = %s',
-            (datetime.now().isoformat(), student_id),
-            commit=True
-        )
-        
-        return jsonify({'message': 'Ping successful'}), 200
+    claims, error = authenticate_student(student_id, device_id)
+    if error:
+        return error
+    
+    server.touch_device(student_id)
+    
+    return jsonify({'message': 'Ping successful'}), 200
 
 @app.route('/student/cleanup_dead_sessions', methods=['POST'])
 def cleanup_dead_sessions():
@@ -1532,33 +3402,46 @@ def cleanup_dead_sessions():
     if not all([student_id, device_id]):
         return jsonify({'error': 'Student ID and device ID are required'}), 400
     
-    with server.lock:
-        # Only cleanup if the device matches
-        device = server.db.fetch_one(
-            'SELECT * FROM active_devices WHERE student_id = %s AND device_id = %s',
+    with server.db.transaction() as cursor:
+        # Only release the device slot if this device holds it
+        cursor.execute(
+            'DELETE FROM active_devices WHERE student_id = %s AND device_id = %s',
             (student_id, device_id)
         )
-        if device:
-            server.db.execute(
-                'DELETE FROM active_devices WHERE student_id = %s',
-                (student_id,),
-                commit=True
-            )
-        
-        server.db.execute(
-            'DELETE FROM checkins WHERE student_id = %s',
-            (student_id,),
-            commit=True
-        )
-        
-        server.db.execute(
-            'DELETE FROM timers WHERE student_id = %s',
-            (student_id,),
-            commit=True
-        )
+        released = cursor.rowcount > 0
+        cursor.execute('DELETE FROM checkins WHERE student_id = %s', (student_id,))
+        cursor.execute('DELETE FROM timers WHERE student_id = %s', (student_id,))
+    
+    if released:
+        server.revoke_tokens([student_id])
+    server.mark_status_changed([student_id])
     
     return jsonify({'message': 'Session cleanup completed'}), 200
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Attendance server')
+    parser.add_argument('--rebuild-counters', action='store_true',
+                        help='recompute attendance counters from the raw histories and exit')
+    args = parser.parse_args()
+    
+    if args.rebuild_counters:
+        rebuilt = server.rebuild_attendance_counters()
+        logger.info(f"Rebuilt attendance counters for {rebuilt} students")
+        print(f"Rebuilt attendance counters for {rebuilt} students")
+        server.shutdown()
+        raise SystemExit(0)
+    
+    # Development server; production runs asgi_server:app under gunicorn (see gunicorn.conf.py)
+    server.start()
     logger.info(f"Starting server on port {server.SERVER_PORT}")
-    app.run(host='0.0.0.0', port=server.SERVER_PORT)
+    http_server = make_server('0.0.0.0', server.SERVER_PORT, app, threaded=True)
+    
+    def handle_sigterm(signum, frame):
+        # serve_forever runs on this thread, so drain and stop it from another one
+        def stop():
+            server.shutdown()
+            http_server.shutdown()
+        threading.Thread(target=stop, daemon=True).start()
+    
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    http_server.serve_forever()
@@ -6,6 +6,7 @@ from datetime import datetime
 import hashlib
 import uuid
 import threading
+import queue
 import time
 import platform
 import subprocess
@@ -16,6 +17,8 @@ import os
 import atexit
 import json
 
+from api_client import ApiClient, cache_key, http, read_events
+
 class WiFiDetector:
     """Enhanced WiFi BSSID detection with multiple fallback methods"""
     
@@ -159,11 +162,15 @@ class WiFiDetector:
         pattern = r'^([0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}$'
         return bool(re.match(pattern, bssid))
 
-class StudentAuth:
+class StudentAuth(ApiClient):
+    timeout = 10
+    
     def __init__(self):
-        self.server_url = "https://deadball-4ua9.onrender.com"
+        super().__init__("https://deadball-4ua9.onrender.com")
         self.current_student = None
         self.device_id = str(uuid.uuid4())
+        self.session_token = None
+        self.attendance_cache = None  # (etag, attendance) of the last full history fetched
         self.classroom_bssid = None
         self.is_admin = self.check_admin_privileges()
         self.ping_thread = None
@@ -175,7 +182,7 @@ class StudentAuth:
         """Clean up server state when program exits"""
         if self.current_student:
             try:
-                requests.post(
+                http.post(
                     f"{self.server_url}/student/cleanup_dead_sessions",
                     json={
                         'student_id': self.current_student['id'],
@@ -198,6 +205,46 @@ class StudentAuth:
     def hash_password(self, password):
         return hashlib.sha256(password.encode()).hexdigest()
     
+    def auth_headers(self):
+        """Authorization header carrying the session token issued at login"""
+        if self.session_token:
+            return {'Authorization': f"Bearer {self.session_token}"}
+        return {}
+    
+    def load_dashboard_data(self):
+        """Status, attendance history and timetable for the dashboard in one round trip.
+        
+        Returns {'status', 'attendance', 'timetable'} holding whichever calls succeeded;
+        an empty dict if the batch itself failed, so the dashboard fetches them separately.
+        """
+        student = self.current_student
+        identity = {'student_id': student['id'], 'device_id': self.device_id}
+        try:
+            status, attendance, timetable = self.batch([
+                ('GET', '/student/get_status', identity),
+                ('GET', '/student/get_attendance', identity),
+                ('GET', '/student/get_timetable', {
+                    'student_id': student['id'],
+                    'branch': student['branch'],
+                    'semester': student['semester']
+                })
+            ])
+        except (requests.exceptions.RequestException, KeyError, ValueError):
+            return {}
+        
+        data = {}
+        if status[0] == 200:
+            data['status'] = status[1]
+        if attendance[0] == 200:
+            # Kept in the http cache too, but get_attendance revalidates through its own
+            key = cache_key('/student/get_attendance', identity)
+            if key in self.http_cache:
+                self.attendance_cache = (self.http_cache[key][0], attendance[1]['attendance'])
+            data['attendance'] = attendance[1]['attendance']
+        if timetable[0] == 200:
+            data['timetable'] = timetable[1]['timetable']
+        return data
+    
     def get_current_bssid(self):
         """Get current WiFi BSSID"""
         return WiFiDetector.get_current_bssid()
@@ -206,7 +253,7 @@ class StudentAuth:
         
         try:
             # Step 1: Login student
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/student/login",
                 json={
                     'id': student_id,
@@ -219,10 +266,11 @@ class StudentAuth:
             if response.status_code == 200:
                 data = response.json()
                 self.current_student = data['student']
+                self.session_token = data.get('session_token')
 
                 # Step 2: Try fetching expected BSSID by calling teacher login
                 try:
-                    teacher_login = requests.post(
+                    teacher_login = http.post(
                         f"{self.server_url}/teacher/login",
                         json={
                             'id': 'admin',         # Replace with any safe teacher ID
@@ -255,13 +303,14 @@ class StudentAuth:
         
     def check_in(self, bssid=None):
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/student/checkin",
                 json={
                     'student_id': self.current_student['id'],
                     'bssid': bssid,
                     'device_id': self.device_id
                 },
+                headers=self.auth_headers(),
                 timeout=10
             )
             
@@ -274,12 +323,13 @@ class StudentAuth:
     
     def start_timer(self):
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/student/timer/start",
                 json={
                     'student_id': self.current_student['id'],
                     'device_id': self.device_id
                 },
+                headers=self.auth_headers(),
                 timeout=10
             )
             
@@ -291,12 +341,13 @@ class StudentAuth:
     
     def stop_timer(self):
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/student/timer/stop",
                 json={
                     'student_id': self.current_student['id'],
                     'device_id': self.device_id
                 },
+                headers=self.auth_headers(),
                 timeout=10
             )
             
@@ -308,12 +359,13 @@ class StudentAuth:
     
     def get_status(self):
         try:
-            response = requests.get(
+            response = http.get(
                 f"{self.server_url}/student/get_status",
                 params={
                     'student_id': self.current_student['id'],
                     'device_id': self.device_id
                 },
+                headers=self.auth_headers(),
                 timeout=10
             )
             
@@ -324,48 +376,59 @@ class StudentAuth:
             return False, f"Connection error: {str(e)}"
     
     def get_attendance(self):
+        """Full attendance history, revalidated against the cached copy by ETag"""
         try:
-            response = requests.get(
+            headers = self.auth_headers()
+            if self.attendance_cache:
+                headers['If-None-Match'] = self.attendance_cache[0]
+            
+            response = http.get(
                 f"{self.server_url}/student/get_attendance",
                 params={
                     'student_id': self.current_student['id'],
                     'device_id': self.device_id
                 },
+                headers=headers,
                 timeout=10
             )
             
+            if response.status_code == 304:
+                return True, self.attendance_cache[1]
             if response.status_code == 200:
-                return True, response.json()['attendance']
+                attendance = response.json()['attendance']
+                if response.headers.get('ETag'):
+                    self.attendance_cache = (response.headers['ETag'], attendance)
+                return True, attendance
             return False, response.json().get('error', 'Failed to get attendance')
         except requests.exceptions.RequestException as e:
             return False, f"Connection error: {str(e)}"
     
     def get_timetable(self):
         try:
-            response = requests.get(
-                f"{self.server_url}/student/get_timetable",
+            status_code, data = self.cached_get(
+                "/student/get_timetable",
                 params={
                     'student_id': self.current_student['id'],
                     'branch': self.current_student['branch'],
                     'semester': self.current_student['semester']
-                },
-                timeout=10
+                }
             )
             
-            if response.status_code == 200:
-                return True, response.json()['timetable']
-            return False, response.json().get('error', 'Failed to get timetable')
+            if status_code == 200:
+                return True, data['timetable']
+            return False, data.get('error', 'Failed to get timetable')
         except requests.exceptions.RequestException as e:
             return False, f"Connection error: {str(e)}"
     
     def send_ping(self):
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/student/ping",
                 json={
                     'student_id': self.current_student['id'],
                     'device_id': self.device_id
                 },
+                headers=self.auth_headers(),
                 timeout=10
             )
             
@@ -375,6 +438,19 @@ class StudentAuth:
         except requests.exceptions.RequestException as e:
             return False, f"Connection error: {str(e)}"
 
+    def open_stream(self):
+        """Open the live status stream; the caller reads it with read_events()"""
+        return http.get(
+            f"{self.server_url}/student/stream",
+            params={
+                'student_id': self.current_student['id'],
+                'device_id': self.device_id
+            },
+            headers=self.auth_headers(),
+            stream=True,
+            timeout=(10, 60)  # Heartbeats arrive well within the read timeout
+        )
+    
 class LoginWindow:
     def __init__(self, auth_system):
         self.auth = auth_system
@@ -513,8 +589,14 @@ class StudentDashboard:
     def __init__(self, auth_system):
         self.auth = auth_system
         self.current_status = None
+        self.shown_attendance = None
+        self.status_received_at = time.time()
         self.timer_running = False
         self.auto_refresh_active = True
+        self.stream_events = queue.Queue()  # Filled by the stream thread, drained on the Tk thread
+        self.stream_connected = False
+        # One batched fetch for the first paint; each entry is used once
+        self.prefetched = self.auth.load_dashboard_data()
         
         self.root = tk.Tk()
         self.root.title(f"Dashboard - {self.auth.current_student['name']}")
@@ -524,7 +606,8 @@ class StudentDashboard:
         self.setup_ui()
         self.update_status()
         self.auto_refresh()
-        self.start_ping_thread()
+        self.start_stream_thread()
+        self.process_stream_events()
         
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
     
@@ -629,6 +712,10 @@ class StudentDashboard:
         self.time_remaining_label = ttk.Label(timer_grid, text="00:00")
         self.time_remaining_label.grid(row=1, column=1, sticky='w', pady=(5, 0))
         
+        ttk.Label(timer_grid, text="Session:", font=('Segoe UI', 10, 'bold')).grid(row=2, column=0, sticky='e', padx=(0, 10), pady=(5, 0))
+        self.session_status_label = ttk.Label(timer_grid, text="Unknown", foreground="gray")
+        self.session_status_label.grid(row=2, column=1, sticky='w', pady=(5, 0))
+        
         # Action buttons
         btn_frame = ttk.Frame(status_frame)
         btn_frame.pack(fill=tk.X, pady=(10, 0))
@@ -811,12 +898,16 @@ class StudentDashboard:
         self.root.config(cursor="watch")
         self.root.update()
         
-        success, status_data = self.auth.get_status()
+        if 'status' in self.prefetched:
+            success, status_data = True, self.prefetched.pop('status')
+        else:
+            success, status_data = self.auth.get_status()
         
         self.root.config(cursor="")
         
         if success:
             self.current_status = status_data
+            self.status_received_at = time.time()
             self.update_status_display()
         else:
             self.conn_status.config(text="Connection failed", foreground="red")
@@ -854,11 +945,18 @@ class StudentDashboard:
         
         self.wifi_status.config(text=wifi_text, foreground=wifi_color)
         
-        # Timer status
+        self.update_timer_display()
+    
+    def update_timer_display(self):
+        if not self.current_status:
+            return
+        
+        # Timer status, counted down locally between updates
         timer = self.current_status.get('timer', {})
         if timer.get('status') == 'running':
             self.timer_status_label.config(text="Running", foreground="green")
-            remaining = int(timer.get('remaining', 0))
+            elapsed = time.time() - self.status_received_at
+            remaining = max(0, int(timer.get('remaining', 0) - elapsed))
             mins, secs = divmod(remaining, 60)
             self.time_remaining_label.config(text=f"{mins:02d}:{secs:02d}", foreground="green")
             
@@ -872,9 +970,14 @@ class StudentDashboard:
             self.stop_timer_btn.config(state='disabled')
     
     def load_attendance_data(self):
-        success, attendance_data = self.auth.get_attendance()
+        if 'attendance' in self.prefetched:
+            success, attendance_data = True, self.prefetched.pop('attendance')
+        else:
+            success, attendance_data = self.auth.get_attendance()
         
-        if success:
+        # A 304 hands back the same history object; the tree already shows it
+        if success and attendance_data is not self.shown_attendance:
+            self.shown_attendance = attendance_data
             for item in self.attendance_tree.get_children():
                 self.attendance_tree.delete(item)
             
@@ -888,7 +991,10 @@ class StudentDashboard:
                     ))
     
     def load_timetable_data(self):
-        success, timetable_data = self.auth.get_timetable()
+        if 'timetable' in self.prefetched:
+            success, timetable_data = True, self.prefetched.pop('timetable')
+        else:
+            success, timetable_data = self.auth.get_timetable()
         
         if success:
             for item in self.timetable_tree.get_children():
@@ -898,22 +1004,94 @@ class StudentDashboard:
                 self.timetable_tree.insert("", "end", values=slot)
     
     def auto_refresh(self):
-        if self.auto_refresh_active:
+        if not self.auto_refresh_active:
+            return
+        
+        if self.stream_connected:
+            # Updates are pushed; only tick the countdown
+            self.update_timer_display()
+            self.root.after(1000, self.auto_refresh)
+        else:
             self.update_status()
             self.root.after(10000, self.auto_refresh)  # Refresh every 10 seconds
     
-    def start_ping_thread(self):
-        def ping_loop():
+    def start_stream_thread(self):
+        """Keep one live connection open; it also serves as the liveness heartbeat.
+        
+        While it is down, fall back to pinging every 30 seconds and polling.
+        """
+        def stream_loop():
+            last_ping = 0
+            streaming = True
+            retry_stream_at = 0
             while self.auth.running:
-                try:
-                    self.auth.send_ping()
-                except:
-                    pass
-                time.sleep(30)  # Ping every 30 seconds
-        
-        self.auth.ping_thread = threading.Thread(target=ping_loop, daemon=True)
+                if streaming and time.time() >= retry_stream_at:
+                    try:
+                        with self.auth.open_stream() as response:
+                            if response.status_code == 200:
+                                self.stream_events.put(('connected', None))
+                                for event, data, _ in read_events(response):
+                                    if not self.auth.running:
+                                        break
+                                    self.stream_events.put((event, data))
+                                    if event == 'revoked':
+                                        streaming = False
+                            elif response.status_code == 401:
+                                # No usable session token; stay on the polling fallback
+                                streaming = False
+                                self.stream_events.put(('revoked', None))
+                            elif response.status_code == 503:
+                                # Server is at its stream limit; poll until it says to retry
+                                retry_stream_at = time.time() + float(response.headers.get('Retry-After', 60))
+                    except (requests.exceptions.RequestException, ValueError):
+                        pass
+                    
+                    self.stream_events.put(('disconnected', None))
+                
+                if time.time() - last_ping >= 30:
+                    try:
+                        self.auth.send_ping()
+                    except:
+                        pass
+                    last_ping = time.time()
+                time.sleep(5)
+        
+        self.auth.ping_thread = threading.Thread(target=stream_loop, daemon=True)
         self.auth.ping_thread.start()
     
+    def process_stream_events(self):
+        """Apply streamed events on the Tk thread"""
+        try:
+            while True:
+                self.handle_stream_event(*self.stream_events.get_nowait())
+        except queue.Empty:
+            pass
+        
+        if self.auto_refresh_active:
+            self.root.after(200, self.process_stream_events)
+    
+    def handle_stream_event(self, event, data):
+        if event == 'connected':
+            self.stream_connected = True
+        elif event == 'disconnected':
+            self.stream_connected = False
+        elif event == 'status':
+            self.current_status = data
+            self.status_received_at = time.time()
+            self.timer_running = data['timer']['status'] == 'running'
+            self.update_status_display()
+        elif event == 'session':
+            session = data['session']
+            if session:
+                self.session_status_label.config(text=f"{session['subject']} (Active)", foreground="green")
+            else:
+                self.session_status_label.config(text="No active session", foreground="gray")
+                # Attendance is recorded when a session ends
+                self.load_attendance_data()
+        elif event == 'revoked':
+            self.stream_connected = False
+            self.conn_status.config(text="Session expired, please log in again", foreground="red")
+    
     def run(self):
         # Center window
         self.root.update_idletasks()
@@ -5,11 +5,15 @@ import random
 from datetime import datetime, time, timedelta
 import hashlib
 import uuid
+import threading
+import queue
 from tkinter import font as tkfont
 
-class TeacherAuth:
+from api_client import ApiClient, http, read_events
+
+class TeacherAuth(ApiClient):
     def __init__(self):
-        self.server_url = "https://deadball-4ua9.onrender.com"  # Update with your server URL
+        super().__init__("https://deadball-4ua9.onrender.com")  # Update with your server URL
         self.current_teacher = None
     
     def hash_password(self, password):
@@ -19,7 +23,7 @@ class TeacherAuth:
     def teacher_signup(self, teacher_id, password, email, name):
         """Register a new teacher"""
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/signup",
                 json={
                     'id': teacher_id,
@@ -39,7 +43,7 @@ class TeacherAuth:
     def teacher_login(self, teacher_id, password):
         """Authenticate teacher"""
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/login",
                 json={
                     'id': teacher_id,
@@ -58,7 +62,7 @@ class TeacherAuth:
     def register_student(self, student_id, password, name, classroom, branch, semester):
         """Register a new student"""
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/register_student",
                 json={
                     'id': student_id,
@@ -77,35 +81,78 @@ class TeacherAuth:
         except requests.exceptions.RequestException:
             return False, "Could not connect to server"
     
-    def get_students(self, classroom=None, branch=None, semester=None):
-        """Get list of students with optional filters"""
+    def get_students(self, classroom=None, branch=None, semester=None, student_id=None, fields=None, first_page=None):
+        """Get list of students with optional filters, following pages until the last.
+        
+        `fields` limits the returned columns; the server leaves out attendance unless asked.
+        `first_page` is an already fetched first response for the same filters.
+        """
         try:
             params = {}
+            if student_id:
+                params['id'] = student_id
             if classroom:
                 params['classroom'] = classroom
             if branch:
                 params['branch'] = branch
             if semester:
                 params['semester'] = semester
+            if fields:
+                params['fields'] = ','.join(fields)
+            
+            students = []
+            if first_page:
+                students.extend(first_page['students'])
+                if not first_page.get('next_cursor'):
+                    return students
+                params['cursor'] = first_page['next_cursor']
+            
+            while True:
+                response = http.get(
+                    f"{self.server_url}/teacher/get_students",
+                    params=params
+                )
                 
-            response = requests.get(
-                f"{self.server_url}/teacher/get_students",
+                if response.status_code != 200:
+                    print(f"Error getting students: {response.json().get('error')}")
+                    return []
+                
+                data = response.json()
+                students.extend(data['students'])
+                if not data.get('next_cursor'):
+                    return students
+                params['cursor'] = data['next_cursor']
+        except requests.exceptions.RequestException as e:
+            print(f"Error getting students: {e}")
+            return []
+    
+    def get_attendance_counters(self, student_id=None, classroom=None):
+        """Present/total counters kept by the server, keyed by student ID"""
+        try:
+            params = {}
+            if student_id:
+                params['student_id'] = student_id
+            if classroom:
+                params['classroom'] = classroom
+            
+            response = http.get(
+                f"{self.server_url}/teacher/get_attendance_counters",
                 params=params
             )
             
             if response.status_code == 200:
-                return response.json()['students']
+                return response.json()['counters']
             else:
-                print(f"Error getting students: {response.json().get('error')}")
-                return []
+                print(f"Error getting attendance counters: {response.json().get('error')}")
+                return {}
         except requests.exceptions.RequestException as e:
-            print(f"Error getting students: {e}")
-            return []
+            print(f"Error getting attendance counters: {e}")
+            return {}
     
     def update_student(self, student_id, new_data):
         """Update student information"""
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/update_student",
                 json={
                     'id': student_id,
@@ -123,7 +170,7 @@ class TeacherAuth:
     def delete_student(self, student_id):
         """Delete a student"""
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/delete_student",
                 json={
                     'id': student_id
@@ -140,7 +187,7 @@ class TeacherAuth:
     def update_teacher_profile(self, teacher_id, new_data):
         """Update teacher profile information"""
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/update_profile",
                 json={
                     'id': teacher_id,
@@ -161,7 +208,7 @@ class TeacherAuth:
     def change_teacher_password(self, teacher_id, old_password, new_password):
         """Change teacher password"""
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/change_password",
                 json={
                     'id': teacher_id,
@@ -183,7 +230,7 @@ class TeacherAuth:
     def update_bssid_mapping(self, teacher_id, classroom, bssid):
         """Update BSSID mapping for a classroom"""
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/update_bssid",
                 json={
                     'teacher_id': teacher_id,
@@ -210,25 +257,25 @@ class TeacherAuth:
     def get_timetable(self, branch, semester):
         """Get timetable for branch and semester"""
         try:
-            response = requests.get(
-                f"{self.server_url}/teacher/get_timetable",
+            status_code, data = self.cached_get(
+                "/teacher/get_timetable",
                 params={
                     'branch': branch,
                     'semester': semester
                 }
             )
             
-            if response.status_code == 200:
-                return True, response.json()['timetable']
+            if status_code == 200:
+                return True, data['timetable']
             else:
-                return False, response.json().get('error', 'Failed to get timetable')
+                return False, data.get('error', 'Failed to get timetable')
         except requests.exceptions.RequestException:
             return False, "Could not connect to server"
     
     def update_timetable(self, branch, semester, timetable):
         """Update timetable for branch and semester"""
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/update_timetable",
                 json={
                     'branch': branch,
@@ -247,21 +294,34 @@ class TeacherAuth:
     def get_special_dates(self):
         """Get special dates (holidays and special schedules)"""
         try:
-            response = requests.get(
-                f"{self.server_url}/teacher/get_special_dates"
+            status_code, data = self.cached_get("/teacher/get_special_dates")
+            
+            if status_code == 200:
+                return True, data
+            else:
+                return False, data.get('error', 'Failed to get special dates')
+        except requests.exceptions.RequestException:
+            return False, "Could not connect to server"
+    
+    def get_date_info(self, date):
+        """Holiday and special schedule entries for one date"""
+        try:
+            response = http.get(
+                f"{self.server_url}/teacher/get_date_info",
+                params={'date': date}
             )
             
             if response.status_code == 200:
                 return True, response.json()
             else:
-                return False, response.json().get('error', 'Failed to get special dates')
+                return False, response.json().get('error', 'Failed to get date info')
         except requests.exceptions.RequestException:
             return False, "Could not connect to server"
     
     def update_special_dates(self, holidays, special_dates):
         """Update special dates (holidays and special schedules)"""
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/update_special_dates",
                 json={
                     'holidays': holidays,
@@ -374,6 +434,13 @@ class TeacherDashboard:
         self.reminder_shown = False
         self.special_dates = {"holidays": [], "special_schedules": []}
         self.timetable_data = {"default": []}
+        self.status_view = None  # Last classroom status, kept current with deltas
+        self.status_received_at = {}  # When each student's timer was last reported
+        self.stream_events = queue.Queue()  # Filled by the stream thread, drained on the Tk thread
+        self.stream_classroom = None  # Classroom the live stream follows
+        self.stream_stop = None
+        self.stream_connected = False
+        self.prefetched = {}  # Startup responses from one /batch call, used once each
         
         # Load initial data
         self.load_initial_data()
@@ -426,25 +493,42 @@ class TeacherDashboard:
         )
         self.status_label.pack(side=tk.BOTTOM, fill=tk.X)
         
-        # Auto-refresh every 2 seconds
+        # Auto-refresh every 2 seconds, with live updates streamed in between
         self.update_dashboard()
         self.auto_refresh()
+        self.process_stream_events()
         
         # Show random ring reminder if not shown yet
         if not self.reminder_shown:
             self.show_random_ring_reminder()
     
     def load_initial_data(self):
-        """Load initial data from server"""
-        # Load special dates
-        success, data = self.auth.get_special_dates()
-        if success:
-            self.special_dates = data
+        """Load initial data from server in one batched round trip"""
+        try:
+            special_dates, students, status = self.auth.batch([
+                ('GET', '/teacher/get_special_dates', None),
+                ('GET', '/teacher/get_students', None),
+                ('GET', '/teacher/get_status', None)
+            ])
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            print(f"Batched startup failed, loading separately: {e}")
+            success, data = self.auth.get_special_dates()
+            if success:
+                self.special_dates = data
+            return
+        
+        if special_dates[0] == 200:
+            self.special_dates = special_dates[1]
+        # The tabs built next pick these up instead of fetching them again
+        if students[0] == 200:
+            self.prefetched['students'] = students[1]
+        if status[0] == 200:
+            self.prefetched['status'] = status[1]
     
     def manage_sessions(self):
         """Show a window to manage active sessions"""
         try:
-            response = requests.get(
+            response = http.get(
                 f"{self.server_url}/teacher/get_active_sessions",
                 params={'teacher_id': self.auth.current_teacher['id']}
             )
@@ -496,7 +580,7 @@ class TeacherDashboard:
                     session_id = tree.item(selected[0], 'values')[0]
                     
                     try:
-                        response = requests.post(
+                        response = http.post(
                             f"{self.server_url}/teacher/end_session",
                             json={'session_id': session_id}
                         )
@@ -1174,7 +1258,9 @@ class TeacherDashboard:
         
         # Check if today is a holiday
         today = datetime.now().strftime("%Y-%m-%d")
-        if any(h['date'] == today for h in self.special_dates["holidays"]):
+        success, date_info = self.auth.get_date_info(today)
+        is_holiday = date_info['holiday'] if success else any(h['date'] == today for h in self.special_dates["holidays"])
+        if is_holiday:
             if not messagebox.askyesno("Confirm", "Today is marked as a holiday. Start session anyway?"):
                 return
         
@@ -1209,7 +1295,7 @@ class TeacherDashboard:
                     return
                 
                 try:
-                    response = requests.post(
+                    response = http.post(
                         f"{self.server_url}/teacher/start_session",
                         json={
                             'teacher_id': self.auth.current_teacher['id'],
@@ -1254,7 +1340,7 @@ class TeacherDashboard:
             subject = matching_slots[0][0]
         
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/start_session",
                 json={
                     'teacher_id': self.auth.current_teacher['id'],
@@ -1295,7 +1381,7 @@ class TeacherDashboard:
             return
         
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/end_session",
                 json={
                     'session_id': self.current_session['id']
@@ -1327,7 +1413,7 @@ class TeacherDashboard:
             return
         
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/set_bssid",
                 json={"bssid": bssid}
             )
@@ -1480,7 +1566,10 @@ class TeacherDashboard:
         branch = self.student_branch_var.get()
         semester = self.student_semester_var.get()
         
-        students = self.auth.get_students(classroom=classroom, branch=branch, semester=semester)
+        first_page = None
+        if not (classroom or branch or semester):
+            first_page = self.prefetched.pop('students', None)
+        students = self.auth.get_students(classroom=classroom, branch=branch, semester=semester, first_page=first_page)
         
         # Clear existing items
         for item in self.student_tree.get_children():
@@ -1510,7 +1599,7 @@ class TeacherDashboard:
             return
             
         student_id = self.current_selected_student
-        students = self.auth.get_students()
+        students = self.auth.get_students(student_id=student_id)
         student = next((s for s in students if s['id'] == student_id), None)
         
         if not student:
@@ -1588,7 +1677,7 @@ class TeacherDashboard:
             return
             
         student_id = self.current_selected_student
-        students = self.auth.get_students()
+        students = self.auth.get_students(student_id=student_id, fields=('id', 'name', 'attendance'))
         student = next((s for s in students if s['id'] == student_id), None)
         
         if not student:
@@ -1628,31 +1717,84 @@ class TeacherDashboard:
             stats_frame = tk.Frame(attendance_window)
             stats_frame.pack(fill=tk.X, padx=10, pady=5)
 
-            if 'attendance' in student:
-                total_sessions = sum(len(sessions) for sessions in student['attendance'].values())
-                present_sessions = sum(1 for sessions in student['attendance'].values() 
-                                    for session in sessions.values() if session.get('status') == 'present')
-                attendance_percent = round((present_sessions / total_sessions) * 100 if total_sessions > 0 else 0, 2)
-                
-                tk.Label(stats_frame, text=f"Total Sessions: {total_sessions}").pack(side=tk.LEFT, padx=10)
-                tk.Label(stats_frame, text=f"Present: {present_sessions}").pack(side=tk.LEFT, padx=10)
-                tk.Label(stats_frame, text=f"Attendance Percentage: {attendance_percent}%").pack(side=tk.LEFT, padx=10)
+            counters = self.auth.get_attendance_counters(student_id=student_id).get(student_id)
+            if counters and counters['total']:
+                tk.Label(stats_frame, text=f"Total Sessions: {counters['total']}").pack(side=tk.LEFT, padx=10)
+                tk.Label(stats_frame, text=f"Present: {counters['present']}").pack(side=tk.LEFT, padx=10)
+                tk.Label(stats_frame, text=f"Attendance Percentage: {counters['percentage']}%").pack(side=tk.LEFT, padx=10)
             else:
                 tk.Label(stats_frame, text="No attendance records found").pack(side=tk.LEFT, padx=10)
     
     def update_dashboard(self):
+        params = {}
+        if self.current_classroom:
+            params['classroom'] = self.current_classroom
+            # Only ask for what changed since the view we already have
+            if self.status_view and self.status_view['classroom'] == self.current_classroom:
+                params['since'] = self.status_view['version']
+        
         try:
-            response = requests.get(
-                f"{self.server_url}/teacher/get_status",
-                params={'classroom': self.current_classroom} if self.current_classroom else {}
-            )
-            if response.status_code == 200:
-                data = response.json()
+            prefetched = self.prefetched.pop('status', None)
+            if prefetched and not params:
+                status_code, data = 200, prefetched
+            else:
+                response = http.get(
+                    f"{self.server_url}/teacher/get_status",
+                    params=params
+                )
+                status_code = response.status_code
+                data = response.json() if status_code == 200 else None
+            
+            if status_code == 200:
+                if not data.get('full', True) and data['authorized_bssid'] != self.status_view['authorized_bssid']:
+                    # Every student's authorization depends on it, so start over
+                    self.status_view = None
+                    return self.update_dashboard()
+                
+                data = self.apply_status_delta(data)
                 self.update_student_list(data)
                 self.update_attendance_records(data)
         except requests.exceptions.RequestException as e:
             print(f"Error updating dashboard: {e}")
     
+    def apply_status_delta(self, data):
+        """Merge a get_status response into the cached view and return it for display"""
+        now = datetime.now().timestamp()
+        
+        if data.get('full', True) or not self.status_view:
+            self.status_view = {'classroom': self.current_classroom, 'students': {}}
+            self.status_received_at = {}
+        
+        view = self.status_view
+        view['version'] = data.get('version')
+        view['authorized_bssid'] = data['authorized_bssid']
+        
+        for student_id in data.get('removed', []):
+            view['students'].pop(student_id, None)
+            self.status_received_at.pop(student_id, None)
+        
+        for student_id, student in data['students'].items():
+            view['students'][student_id] = student
+            self.status_received_at[student_id] = now
+        
+        return self.status_display()
+    
+    def status_display(self):
+        """The cached view with running timers counted down to now"""
+        now = datetime.now().timestamp()
+        view = self.status_view
+        
+        # Unchanged students are not resent, so count running timers down locally
+        students = {}
+        for student_id, student in view['students'].items():
+            timer = student['timer']
+            if timer['status'] == 'running':
+                elapsed = now - self.status_received_at.get(student_id, now)
+                student = dict(student, timer=dict(timer, remaining=max(0, timer['remaining'] - elapsed)))
+            students[student_id] = student
+        
+        return {'authorized_bssid': view['authorized_bssid'], 'students': students}
+    
     def update_attendance_records(self, data):
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         for student_id, student in data["students"].items():
@@ -1747,7 +1889,7 @@ class TeacherDashboard:
                 return
         
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/manual_override",
                 json={
                     'student_id': student_id,
@@ -1774,7 +1916,7 @@ class TeacherDashboard:
             return
             
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.server_url}/teacher/random_ring",
                 params={'classroom': self.current_classroom}
             )
@@ -1810,7 +1952,7 @@ class TeacherDashboard:
                 def punish_student1():
                     # Mark absent and deduct 1.5 lectures
                     try:
-                        response = requests.post(
+                        response = http.post(
                             f"{self.server_url}/teacher/manual_override",
                             json={
                                 'student_id': low_student['id'],
@@ -1824,7 +1966,7 @@ class TeacherDashboard:
                             punishment_key = f"PUNISHMENT_{uuid.uuid4().hex}"
 
                             # Get student data
-                            students = self.auth.get_students()
+                            students = self.auth.get_students(student_id=low_student['id'], fields=('id', 'attendance'))
                             student_index = next((i for i, s in enumerate(students) if s['id'] == low_student['id']), None)
                             
                             if student_index is not None:
@@ -1848,7 +1990,7 @@ class TeacherDashboard:
                                 
                                 # Save the changes
                                 try:
-                                    response = requests.post(
+                                    response = http.post(
                                         f"{self.server_url}/teacher/update_student",
                                         json={
                                             'id': low_student['id'],
@@ -1890,7 +2032,7 @@ class TeacherDashboard:
                 def punish_student2():
                     # Mark absent and deduct 1.5 lectures
                     try:
-                        response = requests.post(
+                        response = http.post(
                             f"{self.server_url}/teacher/manual_override",
                             json={
                                 'student_id': high_student['id'],
@@ -1904,7 +2046,7 @@ class TeacherDashboard:
                             punishment_key = f"PUNISHMENT_{uuid.uuid4().hex}"
                             
                             # Get student data
-                            students = self.auth.get_students()
+                            students = self.auth.get_students(student_id=high_student['id'], fields=('id', 'attendance'))
                             student_index = next((i for i, s in enumerate(students) if s['id'] == high_student['id']), None)
                             
                             if student_index is not None:
@@ -1928,7 +2070,7 @@ class TeacherDashboard:
                                 
                                 # Save the changes
                                 try:
-                                    response = requests.post(
+                                    response = http.post(
                                         f"{self.server_url}/teacher/update_student",
                                         json={
                                             'id': high_student['id'],
@@ -1988,7 +2130,7 @@ class TeacherDashboard:
             return
         
         # Get student data
-        students = self.auth.get_students()
+        students = self.auth.get_students(student_id=student_id, fields=('id', 'name', 'attendance'))
         student = next((s for s in students if s['id'] == student_id), None)
         
         if not student:
@@ -2134,8 +2276,111 @@ class TeacherDashboard:
         else:
             messagebox.showerror("Error", message)
     
+    def start_status_stream(self):
+        """Follow the current classroom over the server's event stream"""
+        if self.stream_stop:
+            self.stream_stop.set()
+        
+        self.stream_classroom = self.current_classroom
+        self.stream_connected = False
+        self.stream_stop = threading.Event()
+        
+        if self.current_classroom:
+            threading.Thread(
+                target=self.stream_status,
+                args=(self.current_classroom, self.stream_stop),
+                daemon=True
+            ).start()
+    
+    def stream_status(self, classroom, stop):
+        """Stream thread: read events and hand them to the Tk thread, reconnecting on failure"""
+        last_event_id = None
+        while not stop.is_set():
+            retry_after = 3
+            try:
+                headers = {'Last-Event-ID': last_event_id} if last_event_id else {}
+                response = http.get(
+                    f"{self.server_url}/teacher/status/stream",
+                    params={'classroom': classroom},
+                    headers=headers,
+                    stream=True,
+                    timeout=(10, 60)  # Heartbeats arrive well within the read timeout
+                )
+                with response:
+                    if response.status_code == 200:
+                        self.stream_events.put((classroom, 'connected', None))
+                        for event, data, event_id in read_events(response):
+                            if stop.is_set():
+                                break
+                            if event_id:
+                                last_event_id = event_id
+                            self.stream_events.put((classroom, event, data))
+                    elif response.status_code == 503:
+                        # The server has no stream to spare; keep polling until it asks for a retry
+                        retry_after = float(response.headers.get('Retry-After', 30))
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"Status stream error: {e}")
+            
+            self.stream_events.put((classroom, 'disconnected', None))
+            stop.wait(retry_after)
+    
+    def process_stream_events(self):
+        """Apply streamed events on the Tk thread"""
+        try:
+            while True:
+                self.handle_stream_event(*self.stream_events.get_nowait())
+        except queue.Empty:
+            pass
+        self.root.after(200, self.process_stream_events)
+    
+    def handle_stream_event(self, classroom, event, data):
+        if classroom != self.stream_classroom or classroom != self.current_classroom:
+            return
+        
+        if event in ('connected', 'disconnected'):
+            self.stream_connected = event == 'connected'
+        elif event == 'status':
+            view = self.status_view
+            if view and view['classroom'] == classroom and data['version'] <= (view['version'] or 0):
+                return  # Already seen through a poll
+            if not data['full'] and (not view or view['classroom'] != classroom or data['authorized_bssid'] != view['authorized_bssid']):
+                # Nothing to apply the delta to; fetch everything
+                self.status_view = None
+                self.update_dashboard()
+                return
+            
+            data = self.apply_status_delta(data)
+            self.update_student_list(data)
+            self.update_attendance_records(data)
+        elif event == 'session':
+            session = data['session']
+            if session and (not self.current_session or self.current_session['id'] != session['id']):
+                self.current_session = {
+                    "id": session['id'],
+                    "subject": session['subject'],
+                    "classroom": session['classroom'],
+                    "branch": session['branch'],
+                    "semester": session['semester'],
+                    "start_time": session['start_time'],
+                    "ad_hoc": bool(session['ad_hoc'])
+                }
+                self.session_label.config(text=f"Session: {session['subject']}", fg="green")
+            elif not session and self.current_session and self.current_session['classroom'] == classroom:
+                # Ended elsewhere (another dashboard or server-side cleanup)
+                self.current_session = None
+                self.session_label.config(text="No active session", fg="gray")
+    
     def auto_refresh(self):
-        self.update_dashboard()
+        if self.stream_classroom != self.current_classroom:
+            self.start_status_stream()
+        
+        if self.stream_connected and self.status_view and self.status_view['classroom'] == self.current_classroom:
+            # Changes arrive over the stream; just keep the timers ticking
+            data = self.status_display()
+            self.update_student_list(data)
+            self.update_attendance_records(data)
+        else:
+            self.update_dashboard()
         self.root.after(2000, self.auto_refresh)
     
     def run(self):
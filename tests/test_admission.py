@@ -0,0 +1,122 @@
+"""AdmissionController priority rules.
+
+Importing server connects to DATABASE_URL, so these run against a scratch database.
+"""
+import os
+import threading
+import time
+
+import pytest
+
+if not os.getenv('DATABASE_URL'):
+    pytest.skip('server.py connects to DATABASE_URL on import', allow_module_level=True)
+
+from server import AdmissionController, app, server
+
+
+def admission_class(priority, limit, queue=32, max_wait=2):
+    return {'priority': priority, 'limit': limit, 'queue': queue, 'max_wait': max_wait, 'retry_after': 1}
+
+
+def controller():
+    return AdmissionController(12, 4, {
+        'teacher': admission_class(0, 8),
+        'heartbeat': admission_class(0, 8),
+        'login': admission_class(1, 4, max_wait=1),
+    })
+
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def acquire_in_thread(admission, name, results):
+    thread = threading.Thread(target=lambda: results.append(admission.acquire(name)), daemon=True)
+    thread.start()
+    return thread
+
+
+def test_waiter_at_its_class_limit_does_not_block_lower_priority():
+    admission = controller()
+    for _ in range(8):
+        assert admission.acquire('heartbeat')
+
+    # A ninth heartbeat waits for a heartbeat slot; 4 slots of the total are still free
+    results = []
+    waiter = acquire_in_thread(admission, 'heartbeat', results)
+    wait_until(lambda: admission.waiting['heartbeat'] == 1)
+
+    started = time.monotonic()
+    assert admission.acquire('login')
+    assert time.monotonic() - started < 0.5
+
+    admission.release('heartbeat')
+    waiter.join(2)
+    assert results == [True]
+
+
+def test_waiter_for_total_capacity_goes_before_lower_priority():
+    admission = controller()
+    for _ in range(8):
+        assert admission.acquire('heartbeat')
+    for _ in range(4):
+        assert admission.acquire('teacher')
+
+    # The total is full: a teacher (under its own limit) and a login both wait
+    teacher_results, login_results = [], []
+    teacher = acquire_in_thread(admission, 'teacher', teacher_results)
+    wait_until(lambda: admission.waiting['teacher'] == 1)
+    login = acquire_in_thread(admission, 'login', login_results)
+    wait_until(lambda: admission.waiting['login'] == 1)
+
+    admission.release('heartbeat')
+    teacher.join(2)
+    assert teacher_results == [True]
+    assert admission.waiting['login'] == 1
+
+    admission.release('heartbeat')
+    login.join(3)
+    assert login_results == [False]  # Priority 1 may not use the last reserved slots
+
+
+def test_batch_is_admitted_as_its_lowest_priority_request():
+    before = dict(server.admission.admitted)
+    response = app.test_client().post('/batch', json={'requests': [
+        {'method': 'GET', 'path': '/teacher/get_special_dates'},
+        {'method': 'GET', 'path': '/teacher/get_sessions'}
+    ]})
+
+    assert response.status_code == 200
+    assert [sub['status'] for sub in response.get_json()['responses']] == [200, 200]
+    assert server.admission.admitted['analytics'] == before['analytics'] + 1
+    assert server.admission.admitted['teacher'] == before['teacher']
+    assert server.admission.admitted['default'] == before['default']
+
+
+def test_default_admission_fits_in_the_worker_threads():
+    # Every admitted or queued request holds a thread; the queues must fill before the threads run out
+    admission = server.admission
+    queued = sum(cls['queue'] for cls in admission.classes.values())
+    streams = server.STUDENT_STREAM_LIMIT + server.TEACHER_STREAM_LIMIT
+    assert admission.total + queued + streams <= server.WORKER_THREADS
+    assert all(cls['limit'] > 0 for cls in admission.classes.values())
+    assert admission.total - admission.reserved > 0  # Lowest priority can still run
+
+
+def test_teacher_streams_are_capped(monkeypatch):
+    monkeypatch.setattr(server, 'teacher_streams', threading.BoundedSemaphore(1))
+    client = app.test_client()
+
+    first = client.get('/teacher/status/stream', query_string={'classroom': 'A101'})
+    assert first.status_code == 200
+    refused = client.get('/teacher/status/stream', query_string={'classroom': 'A101'})
+    assert refused.status_code == 503
+    assert 30 <= int(refused.headers['Retry-After']) <= 60
+
+    first.close()  # Closing the stream frees its slot
+    second = client.get('/teacher/status/stream', query_string={'classroom': 'A101'})
+    assert second.status_code == 200
+    second.close()
@@ -0,0 +1,154 @@
+"""The ASGI student routes must answer exactly like the Flask ones they replace.
+
+Importing server connects to DATABASE_URL, so these run against a scratch database.
+"""
+import os
+import re
+
+import pytest
+
+if not os.getenv('DATABASE_URL'):
+    pytest.skip('server.py connects to DATABASE_URL on import', allow_module_level=True)
+pytest.importorskip('asyncpg')
+pytest.importorskip('httpx')
+
+from starlette.testclient import TestClient
+
+import asgi_server
+from server import app, server
+
+STUDENT = 'parity_s1'
+DEVICE = 'parity-device'
+CLASSROOM = 'A101'  # Mapped to a BSSID by the seeded admin account
+
+
+@pytest.fixture(scope='module')
+def clients():
+    # Started here, so the ASGI lifespan leaves shutdown to the process
+    if not server.started:
+        server.start()
+    server.db.execute(
+        'INSERT INTO students (id, password, name, classroom, branch, semester, attendance) '
+        "VALUES (%s, 'x', 'Parity Student', %s, 'CSE', 3, '{}') ON CONFLICT (id) DO NOTHING",
+        (STUDENT, CLASSROOM),
+        commit=True
+    )
+    server.db.execute(
+        'INSERT INTO active_devices (student_id, device_id, last_activity) VALUES (%s, %s, now()::text) '
+        'ON CONFLICT (student_id) DO UPDATE SET device_id = EXCLUDED.device_id',
+        (STUDENT, DEVICE),
+        commit=True
+    )
+    try:
+        with TestClient(asgi_server.app) as asgi_client:
+            yield app.test_client(), asgi_client
+    finally:
+        for table in ('timers', 'checkins', 'active_devices'):
+            server.db.execute(f'DELETE FROM {table} WHERE student_id = %s', (STUDENT,), commit=True)
+        server.db.execute('DELETE FROM students WHERE id = %s', (STUDENT,), commit=True)
+
+
+def reset_student():
+    server.db.execute('DELETE FROM timers WHERE student_id = %s', (STUDENT,), commit=True)
+    server.db.execute('DELETE FROM checkins WHERE student_id = %s', (STUDENT,), commit=True)
+
+
+def student_state():
+    return server.db.fetch_one(
+        'SELECT t.status AS timer_status, c.bssid, s.status_version FROM students s '
+        'LEFT JOIN timers t ON t.student_id = s.id '
+        'LEFT JOIN checkins c ON c.student_id = s.id '
+        'WHERE s.id = %s',
+        (STUDENT,)
+    )
+
+
+def call(client, method, path, params=None, json=None, headers=None):
+    """(status, body) from either the Flask test client or the ASGI one"""
+    if isinstance(client, TestClient):
+        response = client.request(method, path, params=params, json=json, headers=headers)
+        return response.status_code, response.json()
+    response = client.open(path, method=method, query_string=params, json=json, headers=headers)
+    return response.status_code, response.get_json()
+
+
+def test_shared_queries_are_renumbered():
+    for name in dir(asgi_server):
+        if name.endswith('_SQL'):
+            original = getattr(asgi_server.sync_server, name)
+            placeholders = re.findall(r'\$(\d+)', getattr(asgi_server, name))
+            assert '%s' not in getattr(asgi_server, name)
+            assert placeholders == [str(i) for i in range(1, original.count('%s') + 1)]
+
+
+@pytest.mark.parametrize('token', [None, 'valid', 'other-device', 'garbage'])
+@pytest.mark.parametrize('student_id, device_id', [
+    (STUDENT, DEVICE),
+    (STUDENT, 'unknown-device'),
+    ('parity_missing', DEVICE),
+    (STUDENT, None)
+])
+def test_get_status_and_ping_match(clients, token, student_id, device_id):
+    reset_student()
+    headers = {}
+    if token == 'valid':
+        headers['Authorization'] = f'Bearer {server.issue_token(STUDENT, DEVICE, CLASSROOM)}'
+    elif token == 'other-device':
+        headers['Authorization'] = f'Bearer {server.issue_token(STUDENT, "other", CLASSROOM)}'
+    elif token == 'garbage':
+        headers['Authorization'] = 'Bearer not-a-token'
+    identity = {key: value for key, value in (('student_id', student_id), ('device_id', device_id)) if value}
+
+    flask_result, asgi_result = [call(client, 'GET', '/student/get_status', params=identity, headers=headers)
+                                 for client in clients]
+    assert flask_result == asgi_result
+
+    flask_result, asgi_result = [call(client, 'POST', '/student/ping', json=identity, headers=headers)
+                                 for client in clients]
+    assert flask_result == asgi_result
+
+
+@pytest.mark.parametrize('bssid', ['00:11:22:33:44:55', 'ff:ff:ff:ff:ff:ff', None])
+@pytest.mark.parametrize('with_token', [True, False])
+def test_checkin_matches(clients, bssid, with_token):
+    headers = {}
+    if with_token:
+        headers['Authorization'] = f'Bearer {server.issue_token(STUDENT, DEVICE, CLASSROOM)}'
+    body = {'student_id': STUDENT, 'device_id': DEVICE, 'bssid': bssid}
+
+    # Run each side from the same starting state and compare responses and side effects
+    results = []
+    for client in clients:
+        reset_student()
+        version = student_state()['status_version']
+        response = call(client, 'POST', '/student/checkin', json=body, headers=headers)
+        state = student_state()
+        results.append((response, state['timer_status'], state['bssid'], state['status_version'] > version))
+
+    assert results[0] == results[1]
+    assert results[0][1] == ('running' if bssid == '00:11:22:33:44:55' else None)
+
+
+def test_async_routes_refuse_work_while_draining(clients, monkeypatch):
+    _, asgi_client = clients
+    monkeypatch.setattr(server, 'accepting', False)
+
+    response = asgi_client.post('/student/ping', json={'student_id': STUDENT, 'device_id': DEVICE})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+
+
+def test_async_routes_are_shed_by_admission(clients, monkeypatch):
+    _, asgi_client = clients
+    admission = server.admission
+    monkeypatch.setitem(admission.classes, 'heartbeat', dict(admission.classes['heartbeat'], queue=0))
+    held = [admission.acquire('heartbeat') for _ in range(admission.classes['heartbeat']['limit'])]
+    try:
+        response = asgi_client.post('/student/ping', json={'student_id': STUDENT, 'device_id': DEVICE})
+    finally:
+        for _ in held:
+            admission.release('heartbeat')
+
+    assert response.status_code == 503
+    assert 'Retry-After' in response.headers
+    assert admission.active['heartbeat'] == 0
@@ -0,0 +1,32 @@
+"""/batch request validation.
+
+Importing server connects to DATABASE_URL, so these run against a scratch database.
+"""
+import os
+
+import pytest
+
+if not os.getenv('DATABASE_URL'):
+    pytest.skip('server.py connects to DATABASE_URL on import', allow_module_level=True)
+
+from server import app
+
+
+@pytest.mark.parametrize('sub, error', [
+    (1, 'Each request must be an object'),
+    ('/teacher/get_special_dates', 'Each request must be an object'),
+    ({'path': 5}, 'method and path must be strings'),
+    ({'path': '/teacher/get_special_dates', 'method': ['GET']}, 'method and path must be strings'),
+    ({'path': '/teacher/get_special_dates', 'params': [1]}, 'params must be an object'),
+    ({'path': '/teacher/get_special_dates', 'headers': 'x'}, 'headers must be an object')
+])
+def test_malformed_sub_request_gets_a_400_entry(sub, error):
+    response = app.test_client().post('/batch', json={'requests': [
+        sub,
+        {'method': 'GET', 'path': '/teacher/get_special_dates'}
+    ]})
+
+    assert response.status_code == 200
+    first, second = response.get_json()['responses']
+    assert first == {'status': 400, 'body': {'error': error}, 'etag': None}
+    assert second['status'] == 200
@@ -0,0 +1,38 @@
+"""PasswordHasher recovery from dead worker processes.
+
+Importing server connects to DATABASE_URL, so these run against a scratch database.
+"""
+import multiprocessing
+import os
+import signal
+
+import pytest
+
+if not os.getenv('DATABASE_URL'):
+    pytest.skip('server.py connects to DATABASE_URL on import', allow_module_level=True)
+if 'fork' not in multiprocessing.get_all_start_methods():
+    pytest.skip('hash workers are threads without fork', allow_module_level=True)
+
+from server import PasswordHasher
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', 2, 4, 5)
+    hasher.start()
+    yield hasher
+    hasher.close()
+
+
+def test_dead_worker_is_replaced(hasher):
+    broken = hasher.pool
+    os.kill(next(iter(broken._processes)), signal.SIGKILL)
+
+    pwhash = hasher.hash('secret')
+    assert hasher.verify(pwhash, 'secret')
+    assert hasher.pool is not broken
+
+    # The replacement stays in use for later calls
+    replacement = hasher.pool
+    assert not hasher.verify(pwhash, 'wrong')
+    assert hasher.pool is replacement